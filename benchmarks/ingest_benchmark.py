@@ -0,0 +1,170 @@
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import duckdb
+
+# Add the parent directory to the Python path to import the loader
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.ingest import structured_loader
+
+DEFAULT_SCALES = [1_000_000, 10_000_000, 100_000_000]
+DEFAULT_SCHEMAS = ['narrow', 'wide']
+# 'parallel' is the native mode with a worker pool; the rest map to structured_loader ingest modes
+DEFAULT_MODES = ['native', 'parallel', 'chunked', 'pandas']
+DEFAULT_SHARDS = 8
+DEFAULT_WORKDIR = os.path.join(tempfile.gettempdir(), 'allyin_ingest_benchmark')
+WIDE_EXTRA_COLUMNS = 40
+
+def _schema_select(schema):
+    """Returns the SELECT list used to generate synthetic rows for a schema."""
+    columns = [
+        "range AS id",
+        "TIMESTAMP '2024-01-01' + to_seconds(range % 31536000) AS event_time",
+        "'category_' || (range % 97) AS category",
+        "round(random() * 1000, 2) AS amount"
+    ]
+    if schema == 'wide':
+        for i in range(WIDE_EXTRA_COLUMNS):
+            if i % 2:
+                columns.append(f"(hash(range + {i}) % 100000)::BIGINT AS metric_{i}")
+            else:
+                columns.append(f"'value_' || ((range * {i + 3}) % 10007) AS attribute_{i}")
+    return ', '.join(columns)
+
+def generate_dataset(workdir, rows, schema, shards=DEFAULT_SHARDS):
+    """Writes a synthetic CSV dataset split into shards (reused if it already exists) and returns its directory."""
+    dataset_dir = os.path.join(workdir, f"{schema}_{rows}")
+    done_marker = os.path.join(dataset_dir, '.complete')
+    if os.path.exists(done_marker):
+        return dataset_dir
+    shutil.rmtree(dataset_dir, ignore_errors=True)
+    os.makedirs(dataset_dir)
+    con = duckdb.connect(database=':memory:')
+    rows_per_shard = -(-rows // shards)
+    for shard in range(shards):
+        start = shard * rows_per_shard
+        stop = min(rows, start + rows_per_shard)
+        if start >= stop:
+            break
+        shard_path = os.path.join(dataset_dir, f"{schema}_part{shard:03d}.csv")
+        con.execute(
+            f"COPY (SELECT {_schema_select(schema)} FROM range({start}, {stop})) "
+            f"TO '{shard_path}' (HEADER, DELIMITER ',')"
+        )
+    con.close()
+    open(done_marker, 'w').close()
+    print(f"Generated {rows} {schema} rows in {dataset_dir}", file=sys.stderr)
+    return dataset_dir
+
+def _peak_rss_mb():
+    """Returns this process's peak resident set size in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def _run_mode(dataset_dir, db_path, mode, workers, results):
+    """Runs one ingest in a fresh process so peak RSS belongs to that mode alone.
+
+    Only the ingest step is timed: the database is written in place, with default table
+    options, and without statistics, summary tables or Parquet exports.
+    """
+    # Keep stdout clean for the JSON results
+    sys.stdout = sys.stderr
+    loader_mode = 'native' if mode == 'parallel' else mode
+    con = duckdb.connect(database=db_path)
+    structured_loader.ensure_manifest(con)
+    source_files = sorted(
+        os.path.join(dataset_dir, name) for name in os.listdir(dataset_dir) if structured_loader.source_format(name)
+    )
+    items = [
+        structured_loader.check_for_changes({}, path, structured_loader.source_table_name(path), incremental=False)
+        for path in source_files
+    ]
+    start = time.perf_counter()
+    report = structured_loader.load_items(con, items, loader_mode, workers if mode == 'parallel' else 1)
+    elapsed = time.perf_counter() - start
+    con.close()
+    failed = [entry['file'] for entry in report if entry['status'] != 'loaded']
+    results.put({
+        'seconds': elapsed,
+        'rows_loaded': sum(entry['rows'] or 0 for entry in report),
+        'failed_files': failed,
+        'peak_rss_mb': _peak_rss_mb()
+    })
+
+def run_benchmark(dataset_dir, rows, schema, mode, workers, workdir):
+    """Benchmarks one ingest mode against one dataset and returns a result record."""
+    db_path = os.path.join(workdir, f"bench_{schema}_{rows}_{mode}.duckdb")
+    for path in (db_path, db_path + '.wal'):
+        if os.path.exists(path):
+            os.remove(path)
+    input_bytes = sum(
+        os.path.getsize(os.path.join(dataset_dir, name)) for name in os.listdir(dataset_dir) if name.endswith('.csv')
+    )
+    record = {'schema': schema, 'rows': rows, 'mode': mode, 'workers': workers if mode == 'parallel' else 1,
+              'input_bytes': input_bytes, 'status': 'error'}
+
+    # Spawned (not forked) so the child starts without the parent's memory
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=_run_mode, args=(dataset_dir, db_path, mode, workers, results))
+    process.start()
+    process.join()
+    if process.exitcode != 0 or results.empty():
+        record['error'] = f"ingest process exited with code {process.exitcode}"
+    else:
+        outcome = results.get()
+        record.update(outcome)
+        record['status'] = 'ok' if not outcome['failed_files'] else 'partial'
+        record['rows_per_sec'] = outcome['rows_loaded'] / outcome['seconds'] if outcome['seconds'] else None
+        record['mb_per_sec'] = input_bytes / (1024 * 1024) / outcome['seconds'] if outcome['seconds'] else None
+
+    for path in (db_path, db_path + '.wal'):
+        if os.path.exists(path):
+            os.remove(path)
+    return record
+
+def main(argv=None):
+    """Generates synthetic datasets, runs every ingest mode against them and prints JSON results."""
+    parser = argparse.ArgumentParser(description="Benchmark structured_loader ingest modes on synthetic CSVs.")
+    parser.add_argument('--scales', type=int, nargs='+', default=DEFAULT_SCALES, help="Row counts to generate")
+    parser.add_argument('--schemas', nargs='+', choices=DEFAULT_SCHEMAS, default=DEFAULT_SCHEMAS)
+    parser.add_argument('--modes', nargs='+', choices=DEFAULT_MODES, default=DEFAULT_MODES)
+    parser.add_argument('--workers', type=int, default=max(2, os.cpu_count() or 4), help="Workers for the parallel mode")
+    parser.add_argument('--shards', type=int, default=DEFAULT_SHARDS, help="CSV files per dataset")
+    parser.add_argument('--workdir', default=DEFAULT_WORKDIR, help="Where datasets and scratch databases live")
+    parser.add_argument('--output', help="Write the JSON results to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.workdir, exist_ok=True)
+    results = []
+    for schema in args.schemas:
+        for rows in args.scales:
+            dataset_dir = generate_dataset(args.workdir, rows, schema, args.shards)
+            for mode in args.modes:
+                print(f"Running {mode} on {schema} x {rows} rows...", file=sys.stderr)
+                results.append(run_benchmark(dataset_dir, rows, schema, mode, args.workers, args.workdir))
+
+    output = {
+        'generated_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'cpu_count': os.cpu_count(),
+        'duckdb_version': duckdb.__version__,
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(output, f, indent=2)
+        print(f"Wrote benchmark results to {args.output}", file=sys.stderr)
+    else:
+        print(json.dumps(output, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,7 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '.
 from src.retrievers import sql_retriever
 from src.retrievers import vector_retriever
 from src.retrievers import graph_retriever
+from src.tools import result_formatter
 
 import datetime
 
@@ -19,16 +20,70 @@ def log_tool_usage(tool_name, query, result):
     # with open('tool_usage.log', 'a') as f:
     #     f.write(log_entry)
 
+# Rows per page of a SQL answer: few enough that every row of the page fits the formatter's budget,
+# so paging through the answer shows every row of the result
+SQL_PAGE_SIZE = result_formatter.DEFAULT_HEAD_ROWS + result_formatter.DEFAULT_TAIL_ROWS
+
+def format_sql_page(sql_page, handle=None):
+    """Renders one page of SQL results within a fixed character budget, saying which rows are shown.
+
+    Every row of the page is rendered (columns are dropped first if the budget requires it), so
+    no row is skipped between pages. The cost does not depend on how many rows or columns the
+    result has; handle names the full result in result_formatter's store.
+    """
+    rows = sql_page['rows']
+    if rows.empty:
+        return "No rows returned." if sql_page['offset'] == 0 else "No more rows."
+    return result_formatter.format_result(
+        rows, head_rows=len(rows), tail_rows=0, total_rows=sql_page['total_rows'],
+        total_is_estimate=sql_page['total_is_estimate'], row_offset=sql_page['offset'], handle=handle
+    )
+
+def load_full_result(sql_query, timeout=sql_retriever.DEFAULT_QUERY_TIMEOUT):
+    """Fetches the first result_formatter.FULL_RESULT_MAX_ROWS rows of a SQL answer, or None on failure."""
+    full_page = sql_retriever.get_sql_page(
+        sql_query, page_size=result_formatter.FULL_RESULT_MAX_ROWS, exact_total=False, timeout=timeout
+    )
+    return full_page['rows'] if full_page['status'] == 'ok' else None
+
 # Simple agent logic to choose a tool
-def run_agent(query):
-    """Runs the agent to process a query using available tools."""
+def run_agent(query, page=0, page_size=SQL_PAGE_SIZE, return_page_info=False,
+              query_id=None, timeout=sql_retriever.DEFAULT_QUERY_TIMEOUT):
+    """Runs the agent to process a query using available tools.
+
+    SQL results are paginated: page selects which page_size rows are returned. With
+    return_page_info=True a (result, page_info) tuple is returned, where page_info describes
+    the SQL page (None for other tools). SQL queries are stopped after timeout seconds, or
+    earlier by sql_retriever.cancel_query(query_id).
+    """
     chosen_tool = None
     result = ""
+    page_info = None
 
     # Simple keyword-based tool selection
     query_lower = query.lower()
 
-    if any(keyword in query_lower for keyword in ['sql', 'database', 'table']):
+    if query_lower.startswith('stats:') or query_lower.startswith('schema:'):
+        chosen_tool = 'sql_stats'
+        print(f"Agent chose {chosen_tool}")
+        # Answered from the statistics catalog collected at ingest time, without scanning tables
+        table_name = query.split(':', 1)[1].strip() or None
+        stats_df = sql_retriever.get_table_stats(table_name)
+        if stats_df is None or stats_df.empty:
+            result = f"No statistics available for {table_name or 'any table'}. Run structured_loader.py first."
+        else:
+            lines = []
+            for name, table_stats in stats_df.groupby('table_name'):
+                lines.append(f"Table {name}: {table_stats['row_count'].iloc[0]} rows, {len(table_stats)} columns")
+                for _, column in table_stats.iterrows():
+                    lines.append(
+                        f"  {column['column_name']} ({column['column_type']}): "
+                        f"nulls {column['null_fraction']:.1%}, min {column['min_value']}, max {column['max_value']}, "
+                        f"~{column['approx_distinct']} distinct, top {column['top_values']}"
+                    )
+            result = "\n".join(lines)
+
+    elif any(keyword in query_lower for keyword in ['sql', 'database', 'table']):
         chosen_tool = 'sql_retriever'
         print(f"Agent chose {chosen_tool}")
         # Assuming the query for SQL retriever is the SQL query itself
@@ -36,10 +91,33 @@ def run_agent(query):
         if not sql_query:
              result = "Please provide a SQL query after 'sql:'."
              log_tool_usage(chosen_tool, query, result)
-             return result
-        sql_result_df = sql_retriever.get_sql_data(sql_query)
-        if sql_result_df is not None:
-            result = sql_result_df.to_string()
+             return (result, page_info) if return_page_info else result
+        # Only the requested page is fetched and rendered, however large the full result is
+        page_token = sql_retriever.encode_page_token(sql_query, page * page_size, page_size) if page else None
+        try:
+            sql_page = sql_retriever.get_sql_page(
+                sql_query, page_token=page_token, page_size=page_size, timeout=timeout, query_id=query_id
+            )
+        except ValueError as e:
+            sql_page = None
+            print(f"Invalid SQL page request: {e}")
+        if sql_page is not None and sql_page['status'] == 'timeout':
+            result = f"SQL query timed out after {timeout}s and was stopped. Try a more selective query."
+        elif sql_page is not None and sql_page['status'] == 'cancelled':
+            result = "SQL query was cancelled."
+        elif sql_page is not None and sql_page['status'] == 'ok':
+            # The full result is only fetched if someone asks for it by handle, and then only its first rows
+            handle = result_formatter.store_result(loader=lambda: load_full_result(sql_query, timeout))
+            result = format_sql_page(sql_page, handle)
+            page_info = {
+                'result_handle': handle,
+                'page': page,
+                'page_size': page_size,
+                'total_rows': sql_page['total_rows'],
+                'total_is_estimate': sql_page['total_is_estimate'],
+                'has_next': sql_page['next_page_token'] is not None,
+                'has_prev': sql_page['prev_page_token'] is not None
+            }
         else:
             result = "Could not retrieve data using SQL."
 
@@ -51,13 +129,15 @@ def run_agent(query):
         if not vector_query:
              result = "Please provide a search query after 'vector search:'."
              log_tool_usage(chosen_tool, query, result)
-             return result
+             return (result, page_info) if return_page_info else result
         vector_results = vector_retriever.get_vector_retriever(vector_query)
         if vector_results:
             # Format vector search results for output
             formatted_output = []
             for res in vector_results:
-                formatted_output.append(f"  Distance: {res.get('distance', 'N/A'):.4f}, Filename: {res.get('metadata', {}).get('filename', 'N/A')}, Snippet: {res.get('metadata', {}).get('text_snippet', 'N/A')}")
+                page_number = res.get('metadata', {}).get('page_number')
+                page_suffix = f", Page: {page_number}" if page_number is not None else ""
+                formatted_output.append(f"  Distance: {res.get('distance', 'N/A'):.4f}, Filename: {res.get('metadata', {}).get('filename', 'N/A')}{page_suffix}, Snippet: {res.get('metadata', {}).get('text_snippet', 'N/A')}")
             result = "Vector Search Results:\n" + "\n".join(formatted_output)
         else:
             result = "No vector search results found."
@@ -70,20 +150,22 @@ def run_agent(query):
         if not graph_query:
              result = "Please provide a graph query (e.g., node name) after 'graph:'."
              log_tool_usage(chosen_tool, query, result)
-             return result
+             return (result, page_info) if return_page_info else result
         # The graph_retriever.get_graph_data now handles parsing specific commands
         sample_graph = graph_retriever.create_sample_graph() # Re-create sample graph for simplicity
         graph_results = graph_retriever.get_graph_data(graph_query, sample_graph)
         result = "\n".join(graph_results)
 
     else:
-        result = "Could not determine the appropriate tool for the query. Please include keywords like 'sql:', 'vector search:', or 'graph:'."
+        result = "Could not determine the appropriate tool for the query. Please include keywords like 'sql:', 'stats:', 'vector search:', or 'graph:'."
         chosen_tool = 'None'
 
     # Log tool usage if a tool was chosen
     if chosen_tool and chosen_tool != 'None':
          log_tool_usage(chosen_tool, query, result)
 
+    if return_page_info:
+        return result, page_info
     return result
 
 if __name__ == "__main__":
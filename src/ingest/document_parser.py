@@ -3,7 +3,11 @@ import email
 import os
 import json
 import glob
+import hashlib
+import itertools
 import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
 # Add the parent directory to the Python path to import security module
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
@@ -11,15 +15,30 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '.
 from security.pii_filter import find_pii # Import find_pii
 from security.compliance_tagger import tag_compliance # Import tag_compliance
 
-def parse_pdf(pdf_path):
-    """Extracts text from a PDF file."""
-    text = ""
+# Parallel mode keeps this many files per worker process in flight
+PARALLEL_FILES_PER_WORKER = 4
+
+# Manifest of parsed files (path -> size, mtime, content hash), kept next to the JSONL output,
+# so later runs only re-parse new or changed documents
+MANIFEST_SUFFIX = '.manifest.json'
+
+def iter_pdf_pages(pdf_path):
+    """Yields (page_number, text) for each page of a PDF, starting at page 1.
+
+    Only one page's text is held at a time, so very large documents stream in bounded memory.
+    """
+    doc = fitz.open(pdf_path)
     try:
-        doc = fitz.open(pdf_path)
         for page_num in range(doc.page_count):
-            page = doc.load_page(page_num)
-            text += page.get_text()
+            yield page_num + 1, doc.load_page(page_num).get_text()
+    finally:
         doc.close()
+
+def parse_pdf(pdf_path):
+    """Extracts text from a PDF file."""
+    try:
+        # Joining the pages once is linear in the document size, unlike repeated concatenation
+        text = ''.join(page_text for _, page_text in iter_pdf_pages(pdf_path))
     except Exception as e:
         print(f"Error parsing PDF {pdf_path}: {e}")
         text = None
@@ -53,53 +72,262 @@ def parse_eml(eml_path):
 
     return subject, body
 
-def process_unstructured_data(data_dir='data/unstructured', output_jsonl='data/unstructured/parsed.jsonl'):
-    """Processes unstructured data files (PDF and EML) and saves as JSONL."""
+def _new_record(file_path, text, subject=None):
+    """Builds a JSONL record with PII and compliance tags for extracted text."""
+    doc_data = {
+        'filepath': file_path,
+        'filename': os.path.basename(file_path),
+        'text': text,
+        'subject': subject,
+        'pii_tags': {},
+        'compliance_tags': []
+    }
+    # Find PII and compliance tags if text was extracted
+    if text:
+        doc_data['pii_tags'] = find_pii(text)
+        doc_data['compliance_tags'] = tag_compliance(text)
+    return doc_data
+
+def iter_records(file_path, split_pages=False):
+    """Parses one PDF or EML file and yields its JSONL records, tagged for PII and compliance terms.
+
+    A file yields one record, or none if nothing could be extracted. With split_pages=True a PDF
+    yields one record per page that has text, carrying page_number and page_count, and pages are
+    extracted and tagged one at a time.
+    """
+    if file_path.endswith('.pdf') and split_pages:
+        try:
+            with fitz.open(file_path) as doc:
+                page_count = doc.page_count
+            for page_number, page_text in iter_pdf_pages(file_path):
+                if page_text.strip():
+                    doc_data = _new_record(file_path, page_text)
+                    doc_data['page_number'] = page_number
+                    doc_data['page_count'] = page_count
+                    yield doc_data
+        except Exception as e:
+            print(f"Error parsing PDF {file_path}: {e}")
+        return
+
+    subject = None
+    extracted_text = None
+    if file_path.endswith('.pdf'):
+        extracted_text = parse_pdf(file_path)
+    elif file_path.endswith('.eml'):
+        subject, extracted_text = parse_eml(file_path) # Store email body here for PII/compliance check
+    doc_data = _new_record(file_path, extracted_text, subject)
+
+    # Only keep records with some content or metadata
+    if doc_data['text'] is not None or doc_data['subject'] is not None or doc_data['pii_tags'] or doc_data['compliance_tags']:
+        yield doc_data
+
+def process_file(file_path, split_pages=False):
+    """Returns the list of JSONL records for one file (see iter_records).
+
+    Runs in worker processes in parallel mode, so it only takes and returns picklable values.
+    """
+    return list(iter_records(file_path, split_pages))
+
+def _process_parallel(files, workers, split_pages=False):
+    """Yields (file_path, records) in input order while a process pool parses ahead.
+
+    At most a few files per worker are in flight, so a slow document holds back a bounded
+    number of finished results rather than the whole backlog.
+    """
+    pending = deque()
+    files = iter(files)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for file_path in files:
+            pending.append((file_path, executor.submit(process_file, file_path, split_pages)))
+            if len(pending) >= workers * PARALLEL_FILES_PER_WORKER:
+                break
+        while pending:
+            file_path, future = pending.popleft()
+            next_file = next(files, None)
+            if next_file is not None:
+                pending.append((next_file, executor.submit(process_file, next_file, split_pages)))
+            try:
+                yield file_path, future.result()
+            except Exception as e:
+                print(f"Error processing {file_path}: {e}")
+                yield file_path, []
+
+def manifest_path(output_jsonl):
+    """Path of the manifest that belongs to a JSONL output file."""
+    return output_jsonl + MANIFEST_SUFFIX
+
+def file_content_hash(file_path, chunk_size=1024 * 1024):
+    """Returns the SHA-256 of a file's contents, read in chunks."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _output_signature(output_jsonl):
+    """[size, mtime_ns] of the JSONL output, recorded in the manifest to notice outside changes."""
+    stat = os.stat(output_jsonl)
+    return [stat.st_size, stat.st_mtime_ns]
+
+def load_manifest(output_jsonl, split_pages=False):
+    """Loads the manifest of a previous run; an unreadable manifest or missing output means none.
+
+    A manifest written with a different split_pages setting is ignored too, since the stored
+    records have the other shape, and so is one whose output was changed after it was written.
+    """
+    path = manifest_path(output_jsonl)
+    if not os.path.exists(path) or not os.path.exists(output_jsonl):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Error reading manifest {path}, re-parsing everything: {e}")
+        return {}
+    if manifest.get('split_pages', False) != split_pages:
+        print(f"Records in {output_jsonl} were written with split_pages={not split_pages}, re-parsing everything")
+        return {}
+    if manifest.get('output', _output_signature(output_jsonl)) != _output_signature(output_jsonl):
+        print(f"{output_jsonl} changed since its manifest was written, re-parsing everything")
+        return {}
+    return manifest.get('files', {})
+
+def _write_json_atomic(path, data):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+def iter_record_groups(output_jsonl):
+    """Yields (filepath, [JSONL lines]) for each file's records in a previous run's output, one file at a time."""
+    with open(output_jsonl, 'r', encoding='utf-8') as f:
+        lines = (line if line.endswith('\n') else line + '\n' for line in f if line.strip())
+        for file_path, group in itertools.groupby(lines, key=lambda line: json.loads(line)['filepath']):
+            yield file_path, list(group)
+
+def check_for_changes(manifest, file_path):
+    """Returns the file's manifest entry if it is unchanged since the last run, otherwise a fresh entry to parse.
+
+    Size and mtime are compared first; the file is only hashed when they differ, so a touched but
+    identical file is not re-parsed. The second value tells whether the file needs parsing.
+    """
+    stat = os.stat(file_path)
+    entry = manifest.get(file_path)
+    if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+        return entry, False
+    content_hash = file_content_hash(file_path)
+    if entry and entry['content_hash'] == content_hash:
+        return dict(entry, size=stat.st_size, mtime_ns=stat.st_mtime_ns), False
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'content_hash': content_hash, 'has_record': False}, True
+
+def process_unstructured_data(data_dir='data/unstructured', output_jsonl='data/unstructured/parsed.jsonl', workers=1,
+                              incremental=True, split_pages=False):
+    """Processes unstructured data files (PDF and EML) and saves as JSONL.
+
+    With workers > 1 files are parsed and tagged on a pool of worker processes, while this
+    process alone writes the output; records are written in the same (sorted) file order
+    either way, so the output is deterministic.
+
+    With incremental=True only documents that are new or changed since the last run (according
+    to the manifest next to output_jsonl) are parsed, and records of deleted files are dropped.
+    When documents were only added, their records are appended; otherwise the output is
+    rewritten, reusing the stored records of unchanged files.
+
+    With split_pages=True every PDF page becomes its own record with page_number and page_count,
+    so downstream chunking and citations can work per page; in sequential mode pages are
+    extracted, tagged and written one at a time.
+    """
     os.makedirs(data_dir, exist_ok=True)
 
-    # Get list of PDF and EML files
-    pdf_files = glob.glob(os.path.join(data_dir, '*.pdf'))
-    eml_files = glob.glob(os.path.join(data_dir, '*.eml'))
+    # Get list of PDF and EML files, in a stable order
+    pdf_files = sorted(glob.glob(os.path.join(data_dir, '*.pdf')))
+    eml_files = sorted(glob.glob(os.path.join(data_dir, '*.eml')))
 
     all_files = pdf_files + eml_files
 
+    manifest = load_manifest(output_jsonl, split_pages) if incremental else {}
     if not all_files:
         print(f"No PDF or EML files found in {data_dir}")
+        # Records of earlier documents are still dropped below
+        if not manifest:
+            return
+
+    new_manifest = {}
+    to_parse = []
+    for file_path in all_files:
+        entry, changed = check_for_changes(manifest, file_path)
+        if changed:
+            to_parse.append(file_path)
+        new_manifest[file_path] = entry
+    deleted = [path for path in manifest if path not in new_manifest]
+    for path in deleted:
+        print(f"Dropping record of {path} (file no longer exists)")
+    print(f"{len(to_parse)} of {len(all_files)} documents are new or changed, {len(deleted)} were deleted")
+
+    def write_manifest():
+        _write_json_atomic(manifest_path(output_jsonl), {
+            'split_pages': split_pages, 'files': new_manifest, 'output': _output_signature(output_jsonl)
+        })
+
+    if not to_parse and not deleted and manifest:
+        # Nothing to parse or drop: the output is not even read
+        write_manifest()
         return
 
-    with open(output_jsonl, 'w', encoding='utf-8') as outfile:
-        for file_path in all_files:
-            doc_data = {
-                'filepath': file_path,
-                'filename': os.path.basename(file_path),
-                'text': None,
-                'subject': None,
-                'pii_tags': {},
-                'compliance_tags': []
-            }
-            extracted_text = None
-
-            if file_path.endswith('.pdf'):
-                extracted_text = parse_pdf(file_path)
-            elif file_path.endswith('.eml'):
-                subject, body = parse_eml(file_path)
-                doc_data['subject'] = subject
-                extracted_text = body # Store email body here for PII/compliance check
-
-            doc_data['text'] = extracted_text # Store the extracted text (or None)
-
-            # Find PII and compliance tags if text was extracted
-            if extracted_text:
-                doc_data['pii_tags'] = find_pii(extracted_text)
-                doc_data['compliance_tags'] = tag_compliance(extracted_text)
-
-            # Only write to JSONL if there's some content or metadata
-            if doc_data['text'] is not None or doc_data['subject'] is not None or doc_data['pii_tags'] or doc_data['compliance_tags']:
-                json.dump(doc_data, outfile)
-                outfile.write('\n')
+    if workers > 1 and len(to_parse) > 1:
+        results = _process_parallel(to_parse, workers, split_pages)
+    else:
+        # Records are produced lazily, so a large PDF is written page by page as it is parsed
+        results = ((file_path, iter_records(file_path, split_pages)) for file_path in to_parse)
+
+    def serialize(file_path, doc_records):
+        """Yields one file's records as JSONL lines and notes in the manifest whether there were any."""
+        count = 0
+        for doc_data in doc_records:
+            count += 1
+            if 'page_number' not in doc_data:
                 print(f"Processed {file_path} - PII: {doc_data['pii_tags']}, Compliance: {doc_data['compliance_tags']}")
-            else:
-                print(f"Skipping {file_path} due to parsing errors or no content.")
+            yield json.dumps(doc_data) + '\n'
+        new_manifest[file_path]['has_record'] = count > 0
+        if count == 0:
+            print(f"Skipping {file_path} due to parsing errors or no content.")
+        elif split_pages and file_path.endswith('.pdf'):
+            print(f"Processed {file_path} - {count} page records")
+
+    # Only new files that sort after every existing one: their records simply go at the end
+    append_only = (
+        bool(manifest) and not deleted and all(path not in manifest for path in to_parse)
+        and all_files[len(all_files) - len(to_parse):] == to_parse
+    )
+    if append_only:
+        with open(output_jsonl, 'a', encoding='utf-8') as outfile:
+            for file_path, doc_records in results:
+                outfile.writelines(serialize(file_path, doc_records))
+    else:
+        # Rewrite in file order, merging the stored records of unchanged files (the old output is
+        # in the same order, so it is read once, one file's records at a time); the new output
+        # replaces the old one only once it is complete
+        parse_set = set(to_parse)
+        results = iter(results)
+        old_groups = iter_record_groups(output_jsonl) if manifest else iter(())
+        position = {file_path: i for i, file_path in enumerate(all_files)}
+        pending = next(old_groups, None)
+        tmp_path = output_jsonl + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as outfile:
+            for file_path in all_files:
+                if file_path in parse_set:
+                    outfile.writelines(serialize(*next(results)))
+                    continue
+                # Skip records of deleted, re-parsed or earlier files, stopping at this file's or a later one's
+                while pending is not None and (pending[0] in parse_set or position.get(pending[0], -1) < position[file_path]):
+                    pending = next(old_groups, None)
+                if pending is not None and pending[0] == file_path:
+                    outfile.writelines(pending[1])
+                    pending = next(old_groups, None)
+                elif new_manifest[file_path]['has_record']:
+                    print(f"Record of {file_path} is missing from {output_jsonl}; run with incremental=False to rebuild it")
+        os.replace(tmp_path, output_jsonl)
+    write_manifest()
 
 if __name__ == "__main__":
-    process_unstructured_data() 
\ No newline at end of file
+    process_unstructured_data()
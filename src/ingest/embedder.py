@@ -58,6 +58,9 @@ def upload_embeddings_to_chromadb(client, collection_name, documents, embeddings
             # Optionally store a snippet of text instead of the whole text
             'text_snippet': doc.get('text', '')[:500] + '...' if doc.get('text') else None
         }
+        # Page records (parsed with split_pages=True) keep their page number for citations
+        if doc.get('page_number') is not None:
+            metadata['page_number'] = doc['page_number']
         metadatas.append(metadata)
         # Use the original text content for ChromaDB's 'documents' field
         documents_to_add.append(doc.get('text', ''))
@@ -1,36 +1,1482 @@
 import pandas as pd
 import duckdb
 import glob
+import hashlib
+import json
 import os
+import queue
+import re
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Ingestion modes: 'native' streams CSVs through DuckDB's parallel reader,
+# 'pandas' reads each file into a DataFrame first (kept as a fallback for odd files),
+# 'chunked' inserts fixed-size row batches and can resume after a crash
+INGEST_MODES = ('native', 'pandas', 'chunked')
+
+# Table inside the DuckDB file that records which source files have been loaded
+MANIFEST_TABLE = '_ingest_manifest'
+
+# Supported source files: suffix -> format. Compressed files are decompressed while streaming,
+# never expanded on disk.
+SOURCE_SUFFIXES = {
+    '.csv': 'csv',
+    '.csv.gz': 'csv',
+    '.csv.zst': 'csv',
+    '.ndjson': 'ndjson',
+    '.ndjson.gz': 'ndjson',
+    '.ndjson.zst': 'ndjson',
+    '.jsonl': 'ndjson',
+    '.jsonl.gz': 'ndjson',
+    '.jsonl.zst': 'ndjson'
+}
+
+# Partitioned feeds are laid out as <data_dir>/<table>/<key>=<value>/.../*.csv and exposed as views
+# over DuckDB's hive-partitioned reader; their manifest entries carry this marker (followed by a hash of
+# the view definition) instead of a content hash, with the file count and newest file mtime
+PARTITIONED_SOURCE = 'hive-partitioned'
+PARTITION_DIR_PATTERN = re.compile(r'^[^=]+=[^=]*$')
+
+# Per-table load settings, e.g. {"tables": {"orders": {"load_mode": "upsert", "key": ["order_id"]}}}
+TABLE_CONFIG_PATH = 'data/structured/table_config.json'
+
+# How a file's rows are written: 'replace' rewrites the table, 'append' inserts the rows
+# (skipping keys already present when a key is configured), 'upsert' merges on the key.
+# Without a key, 'append' expects the source file to only grow: it inserts the rows past those
+# already loaded (the manifest's rows_loaded), and reloads the whole file if earlier bytes changed.
+LOAD_MODES = ('replace', 'append', 'upsert')
+
+# Table that records how many rows of a file the 'chunked' mode has committed, for crash recovery
+PROGRESS_TABLE = '_ingest_progress'
+
+# Defaults for the 'chunked' mode: rows per committed batch and DuckDB's memory ceiling
+DEFAULT_BATCH_SIZE = 100000
+DEFAULT_MEMORY_LIMIT = '1GB'
+
+# Where sorted Parquet copies of the tables are written when Parquet staging is enabled.
+# Tables are sorted by their configured sort_keys so DuckDB can skip row groups on selective filters.
+PARQUET_DIR = 'data/structured/parquet'
+DEFAULT_ROW_GROUP_SIZE = 122880
+# Catalog of the Parquet copies: a copy is current while exported_at is not older than its table's last load.
+# Every export writes a new <table>.<version>.parquet file recorded in the (possibly staged) catalog, so
+# readers of the previous snapshot keep the copy their catalog names; superseded files are removed once
+# the load is published.
+PARQUET_CATALOG_TABLE = '_parquet_exports'
+PARQUET_VERSION_PATTERN = re.compile(r'^.+\.\d+\.parquet$')
+
+# Catalog of per-column statistics collected at load time, so schema and stats questions
+# can be answered without scanning the tables
+STATS_TABLE = '_table_stats'
+TOP_VALUES_COUNT = 5
+
+# Catalog of materialized summary tables declared under "aggregates" in the table config, e.g.
+# {"aggregates": {"sales_by_day": {"source": "orders", "group_by": ["order_date"], "measures": ["sum(amount)", "count(*)"]}}}
+# Measures are re-aggregatable functions so summaries can be merged incrementally and re-grouped at query time
+AGGREGATE_CATALOG_TABLE = '_aggregate_catalog'
+AGGREGATE_FUNCTIONS = ('sum', 'count', 'min', 'max')
+AGGREGATE_MEASURE_PATTERN = re.compile(r'^\s*(sum|count|min|max)\s*\(\s*(\*|"?[A-Za-z_]\w*"?)\s*\)\s*$', re.IGNORECASE)
+
+# Loads write to a staging copy of the database that is then swapped in atomically, so readers
+# keep querying their current snapshot (and never contend for the file lock) during an ingest.
+# False (write in place) and 'auto' (write in place unless another connection has the database open
+# when the load starts) skip the copy, but readers arriving during such a load cannot open the file.
+PUBLISH_MODES = (True, False, 'auto')
+STAGING_SUFFIX = '.staging'
+# Fingerprint of the published database a staging copy was made from, so an interrupted load
+# is only resumed from its staging copy while the published database is unchanged
+STAGING_BASE_SUFFIX = '.base.json'
+
+# Per-thread in-memory DuckDB connections used by parse_csv
+_parser_connections = threading.local()
+
+def quote_identifier(name):
+    """Quotes a table or column name for safe use in DuckDB SQL."""
+    return '"' + name.replace('"', '""') + '"'
+
+def source_format(file_path):
+    """Returns 'csv' or 'ndjson' for a supported source file, or None."""
+    name = os.path.basename(file_path).lower()
+    for suffix, file_format in SOURCE_SUFFIXES.items():
+        if name.endswith(suffix):
+            return file_format
+    return None
+
+def source_table_name(file_path):
+    """Returns the table name for a source file: its file name without the format and compression suffixes."""
+    name = os.path.basename(file_path)
+    # Longest suffix first, so 'x.csv.gz' becomes 'x' rather than 'x.csv'
+    for suffix in sorted(SOURCE_SUFFIXES, key=len, reverse=True):
+        if name.lower().endswith(suffix):
+            return name[:-len(suffix)]
+    return os.path.splitext(name)[0]
+
+def source_scan_sql(file_path):
+    """Returns the DuckDB table function (with one ? parameter for the path) that streams a source file."""
+    if source_format(file_path) == 'ndjson':
+        return "read_json(?, format='newline_delimited', auto_detect=true)"
+    # read_csv detects .gz and .zst from the file name and decompresses on the fly
+    return "read_csv(?, auto_detect=true)"
+
+def _read_source_pandas(file_path, chunksize=None):
+    """Reads a source file with pandas (compression is inferred from the file name)."""
+    if source_format(file_path) == 'ndjson':
+        return pd.read_json(file_path, lines=True, chunksize=chunksize)
+    return pd.read_csv(file_path, chunksize=chunksize)
+
+def quote_literal(value):
+    """Quotes a string as a DuckDB SQL literal (for statements that cannot take parameters)."""
+    return "'" + str(value).replace("'", "''") + "'"
+
+def file_content_hash(file_path, chunk_size=1024 * 1024):
+    """Returns the SHA-256 hex digest of a file, read in fixed-size chunks."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def file_content_hashes(file_path, prefix_size, chunk_size=1024 * 1024):
+    """Returns (digest of the whole file, digest of its first prefix_size bytes) in a single read."""
+    digest, prefix_digest = hashlib.sha256(), hashlib.sha256()
+    remaining = prefix_size
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+            if remaining > 0:
+                prefix_digest.update(chunk[:remaining])
+                remaining -= len(chunk)
+    return digest.hexdigest(), prefix_digest.hexdigest()
+
+def ensure_manifest(con):
+    """Creates the ingest manifest table if it does not exist yet (and adds columns missing from older versions)."""
+    con.execute(f"""
+        CREATE TABLE IF NOT EXISTS {MANIFEST_TABLE} (
+            path VARCHAR PRIMARY KEY,
+            table_name VARCHAR,
+            size BIGINT,
+            mtime_ns BIGINT,
+            content_hash VARCHAR,
+            loaded_at TIMESTAMP,
+            rows_loaded BIGINT
+        )
+    """)
+    con.execute(f"ALTER TABLE {MANIFEST_TABLE} ADD COLUMN IF NOT EXISTS rows_loaded BIGINT")
+
+def read_manifest(con):
+    """Returns the ingest manifest as a dict keyed by source file path."""
+    has_rows_loaded = con.execute(
+        "SELECT count(*) FROM duckdb_columns() WHERE table_name = ? AND column_name = 'rows_loaded'", [MANIFEST_TABLE]
+    ).fetchone()[0] > 0
+    rows = con.execute(
+        f"SELECT path, table_name, size, mtime_ns, content_hash, {'rows_loaded' if has_rows_loaded else 'NULL'} FROM {MANIFEST_TABLE}"
+    ).fetchall()
+    return {
+        path: {'table_name': table_name, 'size': size, 'mtime_ns': mtime_ns, 'content_hash': content_hash, 'rows_loaded': rows_loaded}
+        for path, table_name, size, mtime_ns, content_hash, rows_loaded in rows
+    }
+
+def record_manifest_entry(con, path, table_name, size, mtime_ns, content_hash, rows_loaded=None):
+    """Inserts or updates the manifest entry for a source file.
+
+    rows_loaded is the number of the file's rows in its table, for tables that hold exactly the
+    file's rows (replace, and append without a key); it tells keyless appends where new rows start.
+    """
+    con.execute(
+        f"INSERT OR REPLACE INTO {MANIFEST_TABLE} (path, table_name, size, mtime_ns, content_hash, loaded_at, rows_loaded) "
+        f"VALUES (?, ?, ?, ?, ?, current_timestamp, ?)",
+        [path, table_name, size, mtime_ns, content_hash, rows_loaded]
+    )
+
+def _drop_relation(con, name):
+    """Drops a table or view by name, whichever exists."""
+    is_view = con.execute(
+        "SELECT count(*) FROM duckdb_views() WHERE schema_name = 'main' AND view_name = ? AND NOT temporary", [name]
+    ).fetchone()[0] > 0
+    con.execute(f"DROP {'VIEW' if is_view else 'TABLE'} IF EXISTS {quote_identifier(name)}")
+
+def drop_stale_tables(con, manifest, live_tables=()):
+    """Drops tables (and manifest entries) whose source file no longer exists, returning their names.
+
+    A table that another source still maps to (one of live_tables, or another existing manifest
+    path) is kept; only the missing source's manifest entry is removed.
+    """
+    remaining = {table_name.lower() for table_name in live_tables}
+    remaining.update(entry['table_name'].lower() for path, entry in manifest.items() if os.path.exists(path))
+    dropped = []
+    for path, entry in manifest.items():
+        if os.path.exists(path):
+            continue
+        con.execute(f"DELETE FROM {MANIFEST_TABLE} WHERE path = ?", [path])
+        if entry['table_name'].lower() in remaining:
+            print(f"Removed {path} from the manifest (table {entry['table_name']} still has another source)")
+            continue
+        _drop_relation(con, entry['table_name'])
+        print(f"Dropped table {entry['table_name']} (source {path} no longer exists)")
+        dropped.append(entry['table_name'])
+    return dropped
+
+def _read_config(config_path):
+    """Reads the JSON table config (missing or unreadable file means an empty config)."""
+    if not os.path.exists(config_path):
+        return {}
+    try:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Error reading table config {config_path}: {e}")
+        return {}
+
+def load_table_config(config_path=TABLE_CONFIG_PATH):
+    """Loads per-table load settings from a JSON config file (missing file means defaults)."""
+    tables = _read_config(config_path).get('tables', {})
+    for table_name, options in tables.items():
+        load_mode = options.get('load_mode', 'replace')
+        if load_mode not in LOAD_MODES:
+            raise ValueError(f"Unknown load_mode '{load_mode}' for table {table_name}. Expected one of: {', '.join(LOAD_MODES)}")
+        if load_mode == 'upsert' and not options.get('key'):
+            raise ValueError(f"Table {table_name} uses load_mode 'upsert' but has no key configured")
+    return tables
+
+def parse_measure(measure):
+    """Splits a measure such as 'sum(amount)' into (function, column); column is '*' for count(*)."""
+    match = AGGREGATE_MEASURE_PATTERN.match(measure)
+    if not match:
+        raise ValueError(
+            f"Unsupported aggregate measure '{measure}'. Expected {', '.join(AGGREGATE_FUNCTIONS)} of a column, or count(*)"
+        )
+    function, column = match.group(1).lower(), match.group(2).strip('"')
+    if column == '*' and function != 'count':
+        raise ValueError(f"Unsupported aggregate measure '{measure}': only count accepts *")
+    return function, column
+
+def measure_column(function, column):
+    """Name of the summary column that stores a measure, e.g. sum_amount or count_star."""
+    return f"{function}_{'star' if column == '*' else column}"
+
+def load_aggregate_config(config_path=TABLE_CONFIG_PATH):
+    """Loads the materialized summary table definitions from the "aggregates" section of the config."""
+    aggregates = _read_config(config_path).get('aggregates', {})
+    for name, definition in aggregates.items():
+        if not definition.get('source') or not definition.get('group_by') or not definition.get('measures'):
+            raise ValueError(f"Aggregate {name} needs a source table, group_by columns and measures")
+        for measure in definition['measures']:
+            parse_measure(measure)
+    return aggregates
+
+def table_exists(con, table_name):
+    """Returns True if a persistent table with this name exists in the main schema."""
+    return con.execute(
+        "SELECT count(*) FROM duckdb_tables() WHERE schema_name = 'main' AND table_name = ? AND NOT temporary",
+        [table_name]
+    ).fetchone()[0] > 0
+
+def _merge_rows(con, table, source_sql, params, load_mode, key):
+    """Appends or upserts the rows of source_sql into an existing table, returning the rows written."""
+    key_match = ' AND '.join(f"t.{quote_identifier(k)} = s.{quote_identifier(k)}" for k in key)
+    if load_mode == 'append':
+        if key:
+            # Only rows whose key is not in the table yet
+            return con.execute(
+                f"INSERT INTO {table} BY NAME SELECT * FROM {source_sql} AS s "
+                f"WHERE NOT EXISTS (SELECT 1 FROM {table} AS t WHERE {key_match})",
+                params
+            ).fetchone()[0]
+        return con.execute(f"INSERT INTO {table} BY NAME SELECT * FROM {source_sql}", params).fetchone()[0]
+
+    # Rows that are new or differ from what is stored; unchanged rows are never rewritten.
+    # Only stored rows whose key occurs in the source are compared, so a batch costs the
+    # size of the batch rather than a scan and hash of the whole table.
+    columns = ', '.join(quote_identifier(name) for name, *_ in con.execute(f"DESCRIBE {table}").fetchall())
+    # NULL-safe, so unchanged rows with a NULL key are still recognised as unchanged
+    key_lookup = ' AND '.join(f"t.{quote_identifier(k)} IS NOT DISTINCT FROM s.{quote_identifier(k)}" for k in key)
+    con.execute(f"CREATE OR REPLACE TEMP TABLE _upsert_source AS SELECT {columns} FROM {source_sql}", params)
+    con.execute(
+        f"CREATE OR REPLACE TEMP TABLE _upsert_delta AS "
+        f"SELECT {columns} FROM _upsert_source EXCEPT "
+        f"SELECT {columns} FROM {table} AS t WHERE EXISTS (SELECT 1 FROM _upsert_source AS s WHERE {key_lookup})"
+    )
+    con.execute(f"DELETE FROM {table} AS t USING _upsert_delta AS s WHERE {key_match}")
+    written = con.execute(f"INSERT INTO {table} BY NAME SELECT * FROM _upsert_delta").fetchone()[0]
+    con.execute("DROP TABLE _upsert_delta")
+    con.execute("DROP TABLE _upsert_source")
+    return written
+
+def write_table(con, table_name, source_sql, params=None, table_options=None, in_transaction=False):
+    """Writes the rows of source_sql (a FROM-clause expression) into a table, honouring its load mode.
+
+    Returns the number of rows written. Append and upsert only write the delta and leave
+    existing rows in place; a table that does not exist yet is always created from scratch.
+    Pass in_transaction=True when the caller already opened a transaction.
+    """
+    table_options = table_options or {}
+    load_mode = table_options.get('load_mode', 'replace')
+    key = table_options.get('key') or []
+    if isinstance(key, str):
+        key = [key]
+    table = quote_identifier(table_name)
+
+    if load_mode == 'replace' or not table_exists(con, table_name):
+        return con.execute(f"CREATE OR REPLACE TABLE {table} AS SELECT * FROM {source_sql}", params).fetchone()[0]
+    if in_transaction:
+        return _merge_rows(con, table, source_sql, params, load_mode, key)
+
+    con.execute("BEGIN TRANSACTION")
+    try:
+        written = _merge_rows(con, table, source_sql, params, load_mode, key)
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+    return written
+
+def _is_keyless_append(table_options):
+    """True for tables loaded with 'append' and no key, whose new rows are found by position."""
+    return (table_options or {}).get('load_mode') == 'append' and not (table_options or {}).get('key')
+
+def _skip_rows(data, skip_rows):
+    """Drops the first skip_rows rows of an Arrow table or DataFrame."""
+    if not skip_rows:
+        return data
+    return data.iloc[skip_rows:] if isinstance(data, pd.DataFrame) else data.slice(skip_rows)
+
+def load_csv_native(con, csv_file, table_name, table_options=None, skip_rows=0):
+    """Streams a CSV (or NDJSON, optionally compressed) file straight into a DuckDB table using DuckDB's parallel, type-sniffing reader.
+
+    The first skip_rows rows (already loaded by an earlier run) are not written.
+    """
+    # The DuckDB readers never materialize the file in Python, so peak memory does not grow with file size
+    source_sql = source_scan_sql(csv_file)
+    if skip_rows:
+        # The scan keeps the file's row order, so the offset skips exactly the rows loaded before
+        source_sql = f"(SELECT * FROM {source_sql} OFFSET {int(skip_rows)})"
+    return write_table(con, table_name, source_sql, [csv_file], table_options)
+
+def load_csv_pandas(con, csv_file, table_name, table_options=None, skip_rows=0):
+    """Loads a CSV file into a DuckDB table via a pandas DataFrame, leaving out its first skip_rows rows."""
+    # Read CSV into pandas DataFrame
+    df = _skip_rows(_read_source_pandas(csv_file), skip_rows)
+    # Load DataFrame into DuckDB table
+    return write_parsed_table(con, table_name, df, table_options)
+
+def find_partitioned_datasets(data_dir):
+    """Returns {table_name: directory} for subdirectories of data_dir laid out as <table>/<key>=<value>/."""
+    datasets = {}
+    for entry in sorted(os.scandir(data_dir), key=lambda e: e.name):
+        if not entry.is_dir():
+            continue
+        if any(child.is_dir() and PARTITION_DIR_PATTERN.match(child.name) for child in os.scandir(entry.path)):
+            datasets[entry.name] = entry.path
+    return datasets
+
+def partition_columns(dataset_dir):
+    """Returns the partition column names of a hive-partitioned directory, outermost first."""
+    columns = []
+    current = dataset_dir
+    while True:
+        partitions = [child for child in os.scandir(current) if child.is_dir() and PARTITION_DIR_PATTERN.match(child.name)]
+        if not partitions:
+            return columns
+        columns.append(partitions[0].name.split('=', 1)[0])
+        current = partitions[0].path
+
+def _partitioned_view(table_name, dataset_dir, table_options=None):
+    """Returns (CREATE VIEW statement, manifest signature) for a hive-partitioned directory.
+
+    The signature is (file count, newest file mtime, marker with a hash of the view definition),
+    so added, removed or rewritten partition files and definition changes all alter it.
+    """
+    table_options = table_options or {}
+    # Plain and compressed CSVs, as absolute patterns so the view resolves from any working directory;
+    # patterns that match nothing are left out since read_csv rejects them
+    files = {}
+    for suffix, file_format in SOURCE_SUFFIXES.items():
+        if file_format == 'csv':
+            pattern = os.path.join(os.path.abspath(dataset_dir), '**', f"*{suffix}")
+            files[pattern] = glob.glob(pattern, recursive=True)
+    patterns = [pattern for pattern, matches in files.items() if matches]
+    if not patterns:
+        raise ValueError(f"No CSV files found under {dataset_dir}")
+    union_by_name = 'true' if table_options.get('union_by_name') else 'false'
+    view_sql = (
+        f"CREATE OR REPLACE VIEW {quote_identifier(table_name)} AS "
+        f"SELECT * FROM read_csv([{', '.join(quote_literal(pattern) for pattern in patterns)}], "
+        f"hive_partitioning=true, union_by_name={union_by_name}, auto_detect=true)"
+    )
+    paths = {path for pattern in patterns for path in files[pattern]}
+    definition_hash = hashlib.sha256(view_sql.encode('utf-8')).hexdigest()[:16]
+    signature = (len(paths), max(os.stat(path).st_mtime_ns for path in paths), f"{PARTITIONED_SOURCE}:{definition_hash}")
+    return view_sql, signature
+
+def partitioned_view_changed(manifest, table_name, dataset_dir, table_options=None):
+    """Returns True if the view over a partitioned directory is new or its files or definition changed."""
+    entry = manifest.get(dataset_dir)
+    if entry is None or entry['table_name'] != table_name:
+        return True
+    try:
+        _, signature = _partitioned_view(table_name, dataset_dir, table_options)
+    except (OSError, ValueError):
+        # Let create_partitioned_view report the problem
+        return True
+    return (entry['size'], entry['mtime_ns'], entry['content_hash']) != signature
+
+def create_partitioned_view(con, table_name, dataset_dir, table_options=None):
+    """Creates a view over all CSVs of a hive-partitioned directory.
+
+    Partition keys become columns, and filters on them are pushed down to the file list,
+    so a query for one partition only reads that partition's files. Set union_by_name in the
+    table options when partitions may have different columns (every header is then read at bind time).
+    """
+    view_sql, (file_count, newest_mtime_ns, marker) = _partitioned_view(table_name, dataset_dir, table_options)
+    con.execute(view_sql)
+    record_manifest_entry(con, dataset_dir, table_name, file_count, newest_mtime_ns, marker)
+    print(f"Created partitioned view {table_name} over {file_count} files in {dataset_dir} "
+          f"(partitioned by {', '.join(partition_columns(dataset_dir))})")
+
+def parquet_path(table_name, parquet_dir=PARQUET_DIR, version=None):
+    """Returns the path of a version of the Parquet copy of a table (unversioned copies predate versioning)."""
+    suffix = f".{version}" if version is not None else ''
+    return os.path.join(parquet_dir, f"{table_name}{suffix}.parquet")
+
+def export_parquet(con, table_name, parquet_dir=PARQUET_DIR, sort_keys=None, row_group_size=DEFAULT_ROW_GROUP_SIZE):
+    """Writes a table to a new version of its Parquet copy, sorted by sort_keys, and records it in the catalog.
+
+    The previous copy is left in place for readers of the published snapshot; prune_parquet_exports
+    removes it after the load is published. Returns the new copy's path.
+    """
+    os.makedirs(parquet_dir, exist_ok=True)
+    target = parquet_path(table_name, parquet_dir, time.time_ns())
+    tmp_path = target + '.tmp'
+    if isinstance(sort_keys, str):
+        sort_keys = [sort_keys]
+    order_by = f" ORDER BY {', '.join(quote_identifier(k) for k in sort_keys)}" if sort_keys else ''
+    con.execute(
+        f"COPY (SELECT * FROM {quote_identifier(table_name)}{order_by}) TO {quote_literal(tmp_path)} "
+        f"(FORMAT PARQUET, COMPRESSION ZSTD, ROW_GROUP_SIZE {int(row_group_size)})"
+    )
+    # Readers never see a half-written file
+    os.replace(tmp_path, target)
+    ensure_parquet_catalog(con)
+    con.execute(
+        f"INSERT OR REPLACE INTO {PARQUET_CATALOG_TABLE} VALUES (?, ?, current_timestamp)",
+        [table_name, os.path.abspath(target)]
+    )
+    print(f"Exported table {table_name} to {target}" + (f" sorted by {', '.join(sort_keys)}" if sort_keys else ''))
+    return target
+
+def ensure_parquet_catalog(con):
+    """Creates the catalog of exported Parquet copies if it does not exist yet."""
+    con.execute(f"""
+        CREATE TABLE IF NOT EXISTS {PARQUET_CATALOG_TABLE} (
+            table_name VARCHAR PRIMARY KEY,
+            path VARCHAR,
+            exported_at TIMESTAMP
+        )
+    """)
+
+def stale_parquet_exports(con, parquet_dir=PARQUET_DIR):
+    """Returns the loaded tables whose Parquet copy in parquet_dir is missing or older than their last load.
+
+    Partitioned views are not exported (their files are read in place already).
+    """
+    current = {}
+    if table_exists(con, PARQUET_CATALOG_TABLE):
+        current = dict(con.execute(f"""
+            SELECT e.table_name, e.path
+            FROM {PARQUET_CATALOG_TABLE} e
+            JOIN (SELECT table_name, max(loaded_at) AS loaded_at FROM {MANIFEST_TABLE} GROUP BY table_name) m
+              USING (table_name)
+            WHERE e.exported_at >= m.loaded_at
+        """).fetchall())
+    tables = con.execute(
+        f"SELECT DISTINCT table_name FROM {MANIFEST_TABLE} WHERE NOT starts_with(content_hash, ?) ORDER BY table_name",
+        [PARTITIONED_SOURCE]
+    ).fetchall()
+    stale = []
+    for (table_name,) in tables:
+        path = current.get(table_name)
+        if path is None or os.path.dirname(path) != os.path.abspath(parquet_dir) or not os.path.exists(path):
+            stale.append(table_name)
+    return stale
+
+def drop_parquet_export(con, table_name):
+    """Removes a dropped table's Parquet copy from the catalog, returning the copy's path (or None).
+
+    The file itself is deleted by prune_parquet_exports once the load is published.
+    """
+    if not table_exists(con, PARQUET_CATALOG_TABLE):
+        return None
+    row = con.execute(f"SELECT path FROM {PARQUET_CATALOG_TABLE} WHERE table_name = ?", [table_name]).fetchone()
+    con.execute(f"DELETE FROM {PARQUET_CATALOG_TABLE} WHERE table_name = ?", [table_name])
+    return row[0] if row else None
+
+def catalogued_parquet_exports(con):
+    """Returns {table name: path} of the Parquet copies the catalog of con lists."""
+    if not table_exists(con, PARQUET_CATALOG_TABLE):
+        return {}
+    return dict(con.execute(f"SELECT table_name, path FROM {PARQUET_CATALOG_TABLE}").fetchall())
+
+def prune_parquet_exports(parquet_dirs, catalogued):
+    """Deletes Parquet copies in parquet_dirs that the published catalog (catalogued) no longer lists.
+
+    Only export files are touched: versioned copies, and unversioned ones of catalogued tables.
+    Call it after publishing, as readers of the previous snapshot may still use the superseded copies.
+    """
+    keep = {os.path.abspath(path) for path in catalogued.values()}
+    for parquet_dir in parquet_dirs:
+        if not os.path.isdir(parquet_dir):
+            continue
+        for entry in os.scandir(parquet_dir):
+            path = os.path.abspath(entry.path)
+            if path in keep or not entry.is_file():
+                continue
+            superseded = PARQUET_VERSION_PATTERN.match(entry.name) or entry.name[:-len('.parquet')] in catalogued
+            if entry.name.endswith('.parquet') and superseded:
+                os.remove(path)
+                print(f"Removed superseded Parquet copy {path}")
+
+def ensure_stats_table(con):
+    """Creates the table statistics catalog if it does not exist yet."""
+    con.execute(f"""
+        CREATE TABLE IF NOT EXISTS {STATS_TABLE} (
+            table_name VARCHAR,
+            column_name VARCHAR,
+            column_type VARCHAR,
+            row_count BIGINT,
+            null_fraction DOUBLE,
+            min_value VARCHAR,
+            max_value VARCHAR,
+            approx_distinct BIGINT,
+            top_values VARCHAR,
+            collected_at TIMESTAMP,
+            PRIMARY KEY (table_name, column_name)
+        )
+    """)
+
+def collect_table_stats(con, table_name, top_k=TOP_VALUES_COUNT):
+    """Computes per-column statistics for a table in a single scan and stores them in the catalog."""
+    columns = [(name, column_type) for name, column_type, *_ in con.execute(f"DESCRIBE {quote_identifier(table_name)}").fetchall()]
+    aggregates = ['count(*)']
+    for name, column_type in columns:
+        column = quote_identifier(name)
+        # min/max/top values are only meaningful for scalar columns
+        if any(marker in column_type for marker in ('[', 'STRUCT', 'MAP', 'UNION')):
+            aggregates += [f"count({column})", 'NULL', 'NULL', 'NULL', 'NULL']
+        else:
+            aggregates += [
+                f"count({column})",
+                f"min({column})::VARCHAR",
+                f"max({column})::VARCHAR",
+                f"approx_count_distinct({column})",
+                f"approx_top_k({column}, {int(top_k)})::VARCHAR[]"
+            ]
+    row = con.execute(f"SELECT {', '.join(aggregates)} FROM {quote_identifier(table_name)}").fetchone()
+    row_count = row[0]
+    stats_rows = []
+    for i, (name, column_type) in enumerate(columns):
+        non_null, min_value, max_value, approx_distinct, top_values = row[1 + i * 5:6 + i * 5]
+        stats_rows.append([
+            table_name, name, column_type, row_count,
+            (row_count - non_null) / row_count if row_count else 0.0,
+            # HyperLogLog can overshoot; a column never has more distinct values than non-null ones
+            min_value, max_value, min(approx_distinct, non_null),
+            json.dumps(top_values) if top_values is not None else None
+        ])
+    con.execute("BEGIN TRANSACTION")
+    try:
+        con.execute(f"DELETE FROM {STATS_TABLE} WHERE table_name = ?", [table_name])
+        if stats_rows:
+            con.executemany(f"INSERT INTO {STATS_TABLE} VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, current_timestamp)", stats_rows)
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+    print(f"Collected statistics for table {table_name} ({row_count} rows, {len(columns)} columns)")
+
+def ensure_aggregate_catalog(con):
+    """Creates the catalog of materialized summary tables if it does not exist yet."""
+    con.execute(f"""
+        CREATE TABLE IF NOT EXISTS {AGGREGATE_CATALOG_TABLE} (
+            aggregate_name VARCHAR PRIMARY KEY,
+            source_table VARCHAR,
+            group_by VARCHAR[],
+            measures VARCHAR[],
+            definition_hash VARCHAR,
+            source_rows BIGINT,
+            summary_rows BIGINT,
+            refreshed_at TIMESTAMP
+        )
+    """)
+
+def _aggregate_definition_hash(definition):
+    return hashlib.sha256(json.dumps(
+        {key: definition[key] for key in ('source', 'group_by', 'measures')}, sort_keys=True
+    ).encode('utf-8')).hexdigest()
+
+def drop_aggregate(con, aggregate_name):
+    """Drops a summary table and its catalog entry."""
+    con.execute(f"DROP TABLE IF EXISTS {quote_identifier(aggregate_name)}")
+    con.execute(f"DELETE FROM {AGGREGATE_CATALOG_TABLE} WHERE aggregate_name = ?", [aggregate_name])
+
+def refresh_aggregate(con, aggregate_name, definition, incremental_from=None):
+    """Rebuilds a summary table from its source, or merges in only source rows past incremental_from.
+
+    Incremental refresh relies on append-only sources: rows with rowid >= incremental_from are
+    the ones inserted since the last refresh, and their partial aggregates are merged with the
+    stored ones (sum and count add up, min and max combine). Returns the summary's row count.
+    """
+    source = quote_identifier(definition['source'])
+    summary = quote_identifier(aggregate_name)
+    group_columns = ', '.join(quote_identifier(column) for column in definition['group_by'])
+    measures = [parse_measure(measure) for measure in definition['measures']]
+    aggregates = ', '.join(
+        f"{function}({'*' if column == '*' else quote_identifier(column)}) AS {quote_identifier(measure_column(function, column))}"
+        for function, column in measures
+    )
+    source_rows = con.execute(f"SELECT count(*) FROM {source}").fetchone()[0]
+
+    con.execute("BEGIN TRANSACTION")
+    try:
+        if incremental_from is None:
+            con.execute(
+                f"CREATE OR REPLACE TABLE {summary} AS "
+                f"SELECT {group_columns}, {aggregates} FROM {source} GROUP BY {group_columns}"
+            )
+        else:
+            merged = []
+            for function, column in measures:
+                stored = quote_identifier(measure_column(function, column))
+                combine = 'sum' if function in ('sum', 'count') else function
+                cast = '::BIGINT' if function == 'count' else ''
+                merged.append(f"{combine}({stored}){cast} AS {stored}")
+            con.execute(
+                f"CREATE OR REPLACE TABLE {summary} AS "
+                f"SELECT {group_columns}, {', '.join(merged)} FROM ("
+                f"SELECT * FROM {summary} UNION ALL BY NAME "
+                f"SELECT {group_columns}, {aggregates} FROM {source} WHERE rowid >= ? GROUP BY {group_columns}"
+                f") GROUP BY {group_columns}",
+                [incremental_from]
+            )
+        summary_rows = con.execute(f"SELECT count(*) FROM {summary}").fetchone()[0]
+        con.execute(
+            f"INSERT OR REPLACE INTO {AGGREGATE_CATALOG_TABLE} VALUES (?, ?, ?, ?, ?, ?, ?, current_timestamp)",
+            [
+                aggregate_name, definition['source'], definition['group_by'],
+                [f"{function}({column})" for function, column in measures],
+                _aggregate_definition_hash(definition), source_rows, summary_rows
+            ]
+        )
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+    mode = 'incrementally' if incremental_from is not None else 'fully'
+    print(f"Refreshed aggregate {aggregate_name} {mode} ({source_rows} source rows -> {summary_rows} summary rows)")
+    return summary_rows
+
+def _view_exists(con, view_name):
+    return con.execute(
+        "SELECT count(*) FROM duckdb_views() WHERE view_name = ? AND NOT internal", [view_name]
+    ).fetchone()[0] > 0
+
+def _stale_aggregates(con, aggregates, changed_tables):
+    """Returns (catalog, undeclared, stale) for the declared summary tables.
+
+    undeclared lists catalogued summaries that are no longer declared; stale lists declared ones
+    that are new, whose definition changed, whose table is missing, or whose source is in
+    changed_tables (reloaded, dropped or re-viewed by this load).
+    """
+    catalog = {}
+    if table_exists(con, AGGREGATE_CATALOG_TABLE):
+        catalog = {
+            row[0]: {'definition_hash': row[1], 'source_rows': row[2]}
+            for row in con.execute(
+                f"SELECT aggregate_name, definition_hash, source_rows FROM {AGGREGATE_CATALOG_TABLE}"
+            ).fetchall()
+        }
+    undeclared = sorted(set(catalog) - set(aggregates))
+    stale = []
+    for aggregate_name, definition in aggregates.items():
+        source_name = definition['source']
+        entry = catalog.get(aggregate_name)
+        current = (
+            entry is not None
+            and entry['definition_hash'] == _aggregate_definition_hash(definition)
+            and table_exists(con, aggregate_name)
+        )
+        if source_name in changed_tables:
+            stale.append(aggregate_name)
+        elif not table_exists(con, source_name) and not _view_exists(con, source_name):
+            # Nothing to build; only a leftover summary needs dropping
+            if entry is not None or table_exists(con, aggregate_name):
+                stale.append(aggregate_name)
+        elif not current:
+            stale.append(aggregate_name)
+    return catalog, undeclared, stale
+
+def refresh_aggregates(con, aggregates, loaded_tables, appended_tables=()):
+    """Brings every declared summary table up to date after an ingest.
+
+    Summaries whose source was not reloaded (or, for partitioned views, re-viewed) are left alone.
+    Sources in appended_tables, whose load only inserted rows into the existing table, are merged
+    incrementally; anything else is rebuilt. Summaries
+    that are no longer declared, or whose refresh fails, are dropped so queries never read a stale summary.
+    """
+    ensure_aggregate_catalog(con)
+    catalog, undeclared, stale = _stale_aggregates(con, aggregates, loaded_tables)
+    for aggregate_name in undeclared:
+        drop_aggregate(con, aggregate_name)
+        print(f"Dropped aggregate {aggregate_name} (no longer declared)")
+
+    for aggregate_name in stale:
+        definition = aggregates[aggregate_name]
+        source_name = definition['source']
+        entry = catalog.get(aggregate_name)
+        try:
+            source_is_table = table_exists(con, source_name)
+            if not source_is_table and not _view_exists(con, source_name):
+                drop_aggregate(con, aggregate_name)
+                print(f"Skipped aggregate {aggregate_name}: source {source_name} does not exist")
+                continue
+            current = (
+                entry is not None
+                and entry['definition_hash'] == _aggregate_definition_hash(definition)
+                and table_exists(con, aggregate_name)
+            )
+            incremental_from = None
+            if current and source_is_table and source_name in appended_tables:
+                source_rows = con.execute(f"SELECT count(*) FROM {quote_identifier(source_name)}").fetchone()[0]
+                if source_rows >= entry['source_rows']:
+                    incremental_from = entry['source_rows']
+            refresh_aggregate(con, aggregate_name, definition, incremental_from)
+        except Exception as e:
+            print(f"Error refreshing aggregate {aggregate_name}: {e}")
+            drop_aggregate(con, aggregate_name)
+
+def staging_path(db_path):
+    """Path of the staging copy that a publishing load writes to."""
+    return db_path + STAGING_SUFFIX
+
+def _database_fingerprint(db_path):
+    """Size and mtime of a database file and its WAL (None where missing), as a JSON-friendly list."""
+    fingerprint = []
+    for path in (db_path, db_path + '.wal'):
+        if os.path.exists(path):
+            stat = os.stat(path)
+            fingerprint.append([stat.st_size, stat.st_mtime_ns])
+        else:
+            fingerprint.append(None)
+    return fingerprint
+
+def _pending_chunked_loads(con):
+    """Returns how many chunked loads have committed batches but did not finish."""
+    if not table_exists(con, PROGRESS_TABLE):
+        return 0
+    return con.execute(f"SELECT count(*) FROM {PROGRESS_TABLE}").fetchone()[0]
+
+def discard_failed_load(con, db_path, path, table_name):
+    """Undoes the committed batches of a chunked load that failed with an error, in a staging database.
+
+    The file's progress is dropped and its table is copied back from the published database at
+    db_path (or dropped if it was not published yet), so the rest of the load can be published.
+    Only crashed or interrupted loads keep their progress for the next run to resume.
+    """
+    con.execute(f"DELETE FROM {PROGRESS_TABLE} WHERE path = ?", [path])
+    table = quote_identifier(table_name)
+    published = False
+    if os.path.exists(db_path):
+        con.execute(f"ATTACH {quote_literal(db_path)} AS _published (READ_ONLY)")
+        try:
+            published = con.execute(
+                "SELECT count(*) FROM duckdb_tables() WHERE database_name = '_published' AND schema_name = 'main' "
+                "AND table_name = ?", [table_name]
+            ).fetchone()[0] > 0
+            if published:
+                con.execute(f"CREATE OR REPLACE TABLE {table} AS SELECT * FROM _published.main.{table}")
+        finally:
+            con.execute("DETACH _published")
+    if not published:
+        con.execute(f"DROP TABLE IF EXISTS {table}")
+    print(f"Discarded the failed load of {path}; table {table_name} is {'kept as published' if published else 'left out'}")
+
+def resumable_staging(db_path):
+    """Returns True if a staging database holds an interrupted chunked load that can be resumed.
+
+    That is the case while the published database is still the one the staging copy was made
+    from; otherwise the staging copy is outdated and a new one is started.
+    """
+    staging = staging_path(db_path)
+    base_path = staging + STAGING_BASE_SUFFIX
+    if not os.path.exists(staging) or not os.path.exists(base_path):
+        return False
+    try:
+        with open(base_path, 'r', encoding='utf-8') as f:
+            base = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return False
+    if base != _database_fingerprint(db_path):
+        print(f"Discarding {staging}: {db_path} changed since it was staged")
+        return False
+    try:
+        con = duckdb.connect(database=staging, read_only=True)
+        try:
+            return _pending_chunked_loads(con) > 0
+        finally:
+            con.close()
+    except duckdb.Error as e:
+        print(f"Discarding unreadable staging database {staging}: {e}")
+        return False
+
+def prepare_staging(db_path, resume=False):
+    """Starts a staging database as a copy of the published one (or empty if none exists yet).
+
+    With resume=True the staging database of an interrupted chunked load (see resumable_staging)
+    is kept, so the load continues from its committed batches. Other leftovers are discarded.
+    A published database's WAL is copied along so no committed change is lost. Returns the staging path.
+    """
+    staging = staging_path(db_path)
+    if resume:
+        print(f"Resuming the interrupted load in {staging}")
+        return staging
+    for leftover in (staging, staging + '.wal', staging + STAGING_BASE_SUFFIX):
+        if os.path.exists(leftover):
+            os.remove(leftover)
+    if os.path.exists(db_path):
+        shutil.copyfile(db_path, staging)
+        if os.path.exists(db_path + '.wal'):
+            shutil.copyfile(db_path + '.wal', staging + '.wal')
+    with open(staging + STAGING_BASE_SUFFIX, 'w', encoding='utf-8') as f:
+        json.dump(_database_fingerprint(db_path), f)
+    return staging
+
+def open_load_database(db_path, publish=True, mode='native', resume=False):
+    """Opens the database a load writes to and returns (connection, staging path or None).
+
+    publish=True writes a staging copy that publish_snapshot swaps in once the load is complete,
+    so readers keep their snapshot meanwhile. publish=False writes db_path in place, which needs
+    exclusive access for the whole load. publish='auto' writes in place when no other connection
+    has db_path open as the load starts, saving a copy of the whole database, and stages otherwise;
+    a reader that connects while such a load runs gets a lock error. Chunked loads always stage
+    (unless publish=False), so a partly loaded table is never visible; resume continues the
+    staging database of an interrupted chunked load.
+    """
+    if publish not in PUBLISH_MODES:
+        raise ValueError(f"Unknown publish mode '{publish}'. Expected one of: True, False, 'auto'")
+    if publish is False:
+        return duckdb.connect(database=db_path, read_only=False), None
+    if publish == 'auto' and mode != 'chunked' and not resume:
+        try:
+            # Fails while any other connection (in this or another process) has the file open; a read-only
+            # connection in this process raises ConnectionException (different configuration)
+            con = duckdb.connect(database=db_path, read_only=False)
+            print(f"Writing {db_path} in place (no other connection has it open)")
+            return con, None
+        except (duckdb.IOException, duckdb.BinderException, duckdb.ConnectionException):
+            print(f"{db_path} is in use; staging the load")
+    staging = prepare_staging(db_path, resume)
+    return duckdb.connect(database=staging, read_only=False), staging
+
+def publish_snapshot(staging, db_path):
+    """Atomically replaces the published database with a fully checkpointed staging file.
+
+    Connections that already have the old file open keep reading that snapshot until they close;
+    new connections (and sql_retriever's handles, which watch the file's identity) see the new one.
+    """
+    if os.path.exists(staging + '.wal'):
+        raise RuntimeError(f"Staging database {staging} was not checkpointed; not publishing it")
+    with open(staging, 'rb') as f:
+        os.fsync(f.fileno())
+    # An old WAL must never be replayed against the new file; without it the old file is merely older
+    if os.path.exists(db_path + '.wal'):
+        os.remove(db_path + '.wal')
+    os.replace(staging, db_path)
+    if os.path.exists(staging + STAGING_BASE_SUFFIX):
+        os.remove(staging + STAGING_BASE_SUFFIX)
+    print(f"Published new snapshot of {db_path}")
+
+def _close_database(con, db_path, staging):
+    """Closes the load connection and, for publishing loads, swaps the staging file in.
+
+    A staging database with an unfinished chunked load (left by a crash or interrupt; loads that
+    fail with an error are discarded first, see discard_failed_load) is not published: it is kept,
+    and the next run resumes the load from it, so readers never see a partly loaded table.
+    Returns True if the load's changes are now visible to readers.
+    """
+    if staging is None:
+        con.close()
+        return True
+    if _pending_chunked_loads(con):
+        con.close()
+        print(f"Not publishing {db_path}: a chunked load did not finish. {staging} is kept and the next run resumes it")
+        return False
+    con.execute("CHECKPOINT")
+    con.close()
+    publish_snapshot(staging, db_path)
+    return True
+
+def fetch_arrow_table(result):
+    """Fetches a DuckDB result as a pyarrow Table across DuckDB versions."""
+    if hasattr(result, 'to_arrow_table'):
+        return result.to_arrow_table()
+    return result.fetch_arrow_table()
+
+def parse_csv(csv_file, mode='native'):
+    """Parses and type-checks a CSV file without writing it, returning an Arrow table or DataFrame."""
+    if mode == 'native':
+        try:
+            # A private in-memory connection per thread, so parser threads never share state
+            if not hasattr(_parser_connections, 'con'):
+                _parser_connections.con = duckdb.connect(database=':memory:')
+            parser = _parser_connections.con
+            return fetch_arrow_table(parser.execute(f"SELECT * FROM {source_scan_sql(csv_file)}", [csv_file]))
+        except duckdb.Error as e:
+            print(f"Native parse failed for {csv_file}, falling back to pandas: {e}")
+    return _read_source_pandas(csv_file)
+
+def write_parsed_table(con, table_name, data, table_options=None):
+    """Writes an already parsed Arrow table or DataFrame into a DuckDB table."""
+    con.register('_parsed_data', data)
+    try:
+        return write_table(con, table_name, '_parsed_data', table_options=table_options)
+    finally:
+        con.unregister('_parsed_data')
+
+def fetch_record_batches(result, batch_size):
+    """Returns a pyarrow RecordBatchReader over a DuckDB result across DuckDB versions."""
+    if hasattr(result, 'to_arrow_reader'):
+        return result.to_arrow_reader(batch_size)
+    return result.fetch_record_batch(batch_size)
+
+def _iter_csv_batches(csv_file, batch_size, memory_limit, native=True):
+    """Yields a CSV file as Arrow record batches (native) or DataFrame chunks (pandas) of at most batch_size rows."""
+    if native:
+        reader = duckdb.connect(database=':memory:')
+        try:
+            reader.execute(f"SET memory_limit = {quote_literal(memory_limit)}")
+            result = reader.execute(f"SELECT * FROM {source_scan_sql(csv_file)}", [csv_file])
+            yield from fetch_record_batches(result, batch_size)
+        finally:
+            reader.close()
+    else:
+        yield from _read_source_pandas(csv_file, chunksize=batch_size)
+
+def ensure_progress_table(con):
+    """Creates the chunked-ingest progress table if it does not exist yet."""
+    con.execute(f"""
+        CREATE TABLE IF NOT EXISTS {PROGRESS_TABLE} (
+            path VARCHAR PRIMARY KEY,
+            table_name VARCHAR,
+            content_hash VARCHAR,
+            rows_committed BIGINT,
+            updated_at TIMESTAMP
+        )
+    """)
+
+def _committed_rows(con, csv_file, content_hash):
+    """Returns how many rows of this exact file version were already committed by an interrupted run."""
+    row = con.execute(f"SELECT content_hash, rows_committed FROM {PROGRESS_TABLE} WHERE path = ?", [csv_file]).fetchone()
+    if row is None or row[0] != content_hash:
+        return 0
+    return row[1]
+
+def _write_chunks(con, csv_file, table_name, table_options, content_hash, batch_size, memory_limit, native, skip_rows=0,
+                  counts=None):
+    """Writes a CSV batch by batch, committing each batch together with its progress record.
+
+    Adds the rows written to counts['written'] (if given) and returns the rows of the file processed.
+    """
+    committed = _committed_rows(con, csv_file, content_hash)
+    if committed > skip_rows:
+        print(f"Resuming {csv_file} after {committed} committed rows")
+    committed = max(committed, skip_rows)
+    seen = 0
+    for batch in _iter_csv_batches(csv_file, batch_size, memory_limit, native):
+        num_rows = len(batch)
+        if seen + num_rows <= committed:
+            # Already committed by an earlier run
+            seen += num_rows
+            continue
+        if seen < committed:
+            batch = batch.slice(committed - seen) if native else batch.iloc[committed - seen:]
+            seen = committed
+        # Only the first batch of a 'replace' load recreates the table; later batches append
+        options = table_options if seen == 0 or table_options.get('load_mode') in ('append', 'upsert') else {'load_mode': 'append'}
+        con.execute("BEGIN TRANSACTION")
+        try:
+            con.register('_batch_data', batch)
+            written = write_table(con, table_name, '_batch_data', table_options=options, in_transaction=True)
+            seen += len(batch)
+            con.execute(
+                f"INSERT OR REPLACE INTO {PROGRESS_TABLE} VALUES (?, ?, ?, ?, current_timestamp)",
+                [csv_file, table_name, content_hash, seen]
+            )
+            con.execute("COMMIT")
+            if counts is not None:
+                counts['written'] += written
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+        finally:
+            con.unregister('_batch_data')
+    return seen
+
+def load_csv_chunked(con, csv_file, table_name, table_options=None, content_hash=None,
+                     batch_size=DEFAULT_BATCH_SIZE, memory_limit=DEFAULT_MEMORY_LIMIT, skip_rows=0):
+    """Loads a CSV file in fixed-size row batches so peak memory is set by batch_size, not file size.
+
+    Every batch is committed together with a progress record, so a run that crashes resumes
+    from the last committed batch of the same file version. The first skip_rows rows are
+    not written. Returns the rows written by this run.
+    """
+    table_options = table_options or {}
+    content_hash = content_hash or file_content_hash(csv_file)
+    ensure_progress_table(con)
+    con.execute(f"SET memory_limit = {quote_literal(memory_limit)}")
+    counts = {'written': 0}
+    try:
+        _write_chunks(
+            con, csv_file, table_name, table_options, content_hash, batch_size, memory_limit, native=True,
+            skip_rows=skip_rows, counts=counts
+        )
+    except duckdb.Error as e:
+        # Restart from the last committed batch with the pandas chunk reader
+        print(f"Native chunked load failed for {csv_file}, falling back to pandas: {e}")
+        _write_chunks(
+            con, csv_file, table_name, table_options, content_hash, batch_size, memory_limit, native=False,
+            skip_rows=skip_rows, counts=counts
+        )
+    con.execute(f"DELETE FROM {PROGRESS_TABLE} WHERE path = ?", [csv_file])
+    return counts['written']
+
+def load_csv(con, csv_file, table_name, mode='native', table_options=None, content_hash=None,
+             batch_size=DEFAULT_BATCH_SIZE, memory_limit=DEFAULT_MEMORY_LIMIT, skip_rows=0):
+    """Loads a CSV file into a DuckDB table using the given ingest mode, returning the rows written.
+
+    skip_rows leaves out the file's first rows (see check_for_changes); it is ignored when the
+    table does not exist, which is then created from the whole file.
+    """
+    if skip_rows and not table_exists(con, table_name):
+        skip_rows = 0
+    if mode == 'chunked':
+        return load_csv_chunked(con, csv_file, table_name, table_options, content_hash, batch_size, memory_limit, skip_rows)
+    if mode == 'native':
+        try:
+            return load_csv_native(con, csv_file, table_name, table_options, skip_rows)
+        except duckdb.Error as e:
+            # Files the DuckDB sniffer cannot handle fall back to the pandas reader
+            print(f"Native load failed for {csv_file}, falling back to pandas: {e}")
+    return load_csv_pandas(con, csv_file, table_name, table_options, skip_rows)
+
+def check_for_changes(manifest, csv_file, table_name, incremental=True, table_options=None):
+    """Returns a work item for csv_file if it needs (re)loading or a manifest refresh, or None if it is unchanged.
+
+    Nothing is written here. A file that was touched but has identical content gets an item
+    with reload=False: only its manifest entry is refreshed, the table is kept.
+    For a keyless append table, the item's skip_rows is the number of rows already loaded when
+    the file only grew; if earlier content changed, the item reloads the table from the whole file.
+    """
+    stat = os.stat(csv_file)
+    entry = manifest.get(csv_file)
+    table_options = table_options or {}
+    content_hash = None
+    reload = True
+    skip_rows = 0
+    if not incremental and _is_keyless_append(table_options):
+        # Re-inserting the whole file would duplicate its rows; a full reload rebuilds the table from it
+        table_options = dict(table_options, load_mode='replace')
+    if incremental and entry:
+        # Unchanged size and mtime: skip without reading the file at all
+        if entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            return None
+        if _is_keyless_append(table_options):
+            content_hash, prefix_hash = file_content_hashes(csv_file, entry['size'])
+            reload = entry['content_hash'] != content_hash
+            if reload:
+                if _appended_only(csv_file, entry, stat.st_size, prefix_hash):
+                    skip_rows = entry['rows_loaded']
+                else:
+                    print(f"{csv_file} changed before its end; reloading table {table_name} from the whole file")
+                    table_options = dict(table_options, load_mode='replace')
+        else:
+            content_hash = file_content_hash(csv_file)
+            reload = entry['content_hash'] != content_hash
+    return {
+        'path': csv_file,
+        'table_name': table_name,
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'content_hash': content_hash,
+        'options': table_options,
+        'reload': reload,
+        'skip_rows': skip_rows,
+        'rows_loaded': entry.get('rows_loaded') if entry else None
+    }
+
+def _appended_only(csv_file, entry, size, prefix_hash):
+    """True if a file only had rows appended since it was loaded, so its first rows_loaded rows are unchanged.
+
+    The file must have grown, start with exactly the previously loaded bytes, and those must have
+    ended with a complete line. Compressed files are never treated as appended to.
+    """
+    if entry.get('rows_loaded') is None or size <= entry['size'] or prefix_hash != entry['content_hash']:
+        return False
+    name = os.path.basename(csv_file).lower()
+    if name.endswith(('.gz', '.zst')):
+        return False
+    with open(csv_file, 'rb') as f:
+        f.seek(entry['size'] - 1)
+        return f.read(1) == b'\n'
+
+def _finish_item(con, item, rows_written, report_entry):
+    """Records a successfully loaded work item in the manifest and the timing report entry."""
+    rows_loaded = None
+    if item['options'].get('load_mode', 'replace') == 'replace' or _is_keyless_append(item['options']):
+        # The table holds exactly this file's rows, and counting them is a metadata lookup
+        rows_loaded = con.execute(f"SELECT count(*) FROM {quote_identifier(item['table_name'])}").fetchone()[0]
+    record_manifest_entry(
+        con, item['path'], item['table_name'], item['size'], item['mtime_ns'],
+        item['content_hash'] or file_content_hash(item['path']), rows_loaded
+    )
+    if table_exists(con, PROGRESS_TABLE):
+        # A file loaded in another mode no longer has a chunked load to resume
+        con.execute(f"DELETE FROM {PROGRESS_TABLE} WHERE path = ?", [item['path']])
+    report_entry['rows'] = rows_written
+    report_entry['status'] = 'loaded'
+    print(f"Loaded {item['path']} into table {item['table_name']} ({rows_written} rows, {item['options'].get('load_mode', 'replace')})")
+
+def _load_sequential(con, items, mode, batch_size=DEFAULT_BATCH_SIZE, memory_limit=DEFAULT_MEMORY_LIMIT):
+    """Loads work items one at a time on the writer connection."""
+    report = []
+    for item in items:
+        entry = {'file': item['path'], 'table_name': item['table_name'], 'status': 'error', 'rows': None,
+                 'parse_seconds': None, 'write_seconds': None}
+        start = time.perf_counter()
+        try:
+            if mode == 'chunked' and item['content_hash'] is None:
+                # Resuming needs the file version up front
+                item['content_hash'] = file_content_hash(item['path'])
+            rows_written = load_csv(
+                con, item['path'], item['table_name'], mode, item['options'], item['content_hash'],
+                batch_size, memory_limit, item.get('skip_rows', 0)
+            )
+            entry['write_seconds'] = time.perf_counter() - start
+            _finish_item(con, item, rows_written, entry)
+        except Exception as e:
+            print(f"Error loading {item['path']}: {e}")
+        report.append(entry)
+    return report
+
+def _parse_worker(item, mode, results):
+    """Parses one work item in a pool thread and hands the result to the writer through the queue."""
+    start = time.perf_counter()
+    data, error = None, None
+    try:
+        data = parse_csv(item['path'], mode)
+        if item['content_hash'] is None:
+            item['content_hash'] = file_content_hash(item['path'])
+    except Exception as e:
+        error = e
+    # Blocks while the queue is full, which bounds how many parsed files are held in memory
+    results.put((item, data, error, time.perf_counter() - start))
+
+def _load_parallel(con, items, mode, workers, queue_size=None):
+    """Parses work items on a thread pool and writes them through the single DuckDB writer connection."""
+    results = queue.Queue(maxsize=queue_size or workers)
+    report = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for item in items:
+            executor.submit(_parse_worker, item, mode, results)
+        # Only this thread writes to DuckDB, which allows a single writer per database file
+        for _ in range(len(items)):
+            item, data, error, parse_seconds = results.get()
+            entry = {'file': item['path'], 'table_name': item['table_name'], 'status': 'error', 'rows': None,
+                     'parse_seconds': parse_seconds, 'write_seconds': None}
+            if error is not None:
+                print(f"Error parsing {item['path']}: {error}")
+            else:
+                start = time.perf_counter()
+                try:
+                    skip_rows = item.get('skip_rows', 0) if table_exists(con, item['table_name']) else 0
+                    rows_written = write_parsed_table(con, item['table_name'], _skip_rows(data, skip_rows), item['options'])
+                    entry['write_seconds'] = time.perf_counter() - start
+                    _finish_item(con, item, rows_written, entry)
+                except Exception as e:
+                    print(f"Error loading {item['path']}: {e}")
+            # Release the parsed data before taking the next item off the queue
+            data = None
+            report.append(entry)
+    return report
+
+def load_items(con, items, mode='native', workers=1, batch_size=DEFAULT_BATCH_SIZE, memory_limit=DEFAULT_MEMORY_LIMIT):
+    """Loads work items (see check_for_changes) through con and records them in the manifest.
+
+    This is the ingest step of load_structured_data alone, without staging, statistics,
+    summary tables or Parquet exports. Returns the per-file timing report.
+    """
+    if workers > 1 and len(items) > 1 and mode != 'chunked':
+        return _load_parallel(con, items, mode, workers)
+    return _load_sequential(con, items, mode, batch_size, memory_limit)
+
+def print_load_report(report, elapsed):
+    """Prints per-file timings and the overall throughput of a load run."""
+    if not report:
+        return
+    print(f"{'table':<30} {'status':<8} {'rows':>12} {'parse s':>9} {'write s':>9}")
+    for entry in report:
+        rows = entry['rows'] if entry['rows'] is not None else '-'
+        parse_seconds = f"{entry['parse_seconds']:.3f}" if entry['parse_seconds'] is not None else '-'
+        write_seconds = f"{entry['write_seconds']:.3f}" if entry['write_seconds'] is not None else '-'
+        print(f"{entry['table_name']:<30} {entry['status']:<8} {rows:>12} {parse_seconds:>9} {write_seconds:>9}")
+    loaded = sum(1 for entry in report if entry['status'] == 'loaded')
+    print(f"Loaded {loaded}/{len(report)} files in {elapsed:.3f}s")
+
+def _list_sources(data_dir):
+    """Returns (source files, partitioned datasets, conflicts) found in data_dir.
+
+    Sources that map to the same table name (e.g. x.csv and x.csv.gz, or x.ndjson and a
+    partitioned directory x/) are left out of both lists; conflicts maps each such table name
+    to its source paths.
+    """
+    source_files = sorted(
+        entry.path for entry in os.scandir(data_dir)
+        if entry.is_file() and source_format(entry.name) is not None
+    )
+    partitioned_datasets = find_partitioned_datasets(data_dir)
+    # DuckDB table names are case-insensitive
+    claims = {}
+    for source_file in source_files:
+        claims.setdefault(source_table_name(source_file).lower(), []).append((source_table_name(source_file), source_file))
+    for table_name, dataset_dir in partitioned_datasets.items():
+        claims.setdefault(table_name.lower(), []).append((table_name, dataset_dir))
+    conflicts = {sources[0][0]: [path for _, path in sources] for sources in claims.values() if len(sources) > 1}
+    excluded = {path for paths in conflicts.values() for path in paths}
+    source_files = [path for path in source_files if path not in excluded]
+    partitioned_datasets = {name: path for name, path in partitioned_datasets.items() if path not in excluded}
+    return source_files, partitioned_datasets, conflicts
+
+def _tables_missing_stats(con):
+    """Loaded tables (not partitioned views) that have no statistics in the catalog yet."""
+    return [table_name for (table_name,) in con.execute(
+        f"SELECT DISTINCT table_name FROM {MANIFEST_TABLE} "
+        f"WHERE NOT starts_with(content_hash, ?) AND table_name NOT IN (SELECT table_name FROM {STATS_TABLE})",
+        [PARTITIONED_SOURCE]
+    ).fetchall()]
+
+def _finish_load(con, db_path, staging, prune_dirs):
+    """Closes (and publishes) the load database, then removes Parquet copies the published catalog no longer lists."""
+    catalogued = catalogued_parquet_exports(con) if prune_dirs else {}
+    if _close_database(con, db_path, staging) and prune_dirs:
+        prune_parquet_exports(prune_dirs, catalogued)
+
+def _conflict_report(conflicts):
+    """Report entries (status 'error') for sources left out because they map to the same table."""
+    return [
+        {'file': path, 'table_name': table_name, 'status': 'error', 'rows': None, 'parse_seconds': None, 'write_seconds': None}
+        for table_name, paths in conflicts.items() for path in paths
+    ]
+
+def plan_load(db_path, data_dir, table_config=None, aggregates=None, incremental=True, parquet_dir=None):
+    """Works out what a load has to do, reading db_path (if it exists) without writing to it.
+
+    Returns a dict with the work items of new, changed or touched source files (see
+    check_for_changes), views: the partitioned datasets whose views must be (re)created, and
+    pending, which is False when the load would change nothing: no file to load, no table to
+    drop, no view to refresh, and no statistics, summary tables or Parquet copies (with
+    parquet_dir set) out of date.
+    """
+    table_config = table_config or {}
+    aggregates = aggregates or {}
+    source_files, partitioned_datasets, conflicts = _list_sources(data_dir)
+    for table_name, paths in conflicts.items():
+        print(f"Error: {', '.join(paths)} all map to table {table_name}; none of them is loaded until only one remains")
+    manifest = {}
+    con = duckdb.connect(database=db_path, read_only=True) if os.path.exists(db_path) else None
+    try:
+        has_catalogs = con is not None and table_exists(con, MANIFEST_TABLE) and table_exists(con, STATS_TABLE)
+        if has_catalogs:
+            manifest = read_manifest(con)
+        manifest_sources = {}
+        for path, entry in manifest.items():
+            manifest_sources.setdefault(entry['table_name'].lower(), set()).add(path)
+
+        def shared(table_name, path):
+            # The table was (also) loaded from another source, so its contents may not be this source's
+            return bool(manifest_sources.get(table_name.lower(), set()) - {path})
+
+        items = []
+        for source_file in source_files:
+            table_name = source_table_name(source_file)
+            item = check_for_changes(
+                manifest, source_file, table_name, incremental and not shared(table_name, source_file),
+                table_config.get(table_name)
+            )
+            if item is not None:
+                items.append(item)
+        views = {
+            table_name: dataset_dir for table_name, dataset_dir in partitioned_datasets.items()
+            if not incremental or shared(table_name, dataset_dir)
+            or partitioned_view_changed(manifest, table_name, dataset_dir, table_config.get(table_name))
+        }
+        stale = [path for path in manifest if not os.path.exists(path)]
+        pending = not has_catalogs or bool(items or views or stale)
+        if not pending:
+            _, undeclared, stale_aggregates = _stale_aggregates(con, aggregates, set())
+            pending = bool(_tables_missing_stats(con) or undeclared or stale_aggregates)
+        if not pending and parquet_dir:
+            pending = bool(stale_parquet_exports(con, parquet_dir))
+    finally:
+        if con is not None:
+            con.close()
+    return {'items': items, 'views': views, 'pending': pending, 'conflicts': conflicts}
+
+def load_structured_data(data_dir='data/structured', db_path='data/structured/structured_data.duckdb', mode='native',
+                         incremental=True, workers=1, config_path=TABLE_CONFIG_PATH,
+                         batch_size=DEFAULT_BATCH_SIZE, memory_limit=DEFAULT_MEMORY_LIMIT, parquet_dir=None,
+                         publish=True):
+    """Loads CSV files from a directory into a DuckDB database.
+
+    Top-level CSV and NDJSON files (plain, .gz or .zst) become tables; subdirectories laid out as <table>/<key>=<value>/*.csv
+    become views over DuckDB's hive-partitioned reader, so partition filters prune files.
+
+    With incremental=True only files that are new or changed since the last run
+    (according to the manifest) are reloaded, and tables whose source file is gone are dropped.
+    A run with nothing to do returns without opening the database for writing.
+    With workers > 1 files are parsed on a thread pool and written by a single DuckDB writer.
+    Per-table load modes (replace, append, upsert) are read from config_path.
+    mode='chunked' inserts batch_size rows at a time under a DuckDB memory_limit and
+    resumes an interrupted file from its last committed batch.
+    With parquet_dir set, every table is also written there as Parquet, sorted by the table's
+    configured sort_keys (and row_group_size, if given), whenever its copy is missing or older than its last load.
+    Summary tables declared under "aggregates" in config_path are refreshed after the load.
+    By default (publish=True) the load runs against a staging copy of db_path that replaces it
+    atomically once complete, so queries keep running on the previous snapshot meanwhile.
+    publish=False writes db_path in place (and needs exclusive access to it for the whole load);
+    publish='auto' writes in place when no other connection has db_path open as the load starts
+    and stages otherwise (see open_load_database).
+    Returns a per-file timing report (a list of dicts).
+    """
+    if mode not in INGEST_MODES:
+        raise ValueError(f"Unknown ingest mode '{mode}'. Expected one of: {', '.join(INGEST_MODES)}")
 
-def load_structured_data(data_dir='data/structured', db_path='data/structured/structured_data.duckdb'):
-    """Loads CSV files from a directory into a DuckDB database."""
     # Create data directory if it doesn't exist
     os.makedirs(data_dir, exist_ok=True)
 
+    table_config = load_table_config(config_path)
+    aggregates = load_aggregate_config(config_path)
+
+    # An interrupted chunked load is continued in its staging copy, so plan against that copy
+    resume = publish is not False and resumable_staging(db_path)
+    plan = plan_load(
+        staging_path(db_path) if resume else db_path, data_dir, table_config, aggregates, incremental, parquet_dir
+    )
+    if not plan['pending'] and not resume:
+        print(f"{db_path} is up to date; nothing to load from {data_dir}")
+        return _conflict_report(plan['conflicts'])
+
     # Connect to DuckDB
-    con = duckdb.connect(database=db_path, read_only=False)
+    con, staging = open_load_database(db_path, publish, mode, resume)
 
-    # Get list of CSV files
-    csv_files = glob.glob(os.path.join(data_dir, '*.csv'))
+    # Get list of source files (CSV and NDJSON, plain or compressed) and partitioned directories
+    csv_files, partitioned_datasets, conflicts = _list_sources(data_dir)
 
-    if not csv_files:
-        print(f"No CSV files found in {data_dir}")
-        return
+    ensure_manifest(con)
+    manifest = read_manifest(con)
+    # Conflicting sources still exist, so their table is kept until the conflict is resolved
+    live_tables = [source_table_name(path) for path in csv_files] + list(partitioned_datasets) + list(conflicts)
+    dropped = drop_stale_tables(con, manifest, live_tables)
+    ensure_stats_table(con)
+    for table_name in dropped:
+        con.execute(f"DELETE FROM {STATS_TABLE} WHERE table_name = ?", [table_name])
+    # Directories whose superseded Parquet copies are removed once this load is published
+    prune_dirs = {parquet_dir} if parquet_dir else set()
+    for table_name in dropped:
+        dropped_export = drop_parquet_export(con, table_name)
+        if dropped_export:
+            prune_dirs.add(os.path.dirname(dropped_export))
+
+    if not csv_files and not partitioned_datasets:
+        print(f"No CSV or NDJSON files found in {data_dir}")
+        # Stale tables may have been dropped, so this still publishes
+        _finish_load(con, db_path, staging, prune_dirs)
+        return _conflict_report(conflicts)
 
-    for csv_file in csv_files:
-        table_name = os.path.splitext(os.path.basename(csv_file))[0]
+    # Views only need recreating when their files or definition changed
+    # (their globs are expanded at query time, so they always read the current partitions)
+    created_views = set()
+    for table_name, dataset_dir in plan['views'].items():
         try:
-            # Read CSV into pandas DataFrame
-            df = pd.read_csv(csv_file)
-            # Load DataFrame into DuckDB table
-            con.execute(f"CREATE OR REPLACE TABLE {table_name} AS SELECT * FROM df")
-            print(f"Loaded {csv_file} into table {table_name}")
+            create_partitioned_view(con, table_name, dataset_dir, table_config.get(table_name))
+            created_views.add(table_name)
         except Exception as e:
-            print(f"Error loading {csv_file}: {e}")
+            print(f"Error creating partitioned view {table_name} for {dataset_dir}: {e}")
 
-    # Close connection
-    con.close()
+    items = []
+    for item in plan['items']:
+        if item['reload']:
+            items.append(item)
+        else:
+            # Touched but identical content: refresh the manifest, keep the table
+            record_manifest_entry(
+                con, item['path'], item['table_name'], item['size'], item['mtime_ns'], item['content_hash'], item['rows_loaded']
+            )
+            print(f"Skipping unchanged {item['path']} (content hash matches)")
+    if table_exists(con, PROGRESS_TABLE):
+        # Progress of files that no longer need loading can never be resumed
+        con.execute(
+            f"DELETE FROM {PROGRESS_TABLE} WHERE NOT list_contains(?::VARCHAR[], path)", [[item['path'] for item in items]]
+        )
+
+    # Summaries over sources that only get rows appended can be merged incrementally
+    appending = {
+        item['table_name'] for item in items
+        if item['options'].get('load_mode') == 'append' and table_exists(con, item['table_name'])
+    }
+
+    start = time.perf_counter()
+    report = load_items(con, items, mode, workers, batch_size, memory_limit)
+    if staging is not None and table_exists(con, PROGRESS_TABLE):
+        # A file that failed with an error would fail again on resume and hold back the whole snapshot
+        failed = {entry['file']: entry['table_name'] for entry in report if entry['status'] == 'error'}
+        pending = {path for (path,) in con.execute(f"SELECT path FROM {PROGRESS_TABLE}").fetchall()}
+        for path in sorted(failed.keys() & pending):
+            try:
+                discard_failed_load(con, db_path, path, failed[path])
+            except Exception as e:
+                print(f"Error discarding the failed load of {path}: {e}")
+    report.extend(_conflict_report(conflicts))
+    print_load_report(report, time.perf_counter() - start)
+
+    # Refresh statistics for reloaded tables and backfill tables that have none yet.
+    # Partitioned views are skipped: collecting their statistics would scan every partition.
+    stale_stats = {entry['table_name'] for entry in report if entry['status'] == 'loaded'}
+    stale_stats.update(_tables_missing_stats(con))
+    for table_name in sorted(stale_stats):
+        try:
+            collect_table_stats(con, table_name)
+        except Exception as e:
+            print(f"Error collecting statistics for {table_name}: {e}")
+
+    # Summary tables are refreshed after every ingest, before anyone can query the new rows
+    if aggregates or table_exists(con, AGGREGATE_CATALOG_TABLE):
+        loaded_tables = {entry['table_name'] for entry in report if entry['status'] == 'loaded'}
+        refresh_aggregates(con, aggregates, loaded_tables | created_views | set(dropped), appending & loaded_tables)
+
+    # Export reloaded tables, and any table whose copy is missing (e.g. parquet_dir was just turned on)
+    if parquet_dir:
+        for table_name in stale_parquet_exports(con, parquet_dir):
+            options = table_config.get(table_name, {})
+            try:
+                export_parquet(
+                    con, table_name, parquet_dir, options.get('sort_keys'),
+                    options.get('row_group_size', DEFAULT_ROW_GROUP_SIZE)
+                )
+            except Exception as e:
+                print(f"Error exporting {table_name} to Parquet: {e}")
+
+    # Close connection (and publish the staged snapshot)
+    _finish_load(con, db_path, staging, prune_dirs)
+    return report
 
 if __name__ == "__main__":
-    load_structured_data() 
\ No newline at end of file
+    load_structured_data()
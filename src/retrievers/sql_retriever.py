@@ -1,16 +1,1177 @@
+import asyncio
+import base64
+import datetime
 import duckdb
+import glob
+import hashlib
+import itertools
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+import weakref
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 import pandas as pd
 
-def get_sql_data(query, db_path='data/structured/structured_data.duckdb'):
-    """Executes a SQL query against the DuckDB database and returns results as a pandas DataFrame."""
+# Add the parent directory of src to the Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+
+# SQL quoting, Arrow fetching and the names of the catalogs the loader maintains are shared with it:
+# the ingest manifest, the sorted Parquet copies and their catalog (see load_structured_data(parquet_dir=...)),
+# the statistics catalog, and the summary table catalog with its measure column naming
+from src.ingest.structured_loader import (
+    AGGREGATE_CATALOG_TABLE, MANIFEST_TABLE, PARQUET_CATALOG_TABLE, PARQUET_DIR, STATS_TABLE, TABLE_CONFIG_PATH,
+    fetch_arrow_table, fetch_record_batches, measure_column, quote_identifier, quote_literal
+)
+
+DB_PATH = 'data/structured/structured_data.duckdb'
+
+# Result formats of get_sql_data: a pandas DataFrame, a pyarrow Table, or an iterator of
+# pyarrow RecordBatches that streams the result without materializing it
+RESULT_FORMATS = ('pandas', 'arrow', 'batches')
+DEFAULT_BATCH_SIZE = 100000
+
+# Per-query deadline in seconds (None disables it); runaway queries are stopped through DuckDB's interrupt
+DEFAULT_QUERY_TIMEOUT = 30.0
+
+# Opt-in profiling (enable_profiling): queries slower than the threshold go to the slow-query log with their plan
+SLOW_QUERY_LOG_PATH = 'logs/slow_queries.jsonl'
+DEFAULT_SLOW_QUERY_SECONDS = 1.0
+PROFILE_HISTORY_SIZE = 100
+
+# Async API: queries run on a bounded pool of worker threads (each with its own cursor),
+# and at most this many run at once per event loop; the rest wait without blocking the loop
+ASYNC_MAX_CONCURRENCY = 8
+
+# Rows per page for paginated SQL results (get_sql_page)
+DEFAULT_PAGE_SIZE = 50
+
+# Memory budget of the in-process SQL result cache
+RESULT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# Statements that may return different results against the same database version are never cached
+_UNCACHEABLE_SQL = re.compile(r'\b(random|uuid|gen_random_uuid|now|current_\w+|today|read_\w+|glob)\b', re.IGNORECASE)
+_CACHEABLE_PREFIXES = ('select', 'with', 'from', 'values', 'table', 'describe', 'show', 'summarize')
+_SQL_STRING_LITERAL = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")")
+
+# Matching GROUP BY queries are answered from the summary tables in structured_loader's AGGREGATE_CATALOG_TABLE
+_AGGREGATE_QUERY = re.compile(
+    r'^select (?P<select>.+?) from (?P<table>"?[A-Za-z_]\w*"?)(?: where (?P<where>.+?))? group by (?P<group>.+?)'
+    r'(?P<tail> (?:having|order by|limit) .*)?$',
+    re.IGNORECASE
+)
+_AGGREGATE_CALL = re.compile(r'\b(sum|count|min|max|avg)\s*\(\s*(\*|"?[A-Za-z_]\w*"?)\s*\)', re.IGNORECASE)
+_UNSUPPORTED_AGGREGATE_SQL = re.compile(
+    r'\b(select|join|union|intersect|except|over|distinct|filter|qualify|grouping|rollup|cube|all|using|sample)\b', re.IGNORECASE
+)
+_SELECT_ITEM = re.compile(r'^(?P<expr>.+?)(?:(?: as)? (?P<alias>"?[A-Za-z_]\w*"?))?$', re.IGNORECASE)
+_SQL_IDENTIFIER = re.compile(r'^"?([A-Za-z_]\w*)"?$')
+_SQL_WORD = re.compile(r'"(?:[^"]|"")*"|\b[A-Za-z_]\w*\b(?!\s*\()')
+_SQL_SINGLE_QUOTED = re.compile(r"'(?:[^']|'')*'")
+_STASHED_LITERAL = re.compile(r'__literal_(\d+)__')
+_SQL_COMMENT = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")|--[^\n]*|/\*.*?\*/", re.DOTALL)
+# Words that may appear in a WHERE clause besides the summary's group-by columns (unless the source has such a column)
+_WHERE_KEYWORDS = {
+    'and', 'or', 'not', 'in', 'is', 'null', 'between', 'like', 'ilike', 'true', 'false', 'as', 'case', 'when',
+    'then', 'else', 'end', 'date', 'timestamp', 'time', 'interval', 'varchar', 'integer', 'bigint', 'double',
+    'decimal', 'boolean', 'day', 'days', 'month', 'months', 'year', 'years', 'hour', 'hours'
+}
+
+# External files queried in place (register_external_view), optionally declared under "external" in the table config
+# (structured_loader's TABLE_CONFIG_PATH), e.g. {"external": {"clickstream": {"path": "archive/clicks/*.parquet"}}}
+EXTERNAL_FORMATS = ('csv', 'parquet', 'ndjson')
+_EXTERNAL_SUFFIXES = {'.parquet': 'parquet', '.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson'}
+_SQL_NAME_WORD = re.compile(r'[A-Za-z_]\w*')
+
+# Placeholders in query templates: $name, outside string literals
+_TEMPLATE_PARAMETER = re.compile(r'\$([A-Za-z_]\w*)')
+_PLAIN_NAME = re.compile(r'^[A-Za-z_]\w*$')
+
+# Process-wide connection manager: one shared read-only DuckDB handle per database file, plus one
+# cursor per thread. Reusing them keeps DuckDB's buffer cache and catalog warm between queries.
+# A shared handle holds DuckDB's read lock on the file; call close_connections() to release it.
+# structured_loader publishes by swapping in a new file, which handles pick up on their next query.
+_handles = {}
+_handles_lock = threading.Lock()
+_handle_generations = itertools.count(1)
+_thread_state = threading.local()
+# Every handle attaches its file under this name, whatever the file is called (a name such as
+# memory, system or temp, taken from the file, would clash with DuckDB's built-in catalogs)
+SNAPSHOT_ALIAS = 'snapshot'
+
+def _database_signature(db_path):
+    """Returns a cheap fingerprint of a database file (and its WAL) that changes when the file is rewritten or replaced."""
+    signature = []
+    for path in (db_path, db_path + '.wal'):
+        if os.path.exists(path):
+            stat = os.stat(path)
+            signature.append((stat.st_ino, stat.st_size, stat.st_mtime_ns))
+        elif path == db_path:
+            raise FileNotFoundError(f"DuckDB database not found: {db_path}")
+    return tuple(signature)
+
+def _get_handle(db_path):
+    """Returns the shared read-only handle for db_path, reconnecting if the file changed since it was opened."""
+    key = os.path.abspath(db_path)
+    signature = _database_signature(key)
+    with _handles_lock:
+        handle = _handles.get(key)
+        if handle is None or handle['signature'] != signature:
+            # The previous handle is not closed here: other threads may still be reading through its
+            # cursors. It is released once the last of them moves on to the new handle.
+            # duckdb.connect() would hand back the instance that still holds the old file open, so each
+            # handle attaches the file to its own in-memory instance and sees the snapshot published now.
+            con = duckdb.connect()
+            con.execute(f"ATTACH {quote_literal(key)} AS {SNAPSHOT_ALIAS} (READ_ONLY)")
+            handle = {
+                'con': con,
+                'signature': signature,
+                'generation': next(_handle_generations)
+            }
+            _handles[key] = handle
+        return handle
+
+def _new_cursor(handle):
+    """Opens a cursor on a handle that resolves unqualified names in the attached database."""
+    cursor = handle['con'].cursor()
+    cursor.execute(f"USE {SNAPSHOT_ALIAS}")
+    return cursor
+
+def _get_cursor_state(db_path=DB_PATH):
+    """Returns this thread's cursor state for db_path, creating a cursor on the current shared handle if needed."""
+    handle = _get_handle(db_path)
+    if not hasattr(_thread_state, 'cursors'):
+        _thread_state.cursors = {}
+    key = os.path.abspath(db_path)
+    state = _thread_state.cursors.get(key)
+    if state is None or state['generation'] != handle['generation']:
+        state = {
+            'cursor': _new_cursor(handle),
+            'generation': handle['generation'],
+            'signature': handle['signature'],
+            'parquet_views': None,
+            'parquet_view_names': set(),
+            'templates': set(),
+            'profiling': False,
+            'aggregates': None,
+            'external_version': 0,
+            'external_views': set()
+        }
+        _thread_state.cursors[key] = state
+    return state
+
+def get_cursor(db_path=DB_PATH):
+    """Returns this thread's DuckDB cursor on the shared read-only handle for db_path."""
+    return _get_cursor_state(db_path)['cursor']
+
+def close_connections():
+    """Closes all shared DuckDB handles (e.g. before writing to the database in place from this process)."""
+    with _handles_lock:
+        for handle in _handles.values():
+            try:
+                handle['con'].close()
+            except duckdb.Error:
+                pass
+        _handles.clear()
+
+class QueryResultCache:
+    """Thread-safe LRU cache of query results (DataFrames) bounded by their total memory size."""
+
+    def __init__(self, max_bytes=RESULT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Returns a copy of the cached DataFrame for key, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            df = entry[0]
+        # Copied so callers can modify their result without corrupting the cache
+        return df.copy()
+
+    def put(self, key, df):
+        """Stores a copy of df under key, evicting least recently used entries to stay within budget."""
+        size = int(df.memory_usage(index=True, deep=True).sum())
+        if size > self.max_bytes:
+            return
+        df = df.copy()
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (df, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        """Drops all cached results (counters are kept)."""
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        """Returns hit/miss counters and memory usage."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes
+            }
+
+_result_cache = QueryResultCache()
+
+def strip_sql_comments(query):
+    """Replaces -- and /* */ comments outside string literals and quoted names with a space."""
+    return _SQL_COMMENT.sub(lambda m: m.group(1) or ' ', query)
+
+def normalize_sql(query):
+    """Normalizes SQL text for cache keys: drops comments, collapses whitespace outside string literals and drops trailing semicolons.
+
+    Comments go first: once newlines are collapsed a -- comment would swallow the SQL after it.
+    """
+    parts = _SQL_STRING_LITERAL.split(strip_sql_comments(query).strip())
+    # Odd indexes are the quoted literals captured by the split, which are kept verbatim
+    normalized = ''.join(part if i % 2 else re.sub(r'\s+', ' ', part) for i, part in enumerate(parts))
+    return normalized.strip().rstrip(';').strip()
+
+def _is_cacheable(normalized_query):
+    """Returns True for read-only statements whose result only depends on the database contents."""
+    unquoted = ''.join(_SQL_STRING_LITERAL.split(normalized_query)[::2])
+    return normalized_query.lower().startswith(_CACHEABLE_PREFIXES) and not _UNCACHEABLE_SQL.search(unquoted)
+
+def get_result_cache_stats():
+    """Returns hit/miss counters and memory usage of the SQL result cache."""
+    return _result_cache.stats()
+
+def clear_result_cache():
+    """Empties the SQL result cache."""
+    _result_cache.clear()
+
+def current_parquet_copies(con, parquet_dir=PARQUET_DIR):
+    """Returns {table name: Parquet file} for the copies in parquet_dir exported after their table's last load.
+
+    Copies the export catalog does not list, or that predate a reload, are ignored so queries
+    never read data older than the table.
+    """
+    has_catalog = con.execute(
+        "SELECT count(*) FROM duckdb_tables() WHERE schema_name = 'main' AND table_name = ?", [PARQUET_CATALOG_TABLE]
+    ).fetchone()[0] > 0
+    if not has_catalog:
+        return {}
+    rows = con.execute(f"""
+        SELECT e.table_name, e.path
+        FROM {PARQUET_CATALOG_TABLE} e
+        JOIN (SELECT table_name, max(loaded_at) AS loaded_at FROM {MANIFEST_TABLE} GROUP BY table_name) m
+          USING (table_name)
+        WHERE e.exported_at >= m.loaded_at
+    """).fetchall()
+    copies = {}
+    for table_name, path in rows:
+        if os.path.dirname(path) == os.path.abspath(parquet_dir) and os.path.exists(path):
+            copies[table_name] = path
+    return copies
+
+def register_parquet_views(con, parquet_dir=PARQUET_DIR):
+    """Creates a temporary view per current Parquet copy so queries read it instead of the table.
+
+    Returns the names of the views created.
+    """
+    copies = current_parquet_copies(con, parquet_dir)
+    for view_name, parquet_file in copies.items():
+        # Temporary views shadow the stored table of the same name for this connection only
+        con.execute(
+            f"CREATE OR REPLACE TEMP VIEW {quote_identifier(view_name)} AS "
+            f"SELECT * FROM read_parquet({quote_literal(parquet_file)})"
+        )
+    return set(copies)
+
+def _prepare_parquet_views(state, parquet_dir):
+    """Makes a thread's cursor read the Parquet copies in parquet_dir, or the stored tables when it is None.
+
+    The views are (re)created when parquet_dir or its files changed since the cursor's last query,
+    and views left from a previous parquet_dir are dropped so they no longer shadow the tables.
+    """
+    signature = None
+    if parquet_dir:
+        signature = (os.path.abspath(parquet_dir), tuple(sorted(
+            (path, os.stat(path).st_mtime_ns) for path in glob.glob(os.path.join(parquet_dir, '*.parquet'))
+        )))
+    if state['parquet_views'] == signature:
+        return
+    for view_name in state['parquet_view_names']:
+        state['cursor'].execute(f"DROP VIEW IF EXISTS temp.main.{quote_identifier(view_name)}")
+    state['parquet_view_names'] = register_parquet_views(state['cursor'], parquet_dir) if parquet_dir else set()
+    state['parquet_views'] = signature
+
+# Registered external views, shared by all threads; cursors recreate their temp views when the version changes
+_external_views = {}
+_external_views_lock = threading.Lock()
+_external_versions = itertools.count(1)
+_external_state = {'version': 0, 'config_loaded': False}
+
+def _external_format(path):
+    """Infers an external file glob's format from its suffix (ignoring .gz/.zst compression)."""
+    base = path.lower()
+    for compression in ('.gz', '.zst'):
+        if base.endswith(compression):
+            base = base[:-len(compression)]
+    return _EXTERNAL_SUFFIXES.get(os.path.splitext(base)[1])
+
+def register_external_view(name, path, file_format=None, hive_partitioning=False):
+    """Registers CSV, Parquet or NDJSON files matching a glob as a view that queries scan in place.
+
+    Nothing is copied into the database: DuckDB reads the files at query time, pushing column
+    projections (and, for Parquet, filters on row-group statistics) into the scan. The view shadows
+    any stored table of the same name. file_format is inferred from the suffix when omitted.
+    """
+    if not _PLAIN_NAME.match(name):
+        raise ValueError(f"Invalid external view name '{name}'")
+    file_format = file_format or _external_format(path)
+    if file_format not in EXTERNAL_FORMATS:
+        raise ValueError(f"Unknown external file format '{file_format}' for {path}. Expected one of: {', '.join(EXTERNAL_FORMATS)}")
+    if not glob.glob(path, recursive=True):
+        raise FileNotFoundError(f"No files match {path}")
+    source = quote_literal(path)
+    partitioning = f"hive_partitioning={'true' if hive_partitioning else 'false'}"
+    reader = {
+        'parquet': f"read_parquet({source}, {partitioning})",
+        'csv': f"read_csv({source}, auto_detect=true, {partitioning})",
+        'ndjson': f"read_json({source}, format='newline_delimited', auto_detect=true, {partitioning})"
+    }[file_format]
+    with _external_views_lock:
+        _external_views[name] = {'name': name, 'path': path, 'format': file_format, 'reader': reader}
+        _external_state['version'] = next(_external_versions)
+    print(f"Registered external view {name} over {path} ({file_format})")
+
+def unregister_external_view(name):
+    """Removes an external view; returns False if no view of that name was registered."""
+    with _external_views_lock:
+        if _external_views.pop(name, None) is None:
+            return False
+        _external_state['version'] = next(_external_versions)
+    print(f"Unregistered external view {name}")
+    return True
+
+def list_external_views():
+    """Returns {name: {'path', 'format'}} for the registered external views."""
+    with _external_views_lock:
+        return {name: {'path': view['path'], 'format': view['format']} for name, view in _external_views.items()}
+
+def load_external_views(config_path=TABLE_CONFIG_PATH):
+    """Registers the external views declared under "external" in the table config."""
+    if not os.path.exists(config_path):
+        return
+    try:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            external = json.load(f).get('external', {})
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Error reading table config {config_path}: {e}")
+        return
+    for name, options in external.items():
+        try:
+            register_external_view(name, options['path'], options.get('format'), options.get('hive_partitioning', False))
+        except (KeyError, ValueError, FileNotFoundError) as e:
+            print(f"Error registering external view {name}: {e}")
+
+def _create_external_views(con, views):
+    for view in views.values():
+        con.execute(f"CREATE OR REPLACE TEMP VIEW {quote_identifier(view['name'])} AS SELECT * FROM {view['reader']}")
+
+def _external_view_registry():
+    """Returns (version, views) of the registry, registering the configured views on first use."""
+    with _external_views_lock:
+        load_config = not _external_state['config_loaded']
+        _external_state['config_loaded'] = True
+    if load_config:
+        load_external_views()
+    with _external_views_lock:
+        return _external_state['version'], dict(_external_views)
+
+def _prepare_external_views(state):
+    """Brings this thread's temp views in line with the external view registry; returns the registry."""
+    version, views = _external_view_registry()
+    if state['external_version'] != version:
+        for name in state['external_views'] - set(views):
+            state['cursor'].execute(f"DROP VIEW IF EXISTS temp.main.{quote_identifier(name)}")
+        _create_external_views(state['cursor'], views)
+        state['external_version'] = version
+        state['external_views'] = set(views)
+    return views
+
+def _external_signature(normalized_query, views):
+    """Versions of the external files a query reads, so cached results are dropped when they change."""
+    names = {word.lower() for word in _SQL_NAME_WORD.findall(normalized_query)}
+    signature = []
+    for name, view in sorted(views.items()):
+        if name.lower() in names:
+            signature.append((name, view['reader'], tuple(sorted(
+                (path, os.stat(path).st_size, os.stat(path).st_mtime_ns) for path in glob.glob(view['path'], recursive=True)
+            ))))
+    return tuple(signature)
+
+# Queries currently executing, by query id, so they can be cancelled from another thread
+_running_queries = {}
+_running_queries_lock = threading.Lock()
+
+@contextmanager
+def _track_query(cursor, query, query_id, timeout):
+    """Registers a running query for cancel_query() and interrupts it when its deadline passes."""
+    entry = {'cursor': cursor, 'query': query, 'started_at': time.time(), 'stop_reason': None}
+    with _running_queries_lock:
+        _running_queries[query_id] = entry
+
+    def expire():
+        entry['stop_reason'] = 'timeout'
+        cursor.interrupt()
+
+    timer = None
+    if timeout is not None:
+        timer = threading.Timer(timeout, expire)
+        timer.daemon = True
+        timer.start()
+    try:
+        yield entry
+    except duckdb.InterruptException as e:
+        # Tell callers whether the deadline or cancel_query() stopped the query
+        e.stop_reason = entry['stop_reason'] or 'cancelled'
+        raise
+    finally:
+        if timer is not None:
+            timer.cancel()
+        with _running_queries_lock:
+            if _running_queries.get(query_id) is entry:
+                del _running_queries[query_id]
+
+def cancel_query(query_id):
+    """Interrupts a running query by id. Returns False if no such query is running."""
+    with _running_queries_lock:
+        entry = _running_queries.get(query_id)
+    if entry is None:
+        return False
+    entry['stop_reason'] = 'cancelled'
+    entry['cursor'].interrupt()
+    print(f"Cancelled SQL query {query_id}: {entry['query']}")
+    return True
+
+def list_running_queries():
+    """Returns [{'query_id', 'query', 'running_seconds'}] for queries currently executing."""
+    now = time.time()
+    with _running_queries_lock:
+        return [
+            {'query_id': query_id, 'query': entry['query'], 'running_seconds': now - entry['started_at']}
+            for query_id, entry in _running_queries.items()
+        ]
+
+# Profiling settings shared by all threads, and the most recent query profiles
+_profiling = {'enabled': False, 'slow_query_seconds': DEFAULT_SLOW_QUERY_SECONDS, 'log_path': SLOW_QUERY_LOG_PATH}
+_recent_profiles = deque(maxlen=PROFILE_HISTORY_SIZE)
+_profiling_lock = threading.Lock()
+
+def enable_profiling(slow_query_seconds=DEFAULT_SLOW_QUERY_SECONDS, log_path=SLOW_QUERY_LOG_PATH):
+    """Records DuckDB's profile for every executed query and logs queries slower than slow_query_seconds.
+
+    Profiles (operator timings, rows scanned, peak memory and the operator tree) are attached
+    to execute_sql outcomes and kept for get_query_profiles(). Slow queries are appended to
+    log_path as JSON lines together with their plan. Streamed ('batches') results are not profiled.
+    """
+    with _profiling_lock:
+        _profiling.update({'enabled': True, 'slow_query_seconds': slow_query_seconds, 'log_path': log_path})
+    print(f"SQL profiling enabled; queries over {slow_query_seconds}s are logged to {log_path}")
+
+def disable_profiling():
+    """Stops profiling; cursors switch DuckDB's profiler off before their next query."""
+    with _profiling_lock:
+        _profiling['enabled'] = False
+    print("SQL profiling disabled")
+
+def get_query_profiles(limit=None):
+    """Returns the most recent query profiles, newest first."""
+    with _profiling_lock:
+        profiles = list(reversed(_recent_profiles))
+    return profiles[:limit] if limit else profiles
+
+def _prepare_profiling(state):
+    """Switches DuckDB's profiler on this thread's cursor to match the profiling setting."""
+    enabled = _profiling['enabled']
+    if state['profiling'] != enabled:
+        state['cursor'].execute("PRAGMA enable_profiling='no_output'" if enabled else "PRAGMA disable_profiling")
+        state['profiling'] = enabled
+    return enabled
+
+def _profile_operator(node):
+    """Converts one node of DuckDB's JSON profile into a compact operator tree."""
+    return {
+        'operator': node.get('operator_type') or node.get('operator_name'),
+        'seconds': node.get('operator_timing', 0.0),
+        'rows': node.get('operator_cardinality'),
+        'rows_scanned': node.get('operator_rows_scanned'),
+        'details': node.get('extra_info', {}),
+        'children': [_profile_operator(child) for child in node.get('children', [])]
+    }
+
+def _capture_profile(cursor):
+    """Returns a summary of the profile DuckDB recorded for the cursor's last query (None if unavailable)."""
     try:
-        con = duckdb.connect(database=db_path, read_only=True)
-        df = con.execute(query).fetchdf()
-        con.close()
+        profile = json.loads(cursor.get_profiling_information(format='json'))
+    except Exception as e:
+        print(f"Could not read the SQL query profile: {e}")
+        return None
+    plan = [_profile_operator(child) for child in profile.get('children', [])]
+    operators = []
+    pending = list(plan)
+    while pending:
+        node = pending.pop()
+        operators.append({k: node[k] for k in ('operator', 'seconds', 'rows', 'rows_scanned')})
+        pending.extend(node['children'])
+    operators.sort(key=lambda op: op['seconds'] or 0.0, reverse=True)
+    return {
+        'latency': profile.get('latency'),
+        'cpu_time': profile.get('cpu_time'),
+        'rows_scanned': profile.get('cumulative_rows_scanned'),
+        'rows_returned': profile.get('rows_returned'),
+        'peak_memory_bytes': profile.get('system_peak_buffer_memory'),
+        'bytes_read': profile.get('total_bytes_read'),
+        'operators': operators,
+        'plan': plan
+    }
+
+def _record_profile(outcome, query, params):
+    """Keeps the outcome's profile and appends slow queries to the slow-query log."""
+    entry = {
+        'timestamp': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'query_id': outcome['query_id'],
+        'query': query,
+        'params': params,
+        'status': outcome['status'],
+        'elapsed': outcome['elapsed'],
+        'profile': outcome.get('profile')
+    }
+    with _profiling_lock:
+        if entry['profile'] is not None:
+            _recent_profiles.append(entry)
+        if outcome['elapsed'] < _profiling['slow_query_seconds']:
+            return
+        log_path = _profiling['log_path']
+        try:
+            log_dir = os.path.dirname(log_path)
+            if log_dir:
+                os.makedirs(log_dir, exist_ok=True)
+            with open(log_path, 'a') as f:
+                json.dump(entry, f, default=str)
+                f.write('\n')
+            print(f"Logged slow SQL query ({outcome['elapsed']:.2f}s) to {log_path}")
+        except Exception as e:
+            print(f"Error logging slow SQL query: {e}")
+
+def _load_aggregate_catalog(state):
+    """Returns the summary tables usable on this cursor, skipping any whose source changed since its refresh."""
+    if state['aggregates'] is None:
+        cursor = state['cursor']
+        aggregates = []
+        has_catalog = cursor.execute(
+            "SELECT count(*) FROM duckdb_tables() WHERE schema_name = 'main' AND table_name = ?", [AGGREGATE_CATALOG_TABLE]
+        ).fetchone()[0]
+        if has_catalog:
+            for name, source, group_by, measures, source_rows, summary_rows in cursor.execute(
+                f"SELECT aggregate_name, source_table, group_by, measures, source_rows, summary_rows FROM {AGGREGATE_CATALOG_TABLE}"
+            ).fetchall():
+                try:
+                    current_rows = cursor.execute(f"SELECT count(*) FROM {quote_identifier(source)}").fetchone()[0]
+                except duckdb.Error:
+                    continue
+                if current_rows != source_rows:
+                    print(f"Ignoring stale aggregate {name}: {source} has {current_rows} rows, summary covers {source_rows}")
+                    continue
+                columns = cursor.execute(
+                    "SELECT column_name FROM duckdb_columns() WHERE database_name = current_database() "
+                    "AND schema_name = 'main' AND table_name = ?", [source]
+                ).fetchall()
+                aggregates.append({
+                    'name': name,
+                    'source': source.lower(),
+                    'columns': {column.lower() for (column,) in columns},
+                    'group_by': {column.lower() for column in group_by},
+                    'measures': {measure.lower() for measure in measures},
+                    'summary_rows': summary_rows
+                })
+        state['aggregates'] = sorted(aggregates, key=lambda entry: entry['summary_rows'])
+    return state['aggregates']
+
+def _split_top_level(text):
+    """Splits a SQL list on commas that are not inside parentheses."""
+    items, depth, current = [], 0, ''
+    for char in text:
+        if char == ',' and depth == 0:
+            items.append(current.strip())
+            current = ''
+            continue
+        depth += char == '('
+        depth -= char == ')'
+        current += char
+    items.append(current.strip())
+    return items
+
+def _needed_measures(function, column):
+    """Summary measures needed to re-aggregate function(column); avg is rebuilt from sum and count."""
+    if function == 'avg':
+        return [f"sum({column})", f"count({column})"]
+    return [f"{function}({column})"]
+
+def _reaggregate(function, column):
+    """SQL that combines a summary table's stored measures into the original aggregate."""
+    stored = lambda f: quote_identifier(measure_column(f, column))
+    if function == 'avg':
+        return f"(sum({stored('sum')}) / sum({stored('count')}))::DOUBLE"
+    if function in ('sum', 'count'):
+        return f"sum({stored(function)}){'::BIGINT' if function == 'count' else ''}"
+    return f"{function}({stored(function)})"
+
+def _mask_literals(query):
+    """Returns (normalized query with its string literals replaced by placeholders, the literals)."""
+    literals = []
+
+    def stash(match):
+        literals.append(match.group(0))
+        return f"__literal_{len(literals) - 1}__"
+
+    return _SQL_SINGLE_QUOTED.sub(stash, normalize_sql(query).rstrip(';')), literals
+
+def rewrite_aggregate_query(query, aggregates):
+    """Rewrites a GROUP BY query over a source table to re-aggregate a matching summary table.
+
+    Only simple single-table queries are considered: bare group-by columns, sum/count/min/max/avg
+    of a column, and a WHERE clause on group-by columns only. Returns (rewritten_query, summary_name),
+    or (None, None) when no summary can answer the query exactly.
+    """
+    masked, literals = _mask_literals(query)
+    match = _AGGREGATE_QUERY.match(masked)
+    if not match or _UNSUPPORTED_AGGREGATE_SQL.search(masked[len('select'):]):
+        return None, None
+    table = _SQL_IDENTIFIER.match(match.group('table')).group(1).lower()
+    candidates = [entry for entry in aggregates if entry['source'] == table]
+    if not candidates:
+        return None, None
+
+    group_columns = set()
+    for item in _split_top_level(match.group('group')):
+        column = _SQL_IDENTIFIER.match(item)
+        if not column:
+            return None, None
+        group_columns.add(column.group(1).lower())
+    # A word such as year or date is a filter column, not a keyword, when the source table has that column
+    source_columns = set().union(*(entry.get('columns', set()) for entry in candidates))
+    filter_columns = set()
+    for word in _SQL_WORD.findall(match.group('where') or ''):
+        word = word.strip('"').lower()
+        if _STASHED_LITERAL.fullmatch(word):
+            continue
+        if word in source_columns or word not in _WHERE_KEYWORDS:
+            filter_columns.add(word)
+
+    calls = [(m.group(1).lower(), m.group(2).strip('"')) for m in _AGGREGATE_CALL.finditer(masked)]
+    select_items = []
+    for item in _split_top_level(match.group('select')):
+        parts = _SELECT_ITEM.match(item)
+        expr, alias = parts.group('expr'), parts.group('alias')
+        column = _SQL_IDENTIFIER.match(expr)
+        call = _AGGREGATE_CALL.fullmatch(expr)
+        if column and column.group(1).lower() in group_columns:
+            select_items.append(item)
+        elif call:
+            function, argument = call.group(1).lower(), call.group(2).strip('"')
+            # Keep the column name DuckDB would have given the original aggregate
+            name = alias or quote_identifier('count_star()' if argument == '*' else f"{function}({argument})")
+            select_items.append(f"{_reaggregate(function, argument)} AS {name}")
+        else:
+            return None, None
+    if any(function != 'count' and argument == '*' for function, argument in calls):
+        return None, None
+    needed = {measure.lower() for function, argument in calls for measure in _needed_measures(function, argument)}
+
+    for entry in candidates:
+        if group_columns <= entry['group_by'] and filter_columns <= entry['group_by'] and needed <= entry['measures']:
+            tail = _AGGREGATE_CALL.sub(
+                lambda m: _reaggregate(m.group(1).lower(), m.group(2).strip('"')), match.group('tail') or ''
+            )
+            rewritten = f"SELECT {', '.join(select_items)} FROM {quote_identifier(entry['name'])}"
+            if match.group('where'):
+                rewritten += f" WHERE {match.group('where')}"
+            rewritten += f" GROUP BY {match.group('group')}{tail}"
+            return _STASHED_LITERAL.sub(lambda m: literals[int(m.group(1))], rewritten), entry['name']
+    return None, None
+
+def _rewrite_for_aggregates(query, db_path, params=None):
+    """Returns query rewritten to read a summary table of db_path, or None if none matches.
+
+    A rewrite that does not bind against the summary table is dropped, so the original query runs.
+    """
+    # Most queries are not GROUP BY queries; skip loading the catalog (which counts source rows) for them
+    if not _AGGREGATE_QUERY.match(_mask_literals(query)[0]):
+        return None
+    try:
+        state = _get_cursor_state(db_path)
+        rewritten, summary = rewrite_aggregate_query(query, _load_aggregate_catalog(state))
+    except Exception as e:
+        print(f"Could not check summary tables for SQL query: {e}")
+        return None
+    if not rewritten:
+        return None
+    try:
+        # Planning binds every name without reading any data
+        state['cursor'].execute(f"EXPLAIN {rewritten}", params)
+    except duckdb.Error as e:
+        print(f"Not using summary table {summary}; the rewritten query does not bind: {e}")
+        return None
+    print(f"Answering SQL query from summary table {summary}")
+    return rewritten
+
+def _stream_batches(cursor, reader):
+    """Yields record batches from reader, closing its dedicated cursor once the stream is exhausted or dropped."""
+    try:
+        yield from reader
+    finally:
+        cursor.close()
+
+def stream_sql_batches(query, db_path=DB_PATH, parquet_dir=None, batch_size=DEFAULT_BATCH_SIZE,
+                       timeout=DEFAULT_QUERY_TIMEOUT, query_id=None, params=None, template=None):
+    """Runs a query and returns an iterator of pyarrow RecordBatches of at most batch_size rows.
+
+    The query gets a dedicated cursor so the thread's shared cursor stays usable while the
+    stream is consumed; only about one batch is held in memory at a time. The timeout and
+    query_id cover starting the query, not consuming the stream. template names a query
+    template the query calls, which is then created on the dedicated cursor.
+    """
+    cursor = _new_cursor(_get_handle(db_path))
+    try:
+        if parquet_dir:
+            # Temporary views are per cursor
+            register_parquet_views(cursor, parquet_dir)
+        _create_external_views(cursor, _external_view_registry()[1])
+        if template:
+            _create_template_macro(cursor, _get_query_template(template))
+        with _track_query(cursor, query, query_id or uuid.uuid4().hex, timeout):
+            reader = fetch_record_batches(cursor.execute(query, params), batch_size)
+    except Exception:
+        cursor.close()
+        raise
+    return _stream_batches(cursor, reader)
+
+def execute_sql(query, db_path=DB_PATH, parquet_dir=None, use_cache=True, result_format='pandas',
+                batch_size=DEFAULT_BATCH_SIZE, timeout=DEFAULT_QUERY_TIMEOUT, query_id=None, params=None,
+                use_aggregates=True):
+    """Executes a SQL query and returns a structured outcome instead of raising.
+
+    Returns a dict with status ('ok', 'timeout', 'cancelled' or 'error'), data (the result,
+    see get_sql_data), error (a message or None), elapsed (seconds) and query_id. A query that
+    runs longer than timeout seconds is interrupted; pass query_id to be able to stop it
+    early with cancel_query(query_id). params are bound to the query's ? placeholders.
+    GROUP BY queries that a materialized summary table can answer exactly are rewritten to
+    read it instead of the source table (use_aggregates=False disables this).
+    """
+    if result_format not in RESULT_FORMATS:
+        raise ValueError(f"Unknown result format '{result_format}'. Expected one of: {', '.join(RESULT_FORMATS)}")
+    return _execute_sql(
+        query, db_path, parquet_dir, use_cache, result_format, batch_size, timeout, query_id, params,
+        use_aggregates=use_aggregates
+    )
+
+def _execute_sql(query, db_path, parquet_dir, use_cache, result_format, batch_size, timeout, query_id, params,
+                 template=None, use_aggregates=False):
+    """Implements execute_sql; template names a query template to create on the cursor first."""
+    query_id = query_id or uuid.uuid4().hex
+    outcome = {'status': 'ok', 'data': None, 'error': None, 'elapsed': None, 'query_id': query_id, 'profile': None}
+    start = time.perf_counter()
+    profiled = False
+    try:
+        if result_format == 'batches':
+            outcome['data'] = stream_sql_batches(
+                query, db_path, parquet_dir, batch_size, timeout, query_id, params, template
+            )
+            print(f"Streaming SQL query results: {query}")
+            return outcome
+        state = _get_cursor_state(db_path)
+        _prepare_parquet_views(state, parquet_dir)
+        external_views = _prepare_external_views(state)
+        if template:
+            _prepare_query_template(state, template)
+        # Cached under the query as written; a summary table rewrite only happens on a miss
+        cache_key = None
+        normalized_query = normalize_sql(query)
+        if result_format == 'pandas' and use_cache and _is_cacheable(normalized_query):
+            cache_key = (
+                os.path.abspath(db_path), normalized_query,
+                state['signature'], state['parquet_views'],
+                json.dumps(params, default=str) if params is not None else None,
+                _external_signature(normalized_query, external_views)
+            )
+            df = _result_cache.get(cache_key)
+            if df is not None:
+                print(f"Served SQL query from cache: {query}")
+                outcome['data'] = df
+                return outcome
+        if use_aggregates:
+            query = _rewrite_for_aggregates(query, db_path, params) or query
+        profiled = _prepare_profiling(state)
+        with _track_query(state['cursor'], query, query_id, timeout):
+            result = state['cursor'].execute(query, params)
+            data = fetch_arrow_table(result) if result_format == 'arrow' else result.fetchdf()
+        if profiled:
+            outcome['profile'] = _capture_profile(state['cursor'])
+        if cache_key is not None:
+            _result_cache.put(cache_key, data)
+        outcome['data'] = data
         print(f"Successfully executed SQL query: {query}")
-        return df
+    except duckdb.InterruptException as e:
+        outcome['status'] = getattr(e, 'stop_reason', 'cancelled')
+        if outcome['status'] == 'timeout':
+            outcome['error'] = f"Query exceeded the {timeout}s timeout and was interrupted"
+        else:
+            outcome['error'] = "Query was cancelled"
+        print(f"SQL query {outcome['status']}: {query}")
     except Exception as e:
+        outcome['status'] = 'error'
+        outcome['error'] = str(e)
         print(f"Error executing SQL query: {query}\n{e}")
+    finally:
+        outcome['elapsed'] = time.perf_counter() - start
+        if profiled:
+            _record_profile(outcome, query, params)
+    return outcome
+
+def get_sql_data(query, db_path=DB_PATH, parquet_dir=None, use_cache=True, result_format='pandas',
+                 batch_size=DEFAULT_BATCH_SIZE, timeout=DEFAULT_QUERY_TIMEOUT, query_id=None, params=None,
+                 use_aggregates=True):
+    """Executes a SQL query against the DuckDB database and returns results as a pandas DataFrame.
+
+    result_format='arrow' returns a pyarrow Table instead, and result_format='batches' an iterator
+    of pyarrow RecordBatches (batch_size rows each) that streams large results with little copying.
+
+    Queries run on this thread's cursor of a shared, long-lived read-only connection.
+    Results of read-only queries are cached, keyed by the normalized SQL text and the database
+    file's version stamp, so repeats between ingests skip DuckDB entirely (use_cache=False bypasses it).
+    With parquet_dir set, tables that have a Parquet copy there are read from it, so selective
+    filters on the sort keys only scan the matching row groups.
+    params are bound to the query's ? placeholders instead of being pasted into the SQL text.
+    Returns None if the query fails, times out or is cancelled; use execute_sql to tell these apart.
+    """
+    outcome = execute_sql(
+        query, db_path, parquet_dir, use_cache, result_format, batch_size, timeout, query_id, params, use_aggregates
+    )
+    return outcome['data'] if outcome['status'] == 'ok' else None
+
+# Worker threads for the async API, and a concurrency limit per event loop
+_async_executor = None
+_async_executor_lock = threading.Lock()
+_async_semaphores = weakref.WeakKeyDictionary()
+
+def _get_async_executor():
+    global _async_executor
+    with _async_executor_lock:
+        if _async_executor is None:
+            _async_executor = ThreadPoolExecutor(max_workers=ASYNC_MAX_CONCURRENCY, thread_name_prefix='sql-async')
+        return _async_executor
+
+def _get_async_semaphore(loop):
+    semaphore = _async_semaphores.get(loop)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(ASYNC_MAX_CONCURRENCY)
+        _async_semaphores[loop] = semaphore
+    return semaphore
+
+async def execute_sql_async(query, db_path=DB_PATH, parquet_dir=None, use_cache=True, result_format='pandas',
+                            batch_size=DEFAULT_BATCH_SIZE, timeout=DEFAULT_QUERY_TIMEOUT, query_id=None, params=None,
+                            use_aggregates=True):
+    """Async counterpart of execute_sql that never blocks the event loop.
+
+    The query runs on a worker thread with that thread's own cursor; at most ASYNC_MAX_CONCURRENCY
+    queries run at once and further calls wait their turn. Cancelling the awaiting task interrupts
+    the DuckDB query. Streamed 'batches' results are not supported here.
+    """
+    if result_format == 'batches':
+        raise ValueError("result_format='batches' is not supported by the async API; use 'pandas' or 'arrow'")
+    query_id = query_id or uuid.uuid4().hex
+    loop = asyncio.get_running_loop()
+    async with _get_async_semaphore(loop):
+        future = loop.run_in_executor(
+            _get_async_executor(), execute_sql, query, db_path, parquet_dir, use_cache, result_format,
+            batch_size, timeout, query_id, params, use_aggregates
+        )
+        try:
+            return await future
+        except asyncio.CancelledError:
+            # A query that has not started yet is dropped by the executor; a running one is interrupted
+            cancel_query(query_id)
+            raise
+
+async def get_sql_data_async(query, db_path=DB_PATH, parquet_dir=None, use_cache=True, result_format='pandas',
+                             batch_size=DEFAULT_BATCH_SIZE, timeout=DEFAULT_QUERY_TIMEOUT, query_id=None, params=None,
+                             use_aggregates=True):
+    """Async counterpart of get_sql_data: returns the result, or None if the query fails or times out.
+
+    Many calls can be awaited concurrently (e.g. with asyncio.gather) under one event loop.
+    """
+    outcome = await execute_sql_async(
+        query, db_path, parquet_dir, use_cache, result_format, batch_size, timeout, query_id, params, use_aggregates
+    )
+    return outcome['data'] if outcome['status'] == 'ok' else None
+
+# Named query templates, shared by all threads; each cursor creates a macro per template version
+_query_templates = {}
+_query_templates_lock = threading.Lock()
+_template_versions = itertools.count(1)
+
+def register_query_template(name, sql):
+    """Registers a named query whose literals are $name placeholders, e.g.
+    register_query_template('orders_for_customer', 'SELECT * FROM orders WHERE customer_id = $customer_id').
+
+    Each cursor turns the template into a table macro once, so its SQL is parsed a single time,
+    and run_query_template binds the values; they are never pasted into the SQL text.
+    Re-registering a name replaces the template. Returns the template's parameter names.
+    """
+    if not _PLAIN_NAME.match(name):
+        raise ValueError(f"Invalid query template name '{name}'")
+    parts = _SQL_STRING_LITERAL.split(sql.strip().rstrip(';'))
+    param_names = []
+    for i in range(0, len(parts), 2):
+        param_names.extend(p for p in _TEMPLATE_PARAMETER.findall(parts[i]) if p not in param_names)
+        # Macro parameters get a prefix so they cannot shadow column names
+        parts[i] = _TEMPLATE_PARAMETER.sub(r'_param_\1', parts[i])
+    body = ''.join(parts)
+    version = next(_template_versions)
+    with _query_templates_lock:
+        _query_templates[name] = {
+            'name': name,
+            'sql': sql,
+            'params': param_names,
+            'macro': f"_template_{name}_{version}",
+            'body': body,
+            'cacheable': _is_cacheable(normalize_sql(body))
+        }
+    print(f"Registered query template '{name}' with parameters: {', '.join(param_names) or 'none'}")
+    return list(param_names)
+
+def list_query_templates():
+    """Returns {name: [parameter names]} for the registered query templates."""
+    with _query_templates_lock:
+        return {name: list(template['params']) for name, template in _query_templates.items()}
+
+def _get_query_template(name):
+    with _query_templates_lock:
+        template = _query_templates.get(name)
+    if template is None:
+        raise KeyError(f"Unknown query template '{name}'")
+    return template
+
+def _create_template_macro(cursor, template):
+    macro_params = ', '.join(f"_param_{p}" for p in template['params'])
+    cursor.execute(f"CREATE TEMP MACRO {template['macro']}({macro_params}) AS TABLE {template['body']}")
+
+def _prepare_query_template(state, name):
+    """Creates the template's macro on this thread's cursor unless it already exists."""
+    template = _get_query_template(name)
+    if template['macro'] not in state['templates']:
+        _create_template_macro(state['cursor'], template)
+        state['templates'].add(template['macro'])
+    return template
+
+def run_query_template(name, params=None, db_path=DB_PATH, parquet_dir=None, use_cache=True, result_format='pandas',
+                       batch_size=DEFAULT_BATCH_SIZE, timeout=DEFAULT_QUERY_TIMEOUT, query_id=None):
+    """Runs a registered query template with params ({name: value}) bound to its placeholders.
+
+    Returns the same structured outcome as execute_sql. Raises KeyError for an unknown
+    template and ValueError for missing or unexpected parameters.
+    """
+    template = _get_query_template(name)
+    params = params or {}
+    missing = [p for p in template['params'] if p not in params]
+    unexpected = [p for p in params if p not in template['params']]
+    if missing or unexpected:
+        raise ValueError(
+            f"Query template '{name}' takes parameters ({', '.join(template['params'])}); "
+            f"missing: {', '.join(missing) or 'none'}, unexpected: {', '.join(unexpected) or 'none'}"
+        )
+    placeholders = ', '.join('?' for _ in template['params'])
+    query = f"SELECT * FROM {template['macro']}({placeholders})"
+    values = [params[p] for p in template['params']]
+    return _execute_sql(
+        query, db_path, parquet_dir, use_cache and template['cacheable'], result_format, batch_size,
+        timeout, query_id, values, template=name
+    )
+
+def _query_fingerprint(query):
+    """Returns a short hash of the normalized query, used to tie page tokens to their query."""
+    return hashlib.sha1(normalize_sql(query).encode('utf-8')).hexdigest()[:16]
+
+def encode_page_token(query, offset, page_size=DEFAULT_PAGE_SIZE, total_rows=None, total_is_estimate=False):
+    """Returns an opaque page token for the page of query starting at row offset."""
+    payload = {'q': _query_fingerprint(query), 'o': int(offset), 'n': int(page_size), 't': total_rows, 'e': total_is_estimate}
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode('utf-8')).decode('ascii')
+
+def decode_page_token(page_token, query):
+    """Decodes a page token, raising ValueError if it is malformed or belongs to a different query."""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(page_token.encode('ascii')))
+        offset, page_size = int(payload['o']), int(payload['n'])
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError(f"Invalid page token: {e}")
+    if payload.get('q') != _query_fingerprint(query) or offset < 0 or page_size <= 0:
+        raise ValueError("Page token does not belong to this query")
+    return {'offset': offset, 'page_size': page_size, 'total_rows': payload.get('t'), 'total_is_estimate': payload.get('e', False)}
+
+_BARE_TABLE_SCAN = re.compile(r'^select \* from "?(\w+)"?$', re.IGNORECASE)
+_TRAILING_SEMICOLON = re.compile(r';\s*(?:--[^\n]*\s*)*$')
+
+def _as_subquery(query):
+    """Returns the text of a single query that can be wrapped as a subquery, or None.
+
+    PRAGMAs that DuckDB expands to a SELECT (e.g. PRAGMA show_tables) are returned expanded.
+    Statements that cannot be a subquery (SET, EXPLAIN, CALL, several statements) return None.
+    """
+    try:
+        statements = duckdb.extract_statements(query)
+    except duckdb.Error:
+        return None
+    if len(statements) != 1 or statements[0].type != duckdb.StatementType.SELECT:
+        return None
+    text = _TRAILING_SEMICOLON.sub('', statements[0].query.strip())
+    try:
+        # The text goes on its own lines so a trailing -- comment cannot swallow the closing parenthesis
+        duckdb.extract_statements(_wrap_subquery(text, 'SELECT *', ''))
+    except duckdb.Error:
+        return None
+    return text
+
+def _wrap_subquery(text, select, tail):
+    """Wraps query text as the FROM subquery of select, followed by tail (e.g. a LIMIT clause)."""
+    return f"{select} FROM (\n{text}\n) AS _sub{tail}"
+
+def _count_rows(query, db_path, parquet_dir, timeout=DEFAULT_QUERY_TIMEOUT, query_id=None):
+    """Returns (total_rows, is_estimate) for a query, using the statistics catalog for bare table scans."""
+    match = _BARE_TABLE_SCAN.match(normalize_sql(query))
+    if match and not parquet_dir:
+        stats_df = get_table_stats(match.group(1), db_path)
+        if stats_df is not None and not stats_df.empty:
+            return int(stats_df['row_count'].iloc[0]), False
+    subquery = _as_subquery(query)
+    if subquery is None:
+        return None, True
+    count_df = get_sql_data(
+        _wrap_subquery(subquery, 'SELECT count(*) AS total_rows', ''), db_path, parquet_dir,
+        timeout=timeout, query_id=query_id
+    )
+    if count_df is None:
+        return None, True
+    return int(count_df['total_rows'].iloc[0]), False
+
+def get_sql_page(query, page_token=None, page_size=DEFAULT_PAGE_SIZE, db_path=DB_PATH, parquet_dir=None, exact_total=True,
+                 timeout=DEFAULT_QUERY_TIMEOUT, query_id=None):
+    """Fetches one page of a query's result instead of the whole result.
+
+    Pass the returned next_page_token (or prev_page_token) to fetch the neighbouring page; tokens
+    carry the offset, page size and total, and are rejected for a different query. With
+    exact_total=False no count query is run and total_rows is a lower bound (total_is_estimate=True).
+    Returns a dict with status and error (as in execute_sql), rows (a DataFrame, None unless
+    status is 'ok'), offset, page_size, total_rows, total_is_estimate, next_page_token and prev_page_token.
+    Statements that cannot be paged as a subquery (e.g. SET or EXPLAIN) run unpaged and come back
+    as a single page without tokens.
+    """
+    total_rows, total_is_estimate = None, True
+    offset = 0
+    if page_token:
+        token = decode_page_token(page_token, query)
+        offset, page_size = token['offset'], token['page_size']
+        total_rows, total_is_estimate = token['total_rows'], token['total_is_estimate']
+
+    # Aggregate queries are paged over a matching summary table; tokens still refer to the original query
+    source_query = _rewrite_for_aggregates(query, db_path) or query
+
+    subquery = _as_subquery(source_query)
+    if subquery is None:
+        outcome = execute_sql(source_query, db_path, parquet_dir, timeout=timeout, query_id=query_id)
+        rows = outcome['data'] if outcome['status'] == 'ok' else None
+        total_rows = len(rows) if rows is not None else None
+        return {
+            'status': outcome['status'], 'error': outcome['error'], 'rows': rows, 'offset': 0,
+            'page_size': page_size, 'total_rows': total_rows, 'total_is_estimate': total_rows is None,
+            'next_page_token': None, 'prev_page_token': None
+        }
+
+    # One extra row tells whether another page follows without counting
+    page_sql = _wrap_subquery(subquery, 'SELECT *', f" LIMIT {int(page_size) + 1} OFFSET {int(offset)}")
+    outcome = execute_sql(page_sql, db_path, parquet_dir, timeout=timeout, query_id=query_id)
+    if outcome['status'] != 'ok':
+        return {
+            'status': outcome['status'], 'error': outcome['error'], 'rows': None, 'offset': offset,
+            'page_size': page_size, 'total_rows': total_rows, 'total_is_estimate': total_is_estimate,
+            'next_page_token': None, 'prev_page_token': None
+        }
+    rows = outcome['data']
+    has_more = len(rows) > page_size
+    rows = rows.iloc[:page_size]
+
+    if not has_more and (len(rows) > 0 or offset == 0):
+        # The last page ends the result, so the total is known without counting
+        total_rows, total_is_estimate = offset + len(rows), False
+    elif total_rows is None or total_is_estimate:
+        if exact_total:
+            total_rows, total_is_estimate = _count_rows(source_query, db_path, parquet_dir, timeout, query_id)
+        if total_rows is None or total_is_estimate:
+            total_rows, total_is_estimate = offset + len(rows) + (1 if has_more else 0), has_more
+
+    next_page_token = encode_page_token(query, offset + page_size, page_size, total_rows, total_is_estimate) if has_more else None
+    prev_page_token = encode_page_token(query, max(0, offset - page_size), page_size, total_rows, total_is_estimate) if offset > 0 else None
+    return {
+        'status': 'ok',
+        'error': None,
+        'rows': rows,
+        'offset': offset,
+        'page_size': page_size,
+        'total_rows': total_rows,
+        'total_is_estimate': total_is_estimate,
+        'next_page_token': next_page_token,
+        'prev_page_token': prev_page_token
+    }
+
+def get_table_stats(table_name=None, db_path=DB_PATH):
+    """Returns catalogued per-column statistics (one row per column) without scanning the tables.
+
+    Columns: table_name, column_name, column_type, row_count, null_fraction, min_value,
+    max_value, approx_distinct, top_values (a list) and collected_at.
+    """
+    try:
+        cursor = get_cursor(db_path)
+        sql = f"SELECT * FROM {STATS_TABLE}"
+        params = []
+        if table_name:
+            sql += " WHERE table_name = ?"
+            params.append(table_name)
+        df = cursor.execute(sql + " ORDER BY table_name, column_name", params).fetchdf()
+        df['top_values'] = df['top_values'].apply(lambda value: json.loads(value) if value else [])
+        return df
+    except Exception as e:
+        print(f"Error reading table statistics for {table_name or 'all tables'}: {e}")
         return None
 
 # Example usage (optional - for testing)
@@ -20,4 +1181,9 @@ if __name__ == "__main__":
     result_df = get_sql_data(sample_query)
     if result_df is not None:
         print("\nSample Query Result:")
-        print(result_df) 
\ No newline at end of file
+        print(result_df)
+
+    stats_df = get_table_stats('sample_data_1')
+    if stats_df is not None:
+        print("\nCatalogued Statistics:")
+        print(stats_df)
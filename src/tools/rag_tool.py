@@ -37,7 +37,9 @@ def build_rag_prompt(query, retrieved_documents):
                  context += "[No text content available]\n"
             # Add citation information
             if doc.get('metadata', {}).get('filename'):
-                citations.append(f"[Document {i+1}] {doc['metadata']['filename']}")
+                page = doc['metadata'].get('page_number')
+                page_suffix = f" (page {page})" if page is not None else ""
+                citations.append(f"[Document {i+1}] {doc['metadata']['filename']}{page_suffix}")
             else:
                  citations.append(f"[Document {i+1}] Unknown Source")
             context += "---\n"
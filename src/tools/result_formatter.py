@@ -0,0 +1,192 @@
+import threading
+import uuid
+from collections import OrderedDict
+
+import pandas as pd
+
+# Rendering limits: the rendered answer never exceeds the character budget, whatever the result size.
+# Only the head/tail rows and the first columns are ever turned into text.
+DEFAULT_CHAR_BUDGET = 4000
+DEFAULT_HEAD_ROWS = 10
+DEFAULT_TAIL_ROWS = 5
+DEFAULT_MAX_COLUMNS = 12
+DEFAULT_MAX_CELL_CHARS = 24
+
+# Summary statistics are computed on at most this many rows, so their cost is bounded too
+STATS_SAMPLE_ROWS = 10000
+
+# Results kept for retrieval by handle: least recently used are evicted beyond this many entries
+# or this much memory, and a result larger than the whole budget is never kept
+RESULT_STORE_SIZE = 32
+RESULT_STORE_MAX_BYTES = 64 * 1024 * 1024
+
+# Rows a handle's loader fetches at most, so showing a "full" result never materializes a huge table
+FULL_RESULT_MAX_ROWS = 10000
+
+_results = OrderedDict()
+_results_lock = threading.Lock()
+_results_state = {'bytes': 0}
+
+def _result_size(data):
+    """Memory size in bytes of a DataFrame or pyarrow Table (0 for None)."""
+    if data is None:
+        return 0
+    if isinstance(data, pd.DataFrame):
+        return int(data.memory_usage(index=True, deep=True).sum())
+    return int(getattr(data, 'nbytes', 0))
+
+def _evict_results():
+    """Drops least recently used results until the store is within its entry and byte limits (lock held)."""
+    while len(_results) > RESULT_STORE_SIZE or _results_state['bytes'] > RESULT_STORE_MAX_BYTES:
+        _, evicted = _results.popitem(last=False)
+        _results_state['bytes'] -= evicted['size']
+
+def store_result(data=None, loader=None):
+    """Keeps a result available by handle and returns the handle.
+
+    Pass the result itself as data, or a loader (a callable without arguments) that produces
+    the result on first access, e.g. to re-run a query whose answer showed only one page.
+    Loaders should cap what they fetch (see FULL_RESULT_MAX_ROWS). Data larger than
+    RESULT_STORE_MAX_BYTES is not kept, so its handle only works with a loader.
+    """
+    if data is None and loader is None:
+        raise ValueError("store_result needs data or a loader")
+    size = _result_size(data)
+    if size > RESULT_STORE_MAX_BYTES:
+        data, size = None, 0
+    handle = uuid.uuid4().hex[:12]
+    with _results_lock:
+        _results[handle] = {'data': data, 'loader': loader, 'size': size}
+        _results_state['bytes'] += size
+        _evict_results()
+    return handle
+
+def get_result(handle):
+    """Returns the result for a handle, or None if it is unknown or was evicted."""
+    with _results_lock:
+        entry = _results.get(handle)
+        if entry is None:
+            return None
+        _results.move_to_end(handle)
+        if entry['data'] is not None or entry['loader'] is None:
+            return entry['data']
+        loader = entry['loader']
+    data = loader()
+    size = _result_size(data)
+    with _results_lock:
+        # Kept only if it fits the budget and the entry was not evicted while loading
+        if data is not None and size <= RESULT_STORE_MAX_BYTES and _results.get(handle) is entry and entry['data'] is None:
+            entry['data'], entry['size'] = data, size
+            _results_state['bytes'] += size
+            _results.move_to_end(handle)
+            _evict_results()
+    return data
+
+def _truncate(value, max_chars):
+    text = str(value).replace('\n', ' ')
+    return text if len(text) <= max_chars else text[:max_chars - 1] + '…'
+
+def _render_table(df, row_positions, columns, max_cell_chars, omitted_rows, row_offset=0):
+    """Renders the given rows and columns as fixed-width text, marking where rows were omitted."""
+    header = ['#'] + [_truncate(column, max_cell_chars) for column in columns]
+    body = []
+    for position in row_positions:
+        row = df.iloc[position]
+        body.append([str(row_offset + position + 1)] + [_truncate(row[column], max_cell_chars) for column in columns])
+    widths = [max(len(line[i]) for line in [header] + body) for i in range(len(header))]
+    render = lambda cells: '  '.join(cell.rjust(width) for cell, width in zip(cells, widths)).rstrip()
+    lines = [render(header), render(['-' * width for width in widths])]
+    for i, cells in enumerate(body):
+        if omitted_rows and i > 0 and row_positions[i] != row_positions[i - 1] + 1:
+            lines.append(f"… {omitted_rows:,} rows omitted …")
+        lines.append(render(cells))
+    return '\n'.join(lines)
+
+def summarize_columns(df, columns, max_cell_chars=DEFAULT_MAX_CELL_CHARS, title='Column summary'):
+    """One line of summary statistics per column (numeric range and mean, or distinct/top values).
+
+    The statistics only cover df; title says what that is when df is part of a larger result.
+    """
+    sample = df if len(df) <= STATS_SAMPLE_ROWS else df.iloc[:STATS_SAMPLE_ROWS]
+    lines = []
+    for column in columns:
+        values = sample[column]
+        nulls = int(values.isna().sum())
+        if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+            stats = f"min {values.min()}, max {values.max()}, mean {values.mean():.4g}" if nulls < len(values) else "all null"
+        else:
+            counts = values.astype(str).value_counts()
+            stats = f"{len(counts)} distinct, top {_truncate(counts.index[0], max_cell_chars)}" if len(counts) else "empty"
+        lines.append(f"  {_truncate(column, max_cell_chars)} ({values.dtype}): {stats}, {nulls} null")
+    scope = f" (first {len(sample):,} rows)" if len(sample) < len(df) else ''
+    return f"{title}{scope}:\n" + '\n'.join(lines)
+
+def format_result(df, char_budget=DEFAULT_CHAR_BUDGET, head_rows=DEFAULT_HEAD_ROWS, tail_rows=DEFAULT_TAIL_ROWS,
+                  max_columns=DEFAULT_MAX_COLUMNS, max_cell_chars=DEFAULT_MAX_CELL_CHARS, total_rows=None,
+                  total_is_estimate=False, row_offset=0, handle=None, include_summary=True):
+    """Renders a DataFrame as a compact text table that never exceeds char_budget characters.
+
+    Shows the first head_rows and last tail_rows rows of the first max_columns columns, with cells
+    cut to max_cell_chars, followed by per-column summary statistics and a footer with the full
+    shape and the handle under which the full result can be retrieved. When df is one page of a
+    larger result, pass the page's row_offset and the result's total_rows (a lower bound if
+    total_is_estimate); the summary is then labelled as covering that page only. When the text
+    would exceed the budget, the summary, the tail rows, then columns and head rows are dropped in turn.
+    """
+    if df is None:
+        return "No result."
+    row_count = len(df)
+    total_rows = row_count if total_rows is None else total_rows
+    if row_count == 0:
+        return "No rows returned."
+
+    total = f"{'at least ' if total_is_estimate else ''}{total_rows:,}"
+    summary_title = 'Column summary'
+    if row_offset or total_rows != row_count or total_is_estimate:
+        footer = [f"Showing rows {row_offset + 1:,}-{row_offset + row_count:,} of {total}, {len(df.columns)} columns"]
+        summary_title = f"Column summary of rows {row_offset + 1:,}-{row_offset + row_count:,} only"
+    else:
+        footer = [f"{total} rows × {len(df.columns)} columns"]
+    if handle:
+        footer.append(f"Full result available as handle {handle}")
+    attempts = []
+    columns, head, tail, summary = min(max_columns, len(df.columns)), head_rows, tail_rows, include_summary
+    # Each attempt only renders a bounded slice, so trying a few layouts stays cheap
+    while True:
+        attempts.append((columns, head, tail, summary))
+        if summary:
+            summary = False
+        elif tail > 0:
+            tail = 0
+        elif columns > 4:
+            columns = columns // 2
+        elif head > 1:
+            head = max(1, head // 2)
+        elif columns > 1:
+            columns = max(1, columns // 2)
+        else:
+            break
+
+    text = ''
+    for columns, head, tail, summary in attempts:
+        shown_columns = list(df.columns[:columns])
+        head_positions = list(range(min(head, row_count)))
+        tail_positions = [p for p in range(max(row_count - tail, 0), row_count) if p >= len(head_positions)]
+        row_positions = head_positions + tail_positions
+        omitted_rows = row_count - len(row_positions)
+        parts = [_render_table(
+            df, row_positions, shown_columns, max_cell_chars, omitted_rows if tail_positions else 0, row_offset
+        )]
+        if omitted_rows and not tail_positions:
+            parts.append(f"… {omitted_rows:,} more rows")
+        if columns < len(df.columns):
+            parts.append(f"… {len(df.columns) - columns} more columns: {_truncate(', '.join(map(str, df.columns[columns:])), 80)}")
+        if summary:
+            parts.append(summarize_columns(df, shown_columns, max_cell_chars, summary_title))
+        parts.append(' | '.join(footer))
+        text = '\n'.join(parts)
+        if len(text) <= char_budget:
+            return text
+    # Even a single cell does not fit: cut the text, keeping the footer
+    tail_text = '\n' + ' | '.join(footer)
+    return (text[:max(0, char_budget - len(tail_text) - 1)] + '…' + tail_text)[:char_budget]
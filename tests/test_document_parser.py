@@ -0,0 +1,56 @@
+import json
+
+from src.ingest import document_parser
+
+
+def write_eml(data_dir, name, body='body'):
+    (data_dir / f"{name}.eml").write_text(f"Subject: {name}\n\n{body}\n")
+
+
+def parse(tmp_path):
+    output = tmp_path / 'parsed.jsonl'
+    document_parser.process_unstructured_data(str(tmp_path / 'docs'), str(output))
+    return [json.loads(line)['filename'] for line in output.read_text().splitlines()]
+
+
+def test_incremental_runs_keep_sorted_order(tmp_path):
+    docs = tmp_path / 'docs'
+    docs.mkdir()
+    write_eml(docs, 'a')
+    write_eml(docs, 'c')
+    assert parse(tmp_path) == ['a.eml', 'c.eml']
+
+    write_eml(docs, 'b')
+    assert parse(tmp_path) == ['a.eml', 'b.eml', 'c.eml']
+    write_eml(docs, 'd')
+    assert parse(tmp_path) == ['a.eml', 'b.eml', 'c.eml', 'd.eml']
+
+    (docs / 'b.eml').unlink()
+    write_eml(docs, 'c', 'changed')
+    assert parse(tmp_path) == ['a.eml', 'c.eml', 'd.eml']
+    records = [json.loads(line) for line in (tmp_path / 'parsed.jsonl').read_text().splitlines()]
+    assert records[1]['text'].strip() == 'changed'
+
+
+def test_unchanged_run_does_not_read_output(tmp_path, monkeypatch):
+    docs = tmp_path / 'docs'
+    docs.mkdir()
+    write_eml(docs, 'a')
+    parse(tmp_path)
+
+    def fail(output_jsonl):
+        raise AssertionError("output was read")
+    monkeypatch.setattr(document_parser, 'iter_record_groups', fail)
+    assert parse(tmp_path) == ['a.eml']
+
+
+def test_deleting_every_document_drops_its_records(tmp_path):
+    docs = tmp_path / 'docs'
+    docs.mkdir()
+    write_eml(docs, 'a')
+    parse(tmp_path)
+
+    (docs / 'a.eml').unlink()
+    assert parse(tmp_path) == []
+    manifest = json.loads((tmp_path / 'parsed.jsonl.manifest.json').read_text())
+    assert manifest['files'] == {}
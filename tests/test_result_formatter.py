@@ -0,0 +1,43 @@
+import pandas as pd
+
+from src.tools import result_formatter
+
+
+def test_page_renders_every_row_and_labels_the_summary():
+    page = pd.DataFrame({'id': range(45, 60), 'value': [f"v{i}" for i in range(45, 60)]})
+
+    text = result_formatter.format_result(page, head_rows=len(page), tail_rows=0, total_rows=1000000, row_offset=45)
+
+    assert all(f"v{i}" in text for i in range(45, 60))
+    assert 'rows omitted' not in text and 'more rows' not in text
+    assert 'Column summary of rows 46-60 only:' in text
+    assert 'Showing rows 46-60 of 1,000,000' in text
+
+
+def test_complete_result_summary_has_no_page_label():
+    text = result_formatter.format_result(pd.DataFrame({'id': range(3)}))
+
+    assert 'Column summary:' in text and '3 rows × 1 columns' in text
+
+
+def test_result_store_is_bounded_by_bytes(monkeypatch):
+    monkeypatch.setattr(result_formatter, '_results', result_formatter.OrderedDict())
+    monkeypatch.setattr(result_formatter, '_results_state', {'bytes': 0})
+    frame = pd.DataFrame({'id': range(1000)})
+    size = result_formatter._result_size(frame)
+    monkeypatch.setattr(result_formatter, 'RESULT_STORE_MAX_BYTES', int(size * 2.5))
+
+    first, second = result_formatter.store_result(frame), result_formatter.store_result(frame.copy())
+    assert result_formatter.get_result(first) is not None
+    # Storing a third result evicts the least recently used one
+    third = result_formatter.store_result(frame.copy())
+    assert result_formatter.get_result(second) is None
+    assert result_formatter.get_result(first) is not None and result_formatter.get_result(third) is not None
+    assert result_formatter._results_state['bytes'] == 2 * size
+
+    # A result over the whole budget is reloaded on every access instead of being kept
+    calls = []
+    huge = pd.DataFrame({'id': range(10000)})
+    handle = result_formatter.store_result(loader=lambda: calls.append(1) or huge)
+    assert len(result_formatter.get_result(handle)) == 10000 and len(result_formatter.get_result(handle)) == 10000
+    assert len(calls) == 2 and result_formatter._results_state['bytes'] == 2 * size
@@ -0,0 +1,347 @@
+import json
+
+import pandas as pd
+import pytest
+
+from src.ingest import structured_loader
+from src.retrievers import sql_retriever
+
+
+def write_csv(path, rows):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('id,category,amount\n')
+        f.writelines(f"{row_id},{category},{amount}\n" for row_id, category, amount in rows)
+
+
+@pytest.fixture
+def loaded_db(tmp_path):
+    """Loads tmp_path/data into tmp_path/db.duckdb with the table config given, and returns the database path."""
+    (tmp_path / 'data').mkdir()
+    db_path = str(tmp_path / 'db.duckdb')
+
+    def load(config=None, **kwargs):
+        config_path = tmp_path / 'table_config.json'
+        config_path.write_text(json.dumps(config or {}))
+        structured_loader.load_structured_data(
+            data_dir=str(tmp_path / 'data'), db_path=db_path, config_path=str(config_path), **kwargs
+        )
+        return db_path
+    yield load
+    sql_retriever.close_connections()
+    sql_retriever.clear_result_cache()
+
+
+@pytest.mark.parametrize('name', ['memory', 'system', 'temp', 'my-data.v2'])
+def test_databases_are_queried_whatever_their_file_name(tmp_path, name):
+    db_path = str(tmp_path / f"{name}.duckdb")
+    con = sql_retriever.duckdb.connect(db_path)
+    con.execute("CREATE TABLE sales AS SELECT 1 AS id")
+    con.close()
+    try:
+        assert sql_retriever.get_sql_data("SELECT id FROM sales", db_path, use_cache=False)['id'].tolist() == [1]
+    finally:
+        sql_retriever.close_connections()
+
+
+def test_parquet_views_are_dropped_without_parquet_dir(tmp_path, loaded_db):
+    write_csv(tmp_path / 'data' / 'sales.csv', [(1, 'a', 10)])
+    parquet_dir = str(tmp_path / 'parquet')
+    db_path = loaded_db(parquet_dir=parquet_dir)
+    # Make the Parquet copy distinguishable from the table (it stays current in the export catalog)
+    copy_path = sql_retriever.get_sql_data("SELECT path FROM _parquet_exports", db_path)['path'][0]
+    sql_retriever.duckdb.sql(
+        f"COPY (SELECT 2 AS id, 'b' AS category, 20 AS amount) TO '{copy_path}' (FORMAT PARQUET)"
+    )
+    query = "SELECT id FROM sales"
+
+    assert sql_retriever.get_sql_data(query, db_path, parquet_dir=parquet_dir)['id'].tolist() == [2]
+    assert sql_retriever.get_sql_data(query, db_path)['id'].tolist() == [1]
+    assert sql_retriever.get_sql_data(query, db_path, use_cache=False)['id'].tolist() == [1]
+    assert sql_retriever.get_sql_data(query, db_path, parquet_dir=parquet_dir)['id'].tolist() == [2]
+
+
+@pytest.mark.parametrize('query', [
+    "SELECT id FROM sales ORDER BY id -- newest last",
+    "SELECT id FROM sales ORDER BY id;  -- with a semicolon",
+    "WITH s AS (SELECT id FROM sales) SELECT id FROM s ORDER BY id",
+])
+def test_sql_page_wraps_queries_with_comments(tmp_path, loaded_db, query):
+    write_csv(tmp_path / 'data' / 'sales.csv', [(i, 'a', i) for i in range(5)])
+    db_path = loaded_db()
+
+    page = sql_retriever.get_sql_page(query, page_size=2, db_path=db_path)
+    assert page['status'] == 'ok', page['error']
+    assert page['rows']['id'].tolist() == [0, 1]
+    assert (page['total_rows'], page['total_is_estimate']) == (5, False)
+
+    last = sql_retriever.get_sql_page(query, page_token=page['next_page_token'], page_size=2, db_path=db_path)
+    last = sql_retriever.get_sql_page(query, page_token=last['next_page_token'], page_size=2, db_path=db_path)
+    assert last['rows']['id'].tolist() == [4] and last['next_page_token'] is None
+
+
+def test_sql_page_skips_the_count_on_the_last_page(tmp_path, loaded_db, monkeypatch):
+    write_csv(tmp_path / 'data' / 'sales.csv', [(i, 'a', i) for i in range(3)])
+    db_path = loaded_db()
+    counts = []
+    count_rows = sql_retriever._count_rows
+    monkeypatch.setattr(sql_retriever, '_count_rows', lambda *args: counts.append(1) or count_rows(*args))
+
+    page = sql_retriever.get_sql_page("SELECT id FROM sales ORDER BY id", page_size=5, db_path=db_path)
+    assert page['rows']['id'].tolist() == [0, 1, 2]
+    assert (page['total_rows'], page['total_is_estimate'], page['next_page_token']) == (3, False, None)
+    assert counts == []
+
+    page = sql_retriever.get_sql_page("SELECT id FROM sales ORDER BY id", page_size=2, db_path=db_path)
+    assert (page['total_rows'], page['total_is_estimate']) == (3, False) and counts == [1]
+
+
+def test_sql_page_handles_pragma_and_other_statements(tmp_path, loaded_db):
+    write_csv(tmp_path / 'data' / 'sales.csv', [(1, 'a', 10)])
+    db_path = loaded_db()
+
+    tables = sql_retriever.get_sql_page("PRAGMA show_tables", page_size=2, db_path=db_path)
+    assert tables['status'] == 'ok', tables['error']
+    assert tables['rows']['name'].tolist() == ['_ingest_manifest', '_table_stats']
+    assert tables['total_rows'] == 3 and tables['next_page_token'] is not None
+
+    explained = sql_retriever.get_sql_page("EXPLAIN SELECT * FROM sales", page_size=2, db_path=db_path)
+    assert explained['status'] == 'ok', explained['error']
+    assert explained['next_page_token'] is None and explained['total_rows'] == len(explained['rows'])
+
+
+SALES_SUMMARY = {
+    'name': 'sales_by_region', 'source': 'sales', 'group_by': {'region', 'category'},
+    'measures': {'sum(amount)', 'count(amount)', 'count(*)', 'max(amount)'}, 'summary_rows': 4,
+    'columns': {'id', 'region', 'category', 'amount', 'year', 'date'}
+}
+
+
+@pytest.mark.parametrize('query,expected', [
+    ("SELECT region, sum(amount) FROM sales GROUP BY region",
+     'SELECT region, sum("sum_amount") AS "sum(amount)" FROM "sales_by_region" GROUP BY region'),
+    ("SELECT region, avg(amount) AS mean FROM sales WHERE category = 'a' GROUP BY region ORDER BY region",
+     'SELECT region, (sum("sum_amount") / sum("count_amount"))::DOUBLE AS mean FROM "sales_by_region" '
+     "WHERE category = 'a' GROUP BY region ORDER BY region"),
+    ("select region, count(*) from sales group by region having count(*) > 1",
+     'SELECT region, sum("count_star")::BIGINT AS "count_star()" FROM "sales_by_region" GROUP BY region '
+     'having sum("count_star")::BIGINT > 1'),
+    # Literals are not mistaken for filter columns
+    ("SELECT region, max(amount) FROM sales WHERE region = 'id > 3' GROUP BY region",
+     'SELECT region, max("max_amount") AS "max(amount)" FROM "sales_by_region" WHERE region = \'id > 3\' GROUP BY region'),
+    # Comments are dropped before matching, so they cannot swallow the rewritten GROUP BY
+    ("SELECT region, sum(amount) FROM sales WHERE category = 'a' -- and region\nGROUP BY region /* per region */",
+     'SELECT region, sum("sum_amount") AS "sum(amount)" FROM "sales_by_region" WHERE category = \'a\' GROUP BY region'),
+])
+def test_rewrite_aggregate_query_matches(query, expected):
+    assert sql_retriever.rewrite_aggregate_query(query, [SALES_SUMMARY]) == (expected, 'sales_by_region')
+
+
+@pytest.mark.parametrize('query', [
+    "SELECT region, sum(amount) FROM sales WHERE id > 3 GROUP BY region",
+    "SELECT region, count(DISTINCT amount) FROM sales GROUP BY region",
+    "SELECT DISTINCT region, sum(amount) FROM sales GROUP BY region",
+    "SELECT region, sum(amount) FROM (SELECT * FROM sales) GROUP BY region",
+    "SELECT region, sum(amount) FROM sales WHERE region IN (SELECT 'a') GROUP BY region",
+    "SELECT region, sum(amount) FROM sales s GROUP BY region",
+    "SELECT region, sum(amount) FROM sales JOIN returns USING (id) GROUP BY region",
+    "SELECT upper(region), sum(amount) FROM sales GROUP BY region",
+    "SELECT region, sum(amount * 2) AS doubled FROM sales GROUP BY region",
+    "SELECT region, min(amount) FROM sales GROUP BY region",
+    "SELECT id, sum(amount) FROM sales GROUP BY id",
+    "SELECT region, sum(amount) FROM orders GROUP BY region",
+    # Source columns named like keywords are filter columns
+    "SELECT region, sum(amount) FROM sales WHERE year = 2021 GROUP BY region",
+    "SELECT region, sum(amount) FROM sales WHERE date >= DATE '2021-01-01' GROUP BY region",
+    # A comment does not hide a filter on a column the summary lacks
+    "SELECT region, sum(amount) FROM sales WHERE category = 'a'\n-- and region\nAND id > 3 GROUP BY region",
+])
+def test_rewrite_aggregate_query_rejects(query):
+    assert sql_retriever.rewrite_aggregate_query(query, [SALES_SUMMARY]) == (None, None)
+
+
+def test_incrementally_refreshed_summary_matches_source(tmp_path, loaded_db, capsys):
+    config = {
+        'tables': {'sales': {'load_mode': 'append'}},
+        'aggregates': {'sales_by_region': {
+            'source': 'sales', 'group_by': ['region', 'category'],
+            'measures': ['sum(amount)', 'count(*)', 'count(amount)', 'max(amount)']
+        }}
+    }
+    sales_csv = tmp_path / 'data' / 'sales.csv'
+    with open(sales_csv, 'w', encoding='utf-8') as f:
+        f.write('id,region,category,amount\n')
+        f.writelines(f"{i},{'nesw'[i % 4]},{'ab'[i % 2]},{i % 7}\n" for i in range(100))
+    loaded_db(config)
+    with open(sales_csv, 'a', encoding='utf-8') as f:
+        f.writelines(f"{i},{'nesw'[i % 4]},{'abc'[i % 3]},{i % 5}\n" for i in range(100, 160))
+    db_path = loaded_db(config)
+    assert 'Refreshed aggregate sales_by_region incrementally' in capsys.readouterr().out
+
+    query = ("SELECT region, category, sum(amount) AS total, count(*) AS n, avg(amount) AS mean, max(amount) AS top "
+             "FROM sales WHERE category <> 'c' GROUP BY region, category ORDER BY region, category")
+    from_summary = sql_retriever.get_sql_data(query, db_path, use_cache=False)
+    assert 'Answering SQL query from summary table sales_by_region' in capsys.readouterr().out
+    from_source = sql_retriever.get_sql_data(query, db_path, use_cache=False, use_aggregates=False)
+    assert from_summary.to_dict('records') == from_source.to_dict('records')
+
+
+def test_aggregate_rewrite_keeps_keyword_columns_and_falls_back(tmp_path, loaded_db, monkeypatch, capsys):
+    config = {'aggregates': {'sales_by_region': {
+        'source': 'sales', 'group_by': ['region'], 'measures': ['sum(amount)', 'count(*)']
+    }}}
+    with open(tmp_path / 'data' / 'sales.csv', 'w', encoding='utf-8') as f:
+        f.write('region,year,amount\n')
+        f.writelines(f"{'nesw'[i % 4]},{2020 + i % 3},{i}\n" for i in range(60))
+    db_path = loaded_db(config)
+
+    for query in [
+        "SELECT region, sum(amount) AS total FROM sales WHERE year = 2021 GROUP BY region ORDER BY region",
+        "SELECT region, sum(amount) AS total FROM sales\n-- all years\nGROUP BY region ORDER BY region",
+    ]:
+        result = sql_retriever.execute_sql(query, db_path, use_cache=False)
+        assert result['status'] == 'ok', result['error']
+        expected = sql_retriever.get_sql_data(query, db_path, use_cache=False, use_aggregates=False)
+        assert result['data'].to_dict('records') == expected.to_dict('records')
+
+    # A rewrite that does not bind is dropped in favour of the original query
+    monkeypatch.setattr(sql_retriever, 'rewrite_aggregate_query', lambda *_: ("SELECT missing FROM sales_by_region", 'sales_by_region'))
+    capsys.readouterr()
+    result = sql_retriever.execute_sql("SELECT region, count(*) AS n FROM sales GROUP BY region", db_path, use_cache=False)
+    assert result['status'] == 'ok' and result['data']['n'].sum() == 60
+    assert 'does not bind' in capsys.readouterr().out
+
+
+def test_aggregate_catalog_and_rewrite_are_skipped_when_not_needed(tmp_path, loaded_db, monkeypatch, capsys):
+    config = {'aggregates': {'sales_by_category': {'source': 'sales', 'group_by': ['category'], 'measures': ['count(*)']}}}
+    write_csv(tmp_path / 'data' / 'sales.csv', [(i, 'ab'[i % 2], i) for i in range(20)])
+    db_path = loaded_db(config)
+    catalog_loads, rewrites = [], []
+    load_catalog, rewrite = sql_retriever._load_aggregate_catalog, sql_retriever.rewrite_aggregate_query
+    monkeypatch.setattr(sql_retriever, '_load_aggregate_catalog', lambda state: catalog_loads.append(1) or load_catalog(state))
+    monkeypatch.setattr(sql_retriever, 'rewrite_aggregate_query', lambda *args: rewrites.append(1) or rewrite(*args))
+
+    # A query that is not a GROUP BY query never loads the catalog
+    sql_retriever.get_sql_data("SELECT id FROM sales WHERE category = 'a'", db_path)
+    assert catalog_loads == []
+
+    # A cache hit does not rewrite the query again
+    query = "SELECT category, count(*) AS n FROM sales GROUP BY category ORDER BY category"
+    sql_retriever.get_sql_data(query, db_path)
+    assert 'Answering SQL query from summary table sales_by_category' in capsys.readouterr().out
+    sql_retriever.get_sql_data(query, db_path)
+    assert 'Served SQL query from cache' in capsys.readouterr().out
+    assert rewrites == [1]
+
+
+def cached_query(query, db_path, capsys, **kwargs):
+    """Runs a query through the result cache and returns (ids, whether it was served from the cache)."""
+    capsys.readouterr()
+    result = sql_retriever.get_sql_data(query, db_path, **kwargs)
+    return result['id'].tolist(), 'Served SQL query from cache' in capsys.readouterr().out
+
+
+@pytest.mark.parametrize('publish', [True, False])
+def test_result_cache_is_invalidated_by_reloads(tmp_path, loaded_db, capsys, publish):
+    sales_csv = tmp_path / 'data' / 'sales.csv'
+    write_csv(sales_csv, [(1, 'a', 10)])
+    db_path = loaded_db(publish=publish)
+    query = "SELECT id FROM sales ORDER BY id"
+    assert cached_query(query, db_path, capsys) == ([1], False)
+    assert cached_query(query, db_path, capsys) == ([1], True)
+
+    write_csv(sales_csv, [(1, 'a', 10), (2, 'b', 20)])
+    if not publish:
+        # Writing in place needs this process's read handle released
+        sql_retriever.close_connections()
+    loaded_db(publish=publish)
+    assert cached_query(query, db_path, capsys) == ([1, 2], False)
+    assert cached_query(query, db_path, capsys) == ([1, 2], True)
+
+
+def test_result_cache_keys_on_parquet_copies(tmp_path, loaded_db, capsys):
+    write_csv(tmp_path / 'data' / 'sales.csv', [(1, 'a', 10)])
+    parquet_dir = str(tmp_path / 'parquet')
+    db_path = loaded_db(parquet_dir=parquet_dir)
+    query = "SELECT id FROM sales"
+    assert cached_query(query, db_path, capsys, parquet_dir=parquet_dir) == ([1], False)
+    assert cached_query(query, db_path, capsys, parquet_dir=parquet_dir) == ([1], True)
+
+    # Rewriting the copy in place (still current in the catalog) changes the key
+    copy_path = sql_retriever.get_sql_data("SELECT path FROM _parquet_exports", db_path)['path'][0]
+    sql_retriever.duckdb.sql(f"COPY (SELECT 3 AS id, 'c' AS category, 30 AS amount) TO '{copy_path}' (FORMAT PARQUET)")
+    assert cached_query(query, db_path, capsys, parquet_dir=parquet_dir) == ([3], False)
+    # Without parquet_dir the table is read under its own key
+    assert cached_query(query, db_path, capsys) == ([1], False)
+
+
+def test_result_cache_keys_on_external_view_files(tmp_path, loaded_db, capsys):
+    write_csv(tmp_path / 'data' / 'sales.csv', [(1, 'a', 10)])
+    db_path = loaded_db()
+    archive = tmp_path / 'archive'
+    archive.mkdir()
+    write_csv(archive / 'part1.csv', [(5, 'x', 1)])
+    sql_retriever.register_external_view('archived', str(archive / '*.csv'))
+    try:
+        query = "SELECT id FROM archived ORDER BY id"
+        assert cached_query(query, db_path, capsys) == ([5], False)
+        assert cached_query(query, db_path, capsys) == ([5], True)
+
+        write_csv(archive / 'part2.csv', [(6, 'y', 2)])
+        assert cached_query(query, db_path, capsys) == ([5, 6], False)
+        # Queries that do not read the view keep their entries when its files change
+        assert cached_query("SELECT id FROM sales", db_path, capsys) == ([1], False)
+        write_csv(archive / 'part1.csv', [(7, 'z', 3)])
+        assert cached_query("SELECT id FROM sales", db_path, capsys) == ([1], True)
+        assert cached_query(query, db_path, capsys) == ([6, 7], False)
+    finally:
+        sql_retriever.unregister_external_view('archived')
+
+
+@pytest.mark.parametrize('query,cacheable', [
+    ("SELECT id FROM sales", True),
+    ("WITH s AS (SELECT 1) SELECT * FROM s", True),
+    ("DESCRIBE sales", True),
+    ("SELECT 'now' AS word, 'random()' AS call", True),
+    ("SELECT random()", False),
+    ("SELECT now()", False),
+    ("SELECT current_date", False),
+    ("SELECT uuid()", False),
+    ("SELECT * FROM read_csv('x.csv')", False),
+    ("SELECT * FROM glob('*.csv')", False),
+    ("INSERT INTO sales VALUES (1, 'a', 1)", False),
+    ("SET threads = 4", False),
+    ("PRAGMA show_tables", False),
+])
+def test_is_cacheable(query, cacheable):
+    assert sql_retriever._is_cacheable(sql_retriever.normalize_sql(query)) is cacheable
+
+
+def test_result_cache_evicts_least_recently_used_within_budget():
+    frames = {name: pd.DataFrame({'id': range(100)}) for name in 'abcd'}
+    size = int(frames['a'].memory_usage(index=True, deep=True).sum())
+    cache = sql_retriever.QueryResultCache(max_bytes=size * 3)
+    for name in 'abc':
+        cache.put(name, frames[name])
+    assert cache.get('a') is not None
+
+    cache.put('d', frames['d'])
+
+    assert cache.get('b') is None
+    assert all(cache.get(name) is not None for name in 'acd')
+    assert cache.stats()['bytes'] == size * 3 and cache.stats()['evictions'] == 1
+    # Results larger than the whole budget are never stored
+    cache.put('big', pd.DataFrame({'id': range(1000)}))
+    assert cache.get('big') is None and cache.stats()['entries'] == 3
+    # Callers get copies, so modifying a result does not change the cache
+    result = cache.get('a')
+    result.loc[0, 'id'] = -1
+    assert cache.get('a')['id'][0] == 0
+
+
+def test_result_cache_key_ignores_commented_out_sql(tmp_path, loaded_db, capsys):
+    write_csv(tmp_path / 'data' / 'sales.csv', [(i, 'a', i) for i in range(5)])
+    db_path = loaded_db()
+
+    assert cached_query("SELECT id FROM sales ORDER BY id -- first only\nLIMIT 1", db_path, capsys) == ([0], False)
+    assert cached_query("SELECT id FROM sales ORDER BY id -- first only LIMIT 1", db_path, capsys) == ([0, 1, 2, 3, 4], False)
+    assert cached_query("SELECT id FROM sales ORDER BY id /* all */ LIMIT 1", db_path, capsys) == ([0], True)
@@ -0,0 +1,311 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+import duckdb
+import pytest
+
+from src.ingest import structured_loader
+
+
+def write_csv(path, rows, mode='w'):
+    with open(path, mode, encoding='utf-8') as f:
+        if mode == 'w':
+            f.write('id,value\n')
+        f.writelines(f"{row_id},{value}\n" for row_id, value in rows)
+
+
+def run_load(tmp_path, tables=None, **kwargs):
+    config_path = tmp_path / 'table_config.json'
+    config_path.write_text(json.dumps({'tables': tables or {}}))
+    return structured_loader.load_structured_data(
+        data_dir=str(tmp_path / 'data'), db_path=str(tmp_path / 'db.duckdb'), config_path=str(config_path), **kwargs
+    )
+
+
+def failing_batches(fail_at, crash=False):
+    """Wraps the chunked batch reader so the load fails (or the process dies) before batch fail_at."""
+    read_batches = structured_loader._iter_csv_batches
+
+    def iter_batches(*args, **kwargs):
+        for i, batch in enumerate(read_batches(*args, **kwargs)):
+            if i == fail_at:
+                if crash:
+                    os._exit(1)
+                raise RuntimeError("simulated failure")
+            yield batch
+    return iter_batches
+
+
+def query(tmp_path, sql):
+    con = duckdb.connect(str(tmp_path / 'db.duckdb'), read_only=True)
+    try:
+        return con.execute(sql).fetchall()
+    finally:
+        con.close()
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    (tmp_path / 'data').mkdir()
+    return tmp_path / 'data'
+
+
+@pytest.mark.parametrize('mode,workers', [('native', 1), ('pandas', 1), ('chunked', 1), ('native', 2)])
+def test_keyless_append_inserts_only_new_rows(tmp_path, data_dir, mode, workers):
+    tables = {'events': {'load_mode': 'append'}, 'other': {'load_mode': 'append'}}
+    write_csv(data_dir / 'events.csv', [(i, f"v{i}") for i in range(1000)])
+    write_csv(data_dir / 'other.csv', [(i, 'x') for i in range(10)])
+    run_load(tmp_path, tables, mode=mode, workers=workers, batch_size=300)
+
+    write_csv(data_dir / 'events.csv', [(i, f"v{i}") for i in range(1000, 1100)], mode='a')
+    write_csv(data_dir / 'other.csv', [(10, 'x')], mode='a')
+    report = run_load(tmp_path, tables, mode=mode, workers=workers, batch_size=300)
+
+    assert {entry['table_name']: entry['rows'] for entry in report} == {'events': 100, 'other': 1}
+    assert query(tmp_path, "SELECT count(*), count(DISTINCT id), max(id) FROM events") == [(1100, 1100, 1099)]
+    assert query(tmp_path, "SELECT count(*) FROM other") == [(11,)]
+
+
+def test_keyless_append_reloads_file_changed_before_its_end(tmp_path, data_dir):
+    tables = {'events': {'load_mode': 'append'}}
+    write_csv(data_dir / 'events.csv', [(i, 'old') for i in range(100)])
+    run_load(tmp_path, tables)
+
+    # Same prefix length, different content, plus new rows: positions no longer identify new rows
+    write_csv(data_dir / 'events.csv', [(i, 'new') for i in range(120)])
+    run_load(tmp_path, tables)
+
+    assert query(tmp_path, "SELECT count(*), count(DISTINCT id), min(value), max(value) FROM events") == [(120, 120, 'new', 'new')]
+
+
+def test_keyed_append_skips_existing_keys(tmp_path, data_dir):
+    tables = {'events': {'load_mode': 'append', 'key': ['id']}}
+    write_csv(data_dir / 'events.csv', [(i, 'first') for i in range(50)])
+    run_load(tmp_path, tables)
+
+    write_csv(data_dir / 'events.csv', [(i, 'second') for i in range(80)])
+    report = run_load(tmp_path, tables)
+
+    assert report[0]['rows'] == 30
+    assert query(tmp_path, "SELECT value, count(*) FROM events GROUP BY value ORDER BY value") == [('first', 50), ('second', 30)]
+
+
+@pytest.mark.parametrize('mode', ['native', 'chunked'])
+def test_upsert_merges_changed_and_new_rows(tmp_path, data_dir, mode):
+    tables = {'accounts': {'load_mode': 'upsert', 'key': ['id']}}
+    write_csv(data_dir / 'accounts.csv', [(i, 'a') for i in range(100)])
+    run_load(tmp_path, tables, mode=mode, batch_size=40)
+
+    # Rows 0-9 change, 10-99 stay the same, 100-104 are new
+    write_csv(data_dir / 'accounts.csv', [(i, 'b' if i < 10 else 'a') for i in range(105)])
+    report = run_load(tmp_path, tables, mode=mode, batch_size=40)
+
+    assert report[0]['rows'] == 15
+    assert query(tmp_path, "SELECT count(*), count(DISTINCT id) FROM accounts") == [(105, 105)]
+    assert query(tmp_path, "SELECT value, count(*) FROM accounts GROUP BY value ORDER BY value") == [('a', 95), ('b', 10)]
+
+
+def test_unchanged_files_are_not_reloaded(tmp_path, data_dir):
+    write_csv(data_dir / 'events.csv', [(i, 'v') for i in range(10)])
+    run_load(tmp_path)
+
+    assert run_load(tmp_path) == []
+    assert not (tmp_path / 'db.duckdb.staging').exists()
+
+
+CRASHING_LOAD = """
+import sys
+sys.path.insert(0, {repo!r})
+from src.ingest import structured_loader
+from tests.test_structured_loader import failing_batches
+structured_loader._iter_csv_batches = failing_batches(2, crash=True)
+structured_loader.load_structured_data(
+    data_dir={data_dir!r}, db_path={db_path!r}, mode='chunked', batch_size=10000, config_path={config_path!r}
+)
+"""
+
+
+def test_chunked_load_resumes_after_crash(tmp_path, data_dir, capsys):
+    write_csv(data_dir / 'events.csv', [(i, 'v') for i in range(50000)])
+    repo = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+    script = CRASHING_LOAD.format(
+        repo=repo, data_dir=str(data_dir), db_path=str(tmp_path / 'db.duckdb'), config_path=str(tmp_path / 'none.json')
+    )
+    crashed = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True)
+    assert crashed.returncode == 1, crashed.stderr
+    assert not (tmp_path / 'db.duckdb').exists()
+
+    report = run_load(tmp_path, mode='chunked', batch_size=10000)
+
+    assert 'Resuming' in capsys.readouterr().out
+    assert report[0]['rows'] == 30000
+    assert query(tmp_path, "SELECT count(*), count(DISTINCT id) FROM events") == [(50000, 50000)]
+    assert not (tmp_path / 'db.duckdb.staging').exists()
+
+
+def test_failed_chunked_load_is_discarded_and_the_rest_published(tmp_path, data_dir, monkeypatch, capsys):
+    write_csv(data_dir / 'events.csv', [(i, 'old') for i in range(100)])
+    run_load(tmp_path, mode='chunked', batch_size=30)
+
+    write_csv(data_dir / 'events.csv', [(i, 'new') for i in range(200)])
+    write_csv(data_dir / 'other.csv', [(i, 'x') for i in range(5)])
+    with monkeypatch.context() as patched:
+        patched.setattr(structured_loader, '_iter_csv_batches', failing_batches(3))
+        report = run_load(tmp_path, mode='chunked', batch_size=30)
+        assert {entry['table_name']: entry['status'] for entry in report} == {'events': 'error', 'other': 'loaded'}
+        # Failing the same way again does not hold back the snapshot either
+        write_csv(data_dir / 'other.csv', [(i, 'x') for i in range(6)])
+        run_load(tmp_path, mode='chunked', batch_size=30)
+
+    # The committed batches are undone and the other table's update is published
+    assert query(tmp_path, "SELECT count(*), max(value) FROM events") == [(100, 'old')]
+    assert query(tmp_path, "SELECT count(*) FROM other") == [(6,)]
+    assert query(tmp_path, "SELECT count(*) FROM _ingest_progress") == [(0,)]
+    assert not (tmp_path / 'db.duckdb.staging').exists()
+    capsys.readouterr()
+
+    report = run_load(tmp_path, mode='chunked', batch_size=30)
+
+    assert 'Resuming' not in capsys.readouterr().out
+    assert report[0]['rows'] == 200
+    assert query(tmp_path, "SELECT count(*), count(DISTINCT id), min(value) FROM events") == [(200, 200, 'new')]
+
+
+def test_failed_chunked_load_of_a_new_table_is_left_out(tmp_path, data_dir, monkeypatch):
+    write_csv(data_dir / 'events.csv', [(i, 'v') for i in range(100)])
+    with monkeypatch.context() as patched:
+        patched.setattr(structured_loader, '_iter_csv_batches', failing_batches(2))
+        run_load(tmp_path, mode='chunked', batch_size=30)
+
+    assert query(tmp_path, "SELECT count(*) FROM duckdb_tables() WHERE table_name = 'events'") == [(0,)]
+    assert not (tmp_path / 'db.duckdb.staging').exists()
+
+
+def test_partitioned_view_resolves_from_any_working_directory(tmp_path, data_dir, monkeypatch):
+    for region in ('eu', 'us'):
+        (data_dir / 'sales' / f"region={region}").mkdir(parents=True)
+        write_csv(data_dir / 'sales' / f"region={region}" / 'part.csv', [(1, region), (2, region)])
+    config_path = tmp_path / 'table_config.json'
+    config_path.write_text(json.dumps({'tables': {}}))
+    monkeypatch.chdir(tmp_path)
+    structured_loader.load_structured_data(data_dir='data', db_path='db.duckdb', config_path=str(config_path))
+
+    monkeypatch.chdir(data_dir)
+    assert query(tmp_path, "SELECT region, count(*) FROM sales GROUP BY region ORDER BY region") == [('eu', 2), ('us', 2)]
+
+
+def test_approx_distinct_never_exceeds_the_non_null_count(tmp_path, data_dir):
+    write_csv(data_dir / 'events.csv', [(i, f"v{i}") for i in range(1000)])
+    run_load(tmp_path)
+
+    assert query(tmp_path, "SELECT approx_distinct FROM _table_stats WHERE column_name = 'id'") == [(1000,)]
+
+
+def test_parquet_copies_follow_reloads(tmp_path, data_dir):
+    from src.retrievers import sql_retriever
+    parquet_dir = str(tmp_path / 'parquet')
+    db_path = str(tmp_path / 'db.duckdb')
+    write_csv(data_dir / 'events.csv', [(i, 'a') for i in range(10)])
+    run_load(tmp_path)
+
+    # Turning parquet_dir on exports tables that were loaded earlier
+    run_load(tmp_path, parquet_dir=parquet_dir)
+    (first_copy,) = query(tmp_path, "SELECT path FROM _parquet_exports")[0]
+    assert os.path.dirname(first_copy) == os.path.abspath(parquet_dir) and os.path.exists(first_copy)
+
+    # A reload without parquet_dir leaves the copy stale, so queries read the table
+    write_csv(data_dir / 'events.csv', [(10, 'b')], mode='a')
+    run_load(tmp_path)
+    count = "SELECT count(*) AS c FROM events"
+    assert sql_retriever.get_sql_data(count, db_path, parquet_dir=parquet_dir, use_cache=False)['c'][0] == 11
+    assert query(tmp_path, "SELECT table_name FROM _parquet_exports") == [('events',)]
+
+    run_load(tmp_path, parquet_dir=parquet_dir)
+    (second_copy,) = query(tmp_path, "SELECT path FROM _parquet_exports")[0]
+    assert duckdb.sql(f"SELECT count(*) FROM '{second_copy}'").fetchall() == [(11,)]
+    # The superseded copy is removed once the new snapshot is published
+    assert os.listdir(parquet_dir) == [os.path.basename(second_copy)]
+    sql_retriever.close_connections()
+
+
+def test_parquet_exports_of_an_unpublished_load_do_not_reach_readers(tmp_path, data_dir, monkeypatch):
+    from src.retrievers import sql_retriever
+    parquet_dir = str(tmp_path / 'parquet')
+    db_path = str(tmp_path / 'db.duckdb')
+    write_csv(data_dir / 'other.csv', [(i, 'old') for i in range(10)])
+    run_load(tmp_path, parquet_dir=parquet_dir)
+
+    # other is reloaded and exported, but the load never gets published
+    write_csv(data_dir / 'other.csv', [(i, 'new') for i in range(20)])
+    with monkeypatch.context() as patched:
+        def fail_publish(staging, db_path):
+            raise RuntimeError("simulated failure")
+        patched.setattr(structured_loader, 'publish_snapshot', fail_publish)
+        with pytest.raises(RuntimeError):
+            run_load(tmp_path, parquet_dir=parquet_dir)
+    assert len(os.listdir(parquet_dir)) == 2
+
+    other = "SELECT count(*) AS c, max(value) AS v FROM other"
+    result = sql_retriever.get_sql_data(other, db_path, parquet_dir=parquet_dir, use_cache=False)
+    assert result.to_dict('records') == [{'c': 10, 'v': 'old'}]
+
+    run_load(tmp_path, parquet_dir=parquet_dir)
+    result = sql_retriever.get_sql_data(other, db_path, parquet_dir=parquet_dir, use_cache=False)
+    assert result.to_dict('records') == [{'c': 20, 'v': 'new'}]
+    assert len(os.listdir(parquet_dir)) == 1
+    sql_retriever.close_connections()
+
+
+def test_loads_publish_a_staged_snapshot_by_default(tmp_path, data_dir, capsys):
+    write_csv(data_dir / 'events.csv', [(i, 'v') for i in range(10)])
+    run_load(tmp_path)
+    write_csv(data_dir / 'events.csv', [(10, 'v')], mode='a')
+    run_load(tmp_path)
+
+    out = capsys.readouterr().out
+    assert out.count('Published new snapshot') == 2 and 'in place' not in out
+    assert query(tmp_path, "SELECT count(*) FROM events") == [(11,)]
+    assert not (tmp_path / 'db.duckdb.staging').exists()
+
+
+def test_sources_mapping_to_one_table_are_reported_not_loaded(tmp_path, data_dir):
+    import gzip
+    write_csv(data_dir / 'x.csv', [(1, 'plain')])
+    write_csv(data_dir / 'z.csv', [(1, 'z')])
+    run_load(tmp_path)
+
+    with gzip.open(data_dir / 'x.csv.gz', 'wt', encoding='utf-8') as f:
+        f.write('id,value\n1,gzip\n2,gzip\n')
+    os.makedirs(data_dir / 'z' / 'part=1')
+    write_csv(data_dir / 'z' / 'part=1' / 'a.csv', [(2, 'z')])
+    report = run_load(tmp_path)
+    assert sorted((entry['file'], entry['status']) for entry in report) == [
+        (str(data_dir / name), 'error') for name in ('x.csv', 'x.csv.gz', 'z', 'z.csv')
+    ]
+    assert query(tmp_path, "SELECT value FROM x") == [('plain',)]
+    shutil.rmtree(data_dir / 'z')
+
+    # Once only one source maps to x, the table is kept and rebuilt from that source
+    os.remove(data_dir / 'x.csv')
+    report = run_load(tmp_path)
+    assert [(entry['table_name'], entry['status']) for entry in report] == [('x', 'loaded')]
+    assert query(tmp_path, "SELECT count(*), min(value) FROM x") == [(2, 'gzip')]
+    assert run_load(tmp_path) == []
+    assert query(tmp_path, "SELECT DISTINCT table_name FROM _table_stats ORDER BY 1") == [('x',), ('z',)]
+
+
+def test_auto_publish_stages_while_this_process_reads_the_database(tmp_path, data_dir, capsys):
+    write_csv(data_dir / 'events.csv', [(i, 'v') for i in range(10)])
+    run_load(tmp_path)
+    reader = duckdb.connect(str(tmp_path / 'db.duckdb'), read_only=True)
+    try:
+        write_csv(data_dir / 'events.csv', [(10, 'v')], mode='a')
+        capsys.readouterr()
+        run_load(tmp_path, publish='auto')
+        assert 'is in use; staging the load' in capsys.readouterr().out
+    finally:
+        reader.close()
+    assert query(tmp_path, "SELECT count(*) FROM events") == [(11,)]
@@ -1,7 +1,10 @@
 import streamlit as st
 import sys
 import os
+import time
+import uuid
 import torch
+from concurrent.futures import ThreadPoolExecutor
 
 # Patch PyTorch path handling
 torch.classes.__path__ = []
@@ -16,6 +19,8 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 's
 
 # Import the agent, feedback logger, metrics functions, and security modules
 from src.agents.multi_tool_agent import run_agent
+from src.retrievers import sql_retriever
+from src.tools import result_formatter
 from feedback.logger import log_feedback
 from dashboards.metrics import load_feedback_data, get_query_count, get_feedback_counts
 from security.pii_filter import filter_pii
@@ -53,6 +58,13 @@ if feedback_counts:
 else:
     st.sidebar.write("No feedback yet.")
 
+st.sidebar.markdown("---")
+st.sidebar.header("Query Settings")
+# SQL queries running longer than this are stopped so a runaway query cannot hang the app
+sql_timeout = st.sidebar.number_input(
+    "SQL timeout (seconds)", min_value=1.0, value=float(sql_retriever.DEFAULT_QUERY_TIMEOUT), step=5.0
+)
+
 st.sidebar.markdown("---")
 st.sidebar.header("Filters (Coming Soon)")
 # Add filter options here later
@@ -71,6 +83,75 @@ if 'last_response' not in st.session_state:
     st.session_state.last_response = None
 if 'last_citations' not in st.session_state:
     st.session_state.last_citations = []
+if 'last_page_info' not in st.session_state:
+    st.session_state.last_page_info = None # Paging state of the last SQL answer
+if 'running_query' not in st.session_state:
+    st.session_state.running_query = None # The agent run in progress: its query id, future, query and page
+
+@st.cache_resource
+def get_agent_executor():
+    """Thread pool the agent runs on, shared by all script runs so a later run can still reach a running query."""
+    return ThreadPoolExecutor(max_workers=4)
+
+def filter_and_tag(agent_response):
+    """Applies the PII filter and appends compliance tags to an agent response."""
+    filtered_response = filter_pii(agent_response)
+    tags = tag_compliance(filtered_response)
+
+    # Convert tags list to a string for display
+    if tags:
+        return f"{filtered_response}\n\nCompliance Tags: {', '.join(tags)}"
+    return filtered_response
+
+def display_response(tagged_response):
+    """Shows an agent response, color-coded by its apparent outcome."""
+    st.subheader("Agent Response:")
+    # Simple attempt at highlighting or color-coding using markdown
+    # This would need more sophisticated logic based on agent output structure
+    if "Error" in tagged_response:
+        st.error(tagged_response)
+    elif "Success" in tagged_response or "Loaded" in tagged_response or "Neighbors" in tagged_response or "search results" in str(tagged_response).lower() or "Agent chose" in tagged_response:
+         # Check for indicators of successful retrieval/action
+         st.success(tagged_response)
+    else:
+        st.write(tagged_response)
+
+def start_agent(query, page=0):
+    """Starts the agent on a background thread under a fresh query id, so the Cancel button can stop its SQL query."""
+    if st.session_state.running_query:
+        # A new question replaces the one still running
+        sql_retriever.cancel_query(st.session_state.running_query['query_id'])
+    query_id = uuid.uuid4().hex
+    future = get_agent_executor().submit(
+        run_agent, query, page=page, return_page_info=True, query_id=query_id, timeout=sql_timeout
+    )
+    st.session_state.running_query = {'query_id': query_id, 'future': future, 'query': query, 'page': page, 'started': time.time()}
+
+def wait_for_agent():
+    """Waits for the running agent and returns its (response, page_info).
+
+    Streamlit can only stop a script run at one of its own calls, so the wait updates a status
+    line while it polls; a click on Cancel then interrupts the wait (not the agent) right away.
+    """
+    running = st.session_state.running_query
+    status = st.empty()
+    while not running['future'].done():
+        status.caption(f"Running '{running['query']}' ({time.time() - running['started']:.0f}s)...")
+        time.sleep(0.2)
+    status.empty()
+    st.session_state.running_query = None
+    return running['future'].result()
+
+def show_sql_page(page):
+    """Starts fetching another page of the last SQL answer and reruns the app to display it."""
+    start_agent(st.session_state.last_query, page=page)
+    st.rerun()
+
+# Clicking Cancel while a query runs starts a new script run; the agent keeps running on its thread
+# until its SQL query is cancelled, and the run below then shows the cancelled outcome
+if st.button("Cancel running query") and st.session_state.running_query:
+    if sql_retriever.cancel_query(st.session_state.running_query['query_id']):
+        st.warning("Cancelled the running SQL query.")
 
 # Run Agent button
 if st.button("Get Answer"):
@@ -85,38 +166,57 @@ if st.button("Get Answer"):
         # Modify the agent logic in src/agents/multi_tool_agent.py to use domain.
         # Also, the current multi_tool_agent doesn't return citations separately.
         # You would need to modify multi_tool_agent to return citations from the RAG tool.
-        agent_response = run_agent(query)
-        citations = [] # Placeholder - need to get citations from agent response if using RAG
-
-        # Apply PII filter and compliance tagging
-        filtered_response = filter_pii(agent_response)
-        tags = tag_compliance(filtered_response)
-
-        # Convert tags list to a string for display
-        if tags:
-            tagged_response = f"{filtered_response}\n\nCompliance Tags: {', '.join(tags)}"
-        else:
-            tagged_response = filtered_response
-
-        st.subheader("Agent Response:")
-        # Simple attempt at highlighting or color-coding using markdown
-        # This would need more sophisticated logic based on agent output structure
-        if "Error" in tagged_response:
-            st.error(tagged_response)
-        elif "Success" in tagged_response or "Loaded" in tagged_response or "Neighbors" in tagged_response or "search results" in str(tagged_response).lower() or "Agent chose" in tagged_response:
-             # Check for indicators of successful retrieval/action
-             st.success(tagged_response)
-        else:
-            st.write(tagged_response)
-
-        # Store the last query, response, and citations in session state
-        st.session_state.last_query = query
-        st.session_state.last_response = tagged_response
-        st.session_state.last_citations = citations # Store citations if available
+        # SQL answers only contain the first page of rows; page_info drives the paging buttons.
+        start_agent(query)
 
     else:
         st.warning("Please enter a query.")
 
+if st.session_state.running_query:
+    running_query = st.session_state.running_query['query']
+    agent_response, page_info = wait_for_agent()
+    citations = [] # Placeholder - need to get citations from agent response if using RAG
+
+    # Apply PII filter and compliance tagging
+    tagged_response = filter_and_tag(agent_response)
+    display_response(tagged_response)
+
+    # Store the last query, response, and citations in session state
+    st.session_state.last_query = running_query
+    st.session_state.last_response = tagged_response
+    st.session_state.last_citations = citations # Store citations if available
+    st.session_state.last_page_info = page_info
+elif st.session_state.last_response and st.session_state.last_page_info:
+    # Keep showing the current page of a SQL answer across reruns (e.g. after paging)
+    display_response(st.session_state.last_response)
+
+# Paging for SQL answers: only the rows on screen are ever fetched
+page_info = st.session_state.last_page_info
+if page_info and (page_info['has_prev'] or page_info['has_next']):
+    col_prev, col_next = st.columns(2)
+    with col_prev:
+        if st.button("◀ Previous page", disabled=not page_info['has_prev']):
+            show_sql_page(page_info['page'] - 1)
+    with col_next:
+        if st.button("Next page ▶", disabled=not page_info['has_next']):
+            show_sql_page(page_info['page'] + 1)
+
+# The answer text is a bounded preview; the full SQL result is fetched only on request, capped at
+# result_formatter.FULL_RESULT_MAX_ROWS rows so a huge result cannot freeze the app
+if page_info and page_info.get('result_handle') and st.button("Show full result"):
+    full_result = result_formatter.get_result(page_info['result_handle'])
+    if full_result is None:
+        st.warning("The full result is no longer available. Please run the query again.")
+    else:
+        st.dataframe(full_result)
+        capped = len(full_result) >= result_formatter.FULL_RESULT_MAX_ROWS
+        if page_info['total_rows'] > len(full_result) or (page_info['total_is_estimate'] and capped):
+            total = f"{'at least ' if page_info['total_is_estimate'] else ''}{page_info['total_rows']:,}"
+            st.caption(
+                f"Showing the first {len(full_result):,} of {total} rows. "
+                "Use the page buttons or a more selective query to see the rest."
+            )
+
 # Feedback buttons (Day 8 deliverable)
 if st.session_state.last_query and st.session_state.last_response:
     st.subheader("Provide Feedback:")
@@ -151,6 +251,6 @@ st.markdown("""
 **How to use:**
 Enter your query above. The agent will attempt to use the available data sources (Structured, Unstructured, Graph) to answer.
 
-*   Try queries like: `sql: SELECT * FROM sample_data_1;`, `vector search: tell me about the sample email`
+*   Try queries like: `sql: SELECT * FROM sample_data_1;`, `stats: sample_data_1`, `vector search: tell me about the sample email`
 *   For graph queries, try: `graph: neighbors of Person A`, `graph: add node City Z`, `graph: paths from Person A to Project Beta`, `graph: all nodes`, `graph: all edges`
 """) 
\ No newline at end of file